@@ -1,12 +1,22 @@
-import streamlit as st
-import pandas as pd
+import time
+import json
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
 import numpy as np
-from io import BytesIO
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.pagesizes import A4
+import pandas as pd
+import streamlit as st
 import altair as alt
-from datetime import datetime
+
+from auditoria import FONTES_REGRAS, COLUNAS_SUGESTOES
+from incremental import EstadoAuditoria, pasta_estado
+from historico import HistoricoNotas, COLUNAS_HISTORICO
+from ingestao import EXTENSOES_PLANILHA
+from tarefas import TarefaAnalise, AnaliseCancelada, FORA_DA_MEMORIA_DISPONIVEL
+from instrumentacao import Perfil, perfilar
+from relatorios import (
+    COLUNAS_PLANILHA, COLUNAS_COMPARACAO, preparar_relatorio, relatorio_pronto, obter_relatorio,
+)
 
 # -------------------------------------------------------------------------
 # CONFIGURAÇÃO
@@ -14,202 +24,30 @@ from datetime import datetime
 DEFAULT_ARQUIVO_A = "POSTO.xlsx"
 DEFAULT_ARQUIVO_B = "PMM.xlsx"
 
-EXPECTED_COLS = {
-    "data": ["data", "Data"],
-    "nota": ["numero_nota", "Numero_Nota", "nota"],
-    "tipo": ["tipo_combustivel", "Tipo_Combustivel", "combustivel", "Tipo"],
-    "valor": ["litragem", "Litragem", "litros", "Valor"],
-    "setor": ["setor", "Setor", "departamento", "secretaria"]
+# XLSX (uma aba ou uma por mês), CSV e Parquet passam pelo mesmo leitor (ingestao)
+TIPOS_ARQUIVO = [extensao.lstrip(".") for extensao in EXTENSOES_PLANILHA]
+
+# Análises simultâneas somando todas as sessões (as demais esperam na fila)
+ANALISES_SIMULTANEAS = 2
+LEITURAS_SIMULTANEAS = 2 * ANALISES_SIMULTANEAS
+
+# Tabelas de achados: só a página visível vai para o navegador
+LINHAS_POR_PAGINA = [50, 200, 1000]
+COLUNAS_TELA = {
+    "a": COLUNAS_PLANILHA,
+    "b": COLUNAS_PLANILHA,
+    "par": COLUNAS_COMPARACAO,
+    "sugestoes": COLUNAS_SUGESTOES,
+    "historico": COLUNAS_HISTORICO,
 }
 
-# -------------------------------------------------------------------------
-# FUNÇÕES AUXILIARES
-# -------------------------------------------------------------------------
-def guess_column(df, keys):
-    df_cols = {c.lower(): c for c in df.columns}
-    for key in keys:
-        if key.lower() in df_cols:
-            return df_cols[key.lower()]
-    for k in keys:
-        for c in df.columns:
-            if k.lower() in c.lower():
-                return c
-    return None
-
-def normalize_df(df):
-    df = df.copy()
-    new_cols = {}
-    for key, variations in EXPECTED_COLS.items():
-        found = guess_column(df, variations)
-        if found:
-            new_cols[found] = key.upper()
-    if new_cols:
-        df.rename(columns=new_cols, inplace=True)
-
-    for key in EXPECTED_COLS:
-        if key.upper() not in df.columns:
-            df[key.upper()] = np.nan
-
-    return df
-
-# -------------------------------------------------------------------------
-# FUNÇÃO PRINCIPAL DE ANÁLISE
-# -------------------------------------------------------------------------
-def analisar(df_a, df_b, setor):
-    df_a = normalize_df(df_a)
-    df_b = normalize_df(df_b)
-
-    if setor and setor != "Todos":
-        df_a = df_a[df_a["SETOR"].astype(str).str.upper() == setor.upper()]
-        df_b = df_b[df_b["SETOR"].astype(str).str.upper() == setor.upper()]
-
-    df_a["NOTA"] = df_a["NOTA"].astype(str).str.zfill(4)
-    df_b["NOTA"] = df_b["NOTA"].astype(str).str.zfill(4)
-
-    df_a["VALOR"] = pd.to_numeric(df_a["VALOR"], errors="coerce")
-    df_b["VALOR"] = pd.to_numeric(df_b["VALOR"], errors="coerce")
-
-    df_a["DATA_PARSED"] = pd.to_datetime(df_a["DATA"], errors="coerce")
-    df_b["DATA_PARSED"] = pd.to_datetime(df_b["DATA"], errors="coerce")
-
-    results = {}
-
-    # Divergências internas
-    results["duplicadas_a"] = df_a[df_a["NOTA"].duplicated(keep=False)]
-    results["duplicadas_b"] = df_b[df_b["NOTA"].duplicated(keep=False)]
-
-    results["negativos_a"] = df_a[df_a["VALOR"] < 0]
-    results["negativos_b"] = df_b[df_b["VALOR"] < 0]
-
-    def rep_day(df):
-        t = df.copy()
-        t["DATA_FMT"] = t["DATA_PARSED"].dt.strftime("%d/%m/%Y")
-        return t[t.duplicated(subset=["DATA_FMT", "NOTA", "VALOR"], keep=False)]
-
-    results["rep_mesmo_dia_a"] = rep_day(df_a)
-    results["rep_mesmo_dia_b"] = rep_day(df_b)
-
-    def many_days(df):
-        t = df.copy()
-        t["DATA_FMT"] = t["DATA_PARSED"].dt.strftime("%d/%m/%Y")
-        g = t.groupby("NOTA")["DATA_FMT"].nunique()
-        notas = g[g > 1].index
-        return t[t["NOTA"].isin(notas)]
-
-    results["nota_diff_a"] = many_days(df_a)
-    results["nota_diff_b"] = many_days(df_b)
-
-    # Comparação entre planilhas
-    merged = pd.merge(df_a, df_b, on="NOTA", suffixes=("_A", "_B"), how="outer")
-    results["merged"] = merged
-
-    results["notas_apenas_em_a"] = merged[merged["VALOR_B"].isnull()]
-    results["notas_apenas_em_b"] = merged[merged["VALOR_A"].isnull()]
-
-    merged["DATA_A_PARSED"] = pd.to_datetime(merged.get("DATA_PARSED_A"), errors="coerce")
-    merged["DATA_B_PARSED"] = pd.to_datetime(merged.get("DATA_PARSED_B"), errors="coerce")
-
-    results["datas_divergentes"] = merged[merged["DATA_A_PARSED"] != merged["DATA_B_PARSED"]]
-
-    results["tipos_divergentes"] = merged[
-        (merged["TIPO_A"].astype(str) != merged["TIPO_B"].astype(str))
-        & (~merged["TIPO_A"].isna() | ~merged["TIPO_B"].isna())
-    ]
-
-    results["valores_divergentes"] = merged[
-        ~(np.isclose(merged["VALOR_A"].fillna(-999999), merged["VALOR_B"].fillna(-888888)))
-    ]
-
-    # Totais por combustível
-    def sum_by_fuel(df, pats):
-        mask = pd.Series(False, index=df.index)
-        for p in pats:
-            mask = mask | df["TIPO"].astype(str).str.contains(p, case=False, na=False)
-        return df.loc[mask, "VALOR"].sum()
-
-    gasolina = ["GAS", "GASOLINA"]
-    diesel = ["DIE", "DIESEL"]
-
-    gas_a = sum_by_fuel(df_a, gasolina)
-    gas_b = sum_by_fuel(df_b, gasolina)
-    die_a = sum_by_fuel(df_a, diesel)
-    die_b = sum_by_fuel(df_b, diesel)
-
-    # Totais gerais
-    resumo = {
-        "Total Registros A": len(df_a),
-        "Total Registros B": len(df_b),
-        "Litros Totais A": df_a["VALOR"].sum(),
-        "Litros Totais B": df_b["VALOR"].sum(),
-        "Gasolina A": gas_a,
-        "Gasolina B": gas_b,
-        "Diesel A": die_a,
-        "Diesel B": die_b,
-        "Duplicadas A": len(results["duplicadas_a"]),
-        "Duplicadas B": len(results["duplicadas_b"]),
-        "Negativos A": len(results["negativos_a"]),
-        "Negativos B": len(results["negativos_b"]),
-        "Repetidas A": len(results["rep_mesmo_dia_a"]),
-        "Repetidas B": len(results["rep_mesmo_dia_b"]),
-        "Nota dias diferentes A": len(results["nota_diff_a"]),
-        "Nota dias diferentes B": len(results["nota_diff_b"]),
-        "Só em A": len(results["notas_apenas_em_a"]),
-        "Só em B": len(results["notas_apenas_em_b"]),
-        "Datas divergentes": len(results["datas_divergentes"]),
-        "Tipos divergentes": len(results["tipos_divergentes"]),
-        "Valores divergentes": len(results["valores_divergentes"]),
-    }
-
-    results["resumo"] = resumo
-    results["df_a"] = df_a
-    results["df_b"] = df_b
-
-    return results
-
-# -------------------------------------------------------------------------
-# EXCEL
-# -------------------------------------------------------------------------
-def gerar_excel(results):
-    buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as w:
-        pd.DataFrame([results["resumo"]]).to_excel(w, "Resumo", index=False)
-        results["df_a"].to_excel(w, "POSTO", index=False)
-        results["df_b"].to_excel(w, "PMM", index=False)
-        results["merged"].to_excel(w, "Comparacao", index=False)
-
-        for k, df in results.items():
-            if isinstance(df, pd.DataFrame) and not df.empty:
-                name = k[:31]
-                if name not in ["Resumo", "POSTO", "PMM", "Comparacao"]:
-                    df.to_excel(w, name, index=False)
-
-    buf.seek(0)
-    return buf
-
-# -------------------------------------------------------------------------
-# PDF
-# -------------------------------------------------------------------------
-def gerar_pdf(results):
-    buf = BytesIO()
-    doc = SimpleDocTemplate(buf, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-
-    story.append(Paragraph("<b>Relatório de Auditoria</b>", styles["Title"]))
-    story.append(Spacer(1, 8))
-    story.append(Paragraph(f"Gerado em {datetime.now()}", styles["BodyText"]))
-    story.append(Spacer(1, 8))
-
-    for k, v in results["resumo"].items():
-        if isinstance(v, float):
-            story.append(Paragraph(f"<b>{k}:</b> {v:.2f}", styles["BodyText"]))
-        else:
-            story.append(Paragraph(f"<b>{k}:</b> {v}", styles["BodyText"]))
-        story.append(Spacer(1, 4))
-
-    doc.build(story)
-    buf.seek(0)
-    return buf
+@st.cache_resource
+def pools_analise():
+    # Um par de pools por servidor, compartilhado por todas as sessões
+    return (
+        ThreadPoolExecutor(max_workers=ANALISES_SIMULTANEAS, thread_name_prefix="analise"),
+        ThreadPoolExecutor(max_workers=LEITURAS_SIMULTANEAS, thread_name_prefix="leitura"),
+    )
 
 # -------------------------------------------------------------------------
 # INTERFACE STREAMLIT
@@ -218,35 +56,167 @@ st.set_page_config(layout="wide")
 st.title("🚚 Dashboard de Auditoria de Abastecimentos")
 
 st.sidebar.header("Configurações")
-file_a = st.sidebar.file_uploader("Planilha A (POSTO)", type=["xlsx"])
-file_b = st.sidebar.file_uploader("Planilha B (PMM)", type=["xlsx"])
+file_a = st.sidebar.file_uploader("Planilha A (POSTO)", type=TIPOS_ARQUIVO)
+file_b = st.sidebar.file_uploader("Planilha B (PMM)", type=TIPOS_ARQUIVO)
 use_default = st.sidebar.checkbox("Usar arquivos padrão (POSTO.xlsx / PMM.xlsx)", True)
-processar = st.sidebar.button("Processar")
-
-if processar:
-    df_a = pd.read_excel(file_a) if file_a else pd.read_excel(DEFAULT_ARQUIVO_A)
-    df_b = pd.read_excel(file_b) if file_b else pd.read_excel(DEFAULT_ARQUIVO_B)
-
-    col_a = guess_column(df_a, EXPECTED_COLS["setor"])
-    col_b = guess_column(df_b, EXPECTED_COLS["setor"])
+pre_gerar = st.sidebar.checkbox("Gerar relatórios em segundo plano", False)
+nome_auditoria = st.sidebar.text_input(
+    "Reauditoria incremental (nome)", "",
+    help="Guarda o estado desta auditoria; no próximo envio só as notas que mudaram são verificadas de novo.",
+)
+periodo = st.sidebar.text_input(
+    "Período desta auditoria (ex.: 2024-03)", "",
+    help="Registra as notas no histórico e aponta as já usadas em outros períodos.",
+)
+if FORA_DA_MEMORIA_DISPONIVEL:
+    from particionado import MEMORIA_MB
+
+    ajuda_fora_da_memoria = (
+        f"Analisa as notas em partições no disco com até ~{MEMORIA_MB} MB por vez "
+        "(COMPARADOR_MEMORIA_MB). Não usa a reauditoria incremental nem o histórico."
+    )
+else:
+    ajuda_fora_da_memoria = "Requer o pyarrow (pip install pyarrow)."
+fora_da_memoria = st.sidebar.checkbox(
+    "Modo fora da memória (planilhas muito grandes)", False,
+    disabled=not FORA_DA_MEMORIA_DISPONIVEL, help=ajuda_fora_da_memoria,
+)
+medir = st.sidebar.checkbox(
+    "Medir etapas (tempo e memória)", False,
+    help="Registra tempo, linhas e pico de memória de cada etapa da análise e dos relatórios.",
+)
+
+def medindo():
+    # Ativa o perfil da última análise (se medida) para as etapas dos relatórios
+    perfil = st.session_state.get("perfil")
+    return perfilar(perfil) if perfil is not None else nullcontext()
+
+# Análise terminada (ou cancelada) em segundo plano: guarda o resultado
+tarefa = st.session_state.get("tarefa")
+if tarefa is not None and tarefa.futuro.done():
+    del st.session_state["tarefa"]
+    try:
+        st.session_state["results"] = tarefa.futuro.result()
+    except (AnaliseCancelada, CancelledError):
+        st.sidebar.warning("Análise cancelada.")
+    except Exception as e:
+        st.error(f"❌ Erro na análise: {e}")
+    else:
+        st.session_state["incremental"] = tarefa.estado.ultima if tarefa.estado else None
+        if pre_gerar:
+            with medindo():
+                preparar_relatorio(st.session_state["results"], "excel")
+                preparar_relatorio(st.session_state["results"], "pdf")
 
-    setores = set()
-    if col_a: setores.update(df_a[col_a].dropna().astype(str).unique())
-    if col_b: setores.update(df_b[col_b].dropna().astype(str).unique())
-    setores = sorted(list(setores))
+processar = st.sidebar.button("Processar", disabled="tarefa" in st.session_state)
 
-    setor = st.sidebar.selectbox("Filtrar por Setor", ["Todos"] + setores)
+if processar:
+    # A análise roda em segundo plano; trocar de setor depois só fatia os índices já prontos
+    estado = None
+    historico = None
+    if not fora_da_memoria:
+        estado = EstadoAuditoria(pasta_estado(nome_auditoria)) if nome_auditoria.strip() else None
+        historico = HistoricoNotas(periodo) if periodo.strip() else None
+    st.session_state["perfil"] = Perfil() if medir else None
+    st.session_state["tarefa"] = TarefaAnalise(
+        *pools_analise(), file_a if file_a else DEFAULT_ARQUIVO_A, file_b if file_b else DEFAULT_ARQUIVO_B,
+        estado, historico, fora_da_memoria, st.session_state["perfil"],
+    )
+    st.rerun()
+
+@st.fragment(run_every=0.5)
+def acompanhar_analise():
+    tarefa = st.session_state.get("tarefa")
+    if tarefa is None:
+        return
+    if tarefa.futuro.done():
+        st.rerun()
+
+    etapa = "Cancelando" if tarefa.cancelando else tarefa.etapa
+    st.progress(tarefa.fracao, text=f"{etapa}... ({time.monotonic() - tarefa.inicio:.0f}s)")
+    if st.button("Cancelar análise", disabled=tarefa.cancelando):
+        tarefa.cancelar()
+
+# O fragmento só existe enquanto há análise em andamento: ao terminar, falhar ou ser
+# cancelada, o st.rerun() acima volta ao script, que descarta a tarefa e não o chama mais
+if "tarefa" in st.session_state:
+    acompanhar_analise()
 
-    results = analisar(df_a, df_b, setor)
-    st.session_state["results"] = results
+# -------------------------------------------------------------------------
+# TABELAS PAGINADAS
+# -------------------------------------------------------------------------
+def _contem(df, texto):
+    # Linhas com `texto` em alguma coluna; categorias são testadas uma vez cada
+    mascara = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            achou = serie.cat.categories.astype(str).str.contains(texto, case=False, regex=False)
+            mascara |= np.append(achou, False)[serie.cat.codes.to_numpy()]
+        else:
+            mascara |= serie.astype(str).str.contains(texto, case=False, regex=False).to_numpy()
+    return mascara
+
+def _ordem_linhas(results, chave, filtro, ordenar, crescente):
+    # Posições (na tabela da regra) das linhas filtradas e ordenadas no servidor,
+    # ou None para todas na ordem original. Só esse array, da última consulta de
+    # cada regra, fica na sessão: cada página monta apenas as suas linhas
+    pedido = (results.chave, chave, filtro, ordenar, crescente)
+    guardada = st.session_state.setdefault("ordem_achados", {}).get(chave)
+    if guardada is not None and guardada[0] == pedido:
+        return guardada[1]
+
+    ordem = None
+    if filtro or ordenar:
+        df = results.tabela(chave, COLUNAS_TELA[FONTES_REGRAS[chave]] if filtro else [ordenar])
+        ordem = np.arange(len(df))
+        if filtro:
+            ordem = ordem[_contem(df, filtro)]
+        if ordenar:
+            valores = df[ordenar].iloc[ordem].reset_index(drop=True)
+            ordem = ordem[valores.sort_values(ascending=crescente, kind="stable").index.to_numpy()]
+        del df
+    st.session_state["ordem_achados"][chave] = (pedido, ordem)
+    return ordem
+
+@st.fragment
+def tabela_paginada(results, chave):
+    # Filtro, ordenação e página só reexecutam este trecho, não o painel inteiro
+    colunas = COLUNAS_TELA[FONTES_REGRAS[chave]]
+    prefixo = f"{chave}_{results.chave}"
+
+    c1, c2, c3, c4 = st.columns([3, 2, 1, 1])
+    filtro = c1.text_input("Filtrar", "", key=f"filtro_{prefixo}", placeholder="texto em qualquer coluna")
+    ordenar = c2.selectbox("Ordenar por", [None] + colunas, key=f"ordem_{prefixo}",
+                           format_func=lambda c: "—" if c is None else c)
+    crescente = c3.toggle("Crescente", True, key=f"crescente_{prefixo}")
+    por_pagina = c4.selectbox("Linhas", LINHAS_POR_PAGINA, key=f"linhas_{prefixo}")
+
+    ordem = _ordem_linhas(results, chave, filtro.strip(), ordenar, crescente)
+    total = results.contagem(chave) if ordem is None else len(ordem)
+    paginas = max(1, -(-total // por_pagina))
+    pagina = st.number_input(f"Página (de {paginas})", 1, paginas, 1, key=f"pagina_{prefixo}")
+
+    inicio = (pagina - 1) * por_pagina
+    fim = min(inicio + por_pagina, total)
+    linhas = np.arange(inicio, fim) if ordem is None else ordem[inicio:fim]
+    st.dataframe(results.tabela(chave, colunas, linhas), hide_index=True)
+    st.caption(f"Linhas {min(inicio + 1, total)}–{fim} de {total}")
 
 # -------------------------------------------------------------------------
 # EXIBIÇÃO
 # -------------------------------------------------------------------------
 if "results" not in st.session_state:
-    st.info("Carregue e processe as planilhas.")
+    if "tarefa" not in st.session_state:
+        st.info("Carregue e processe as planilhas.")
 else:
-    results = st.session_state["results"]
+    if st.session_state.get("incremental"):
+        ultima = st.session_state["incremental"]
+        st.sidebar.caption(f"↻ {ultima['notas_refeitas']} de {ultima['notas']} notas verificadas de novo.")
+
+    setor = st.sidebar.selectbox("Filtrar por Setor", ["Todos"] + st.session_state["results"].setores)
+
+    results = st.session_state["results"].fatiar(setor)
     resumo = results["resumo"]
 
     #------------------------ RESUMO -----------------------
@@ -267,39 +237,14 @@ else:
     #------------------------ GRÁFICO POR SECRETARIA -----------------------
     st.subheader("🏛️ Consumo por Secretaria (Gasolina / Diesel / POSTO / PMM)")
 
-    df_a = results["df_a"]
-    df_b = results["df_b"]
+    # Tabela já agregada por setor, origem e combustível (uma linha por barra)
+    consumo = results.consumo
 
     # Se não houver setor, evita erro
-    if "SETOR" not in df_a.columns:
+    if consumo.empty:
         st.warning("Nenhuma coluna de setor encontrada.")
     else:
-        def sum_by_sector(df, label):
-            df2 = df.copy()
-            df2["combustivel"] = df2["TIPO"].astype(str).str.upper()
-            df2["gasolina"] = df2["combustivel"].str.contains("GAS")
-            df2["diesel"] = df2["combustivel"].str.contains("DIE")
-
-            return pd.DataFrame({
-                "Setor": df2["SETOR"],
-                "Gasolina": df2[df2["gasolina"]]["VALOR"].groupby(df2["SETOR"]).sum(),
-                "Diesel": df2[df2["diesel"]]["VALOR"].groupby(df2["SETOR"]).sum()
-            }).fillna(0).assign(Origem=label)
-
-        tabela_a = sum_by_sector(df_a, "POSTO")
-        tabela_b = sum_by_sector(df_b, "PMM")
-
-        consumo = pd.concat([tabela_a, tabela_b]).reset_index()
-
-        # Converter para formato longo
-        consumo_long = consumo.melt(
-            id_vars=["Setor", "Origem"],
-            value_vars=["Gasolina", "Diesel"],
-            var_name="Combustível",
-            value_name="Litros"
-        )
-
-        chart = alt.Chart(consumo_long).mark_bar().encode(
+        chart = alt.Chart(consumo).mark_bar().encode(
             x=alt.X("Litros:Q", title="Litros Abastecidos"),
             y=alt.Y("Setor:N", title="Setor", sort="-x"),
             color="Origem:N",
@@ -312,42 +257,63 @@ else:
     st.markdown("---")
 
     #------------------------ TABELAS -----------------------
-    def show(df, title):
-        if df is not None and not df.empty:
-            with st.expander(f"{title} ({len(df)})"):
-                st.dataframe(df)
-
-    show(results["duplicadas_a"], "Duplicadas A")
-    show(results["duplicadas_b"], "Duplicadas B")
-    show(results["negativos_a"], "Negativos A")
-    show(results["negativos_b"], "Negativos B")
-    show(results["rep_mesmo_dia_a"], "Repetidas Mesmo Dia A")
-    show(results["rep_mesmo_dia_b"], "Repetidas Mesmo Dia B")
-    show(results["nota_diff_a"], "Not a em Dias Diferentes A")
-    show(results["nota_diff_b"], "Nota em Dias Diferentes B")
-    show(results["notas_apenas_em_a"], "Somente na A")
-    show(results["notas_apenas_em_b"], "Somente na B")
-    show(results["datas_divergentes"], "Datas Divergentes")
-    show(results["tipos_divergentes"], "Tipos Divergentes")
-    show(results["valores_divergentes"], "Valores Divergentes")
+    # As contagens vêm dos índices; a tabela só é montada com o expansor aberto
+    tabelas = [
+        ("duplicadas_a", "Duplicadas A"),
+        ("duplicadas_b", "Duplicadas B"),
+        ("negativos_a", "Negativos A"),
+        ("negativos_b", "Negativos B"),
+        ("rep_mesmo_dia_a", "Repetidas Mesmo Dia A"),
+        ("rep_mesmo_dia_b", "Repetidas Mesmo Dia B"),
+        ("nota_diff_a", "Not a em Dias Diferentes A"),
+        ("nota_diff_b", "Nota em Dias Diferentes B"),
+        ("litragens_atipicas_a", "Litragens Atípicas A (fora do padrão do tipo e setor)"),
+        ("litragens_atipicas_b", "Litragens Atípicas B (fora do padrão do tipo e setor)"),
+        ("notas_apenas_em_a", "Somente na A"),
+        ("notas_apenas_em_b", "Somente na B"),
+        ("sugestoes_pares", "Sugestões de Pareamento (Somente na A x Somente na B)"),
+        ("datas_divergentes", "Datas Divergentes"),
+        ("tipos_divergentes", "Tipos Divergentes"),
+        ("valores_divergentes", "Valores Divergentes"),
+        ("notas_outro_periodo", "Notas Já Usadas em Outros Períodos"),
+    ]
+
+    for chave, title in tabelas:
+        n = results.contagem(chave)
+        if n:
+            exp = st.expander(f"{title} ({n})", key=f"exp_{chave}", on_change="rerun")
+            if exp.open:
+                with exp:
+                    tabela_paginada(results, chave)
 
     st.markdown("---")
 
     #------------------------ DOWNLOADS -----------------------
     st.subheader("📥 Exportar Relatórios")
 
-    col1, col2 = st.columns(2)
-    with col1:
-        st.download_button(
-            "⬇️ Baixar Excel",
-            gerar_excel(results),
-            file_name="relatorio_abastecimentos.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-    with col2:
-        st.download_button(
-            "⬇️ Baixar PDF",
-            gerar_pdf(results),
-            file_name="relatorio_abastecimentos.pdf",
-            mime="application/pdf"
-        )
+    # Os relatórios só são gerados quando pedidos e ficam memoizados por resultado
+    exportacoes = [
+        ("excel", "Excel", "relatorio_abastecimentos.xlsx",
+         "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+        ("pdf", "PDF", "relatorio_abastecimentos.pdf", "application/pdf"),
+        ("pdf_detalhado", "PDF detalhado", "relatorio_abastecimentos_detalhado.pdf", "application/pdf"),
+    ]
+
+    for col, (tipo, rotulo, arquivo, mime) in zip(st.columns(len(exportacoes)), exportacoes):
+        with col:
+            dados = relatorio_pronto(results, tipo)
+            if dados is None and st.button(f"⚙️ Preparar {rotulo}", key=f"preparar_{tipo}"):
+                with st.spinner(f"Gerando {rotulo}..."), medindo():
+                    dados = obter_relatorio(results, tipo)
+            if dados is not None:
+                st.download_button(f"⬇️ Baixar {rotulo}", dados, file_name=arquivo, mime=mime)
+
+    #------------------------ DESEMPENHO -----------------------
+    # Por último, para já incluir os relatórios gerados nesta execução
+    perfil = st.session_state.get("perfil")
+    if medir and perfil is not None:
+        with st.sidebar.expander("⏱️ Desempenho"):
+            st.caption("Tempo, linhas e pico de memória por etapa (etapas internas recuadas).")
+            st.dataframe(perfil.tabela(), hide_index=True)
+            st.download_button("⬇️ Baixar perfil (JSON)", json.dumps(perfil.como_dict(), ensure_ascii=False, indent=1),
+                               file_name="perfil_auditoria.json", mime="application/json")
@@ -0,0 +1,866 @@
+import uuid
+from collections.abc import Mapping
+
+import pandas as pd
+import numpy as np
+
+from ingestao import normalize_df
+from instrumentacao import etapa
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+# Dia usado quando a data não pôde ser interpretada (equivale ao NaT)
+DIA_NULO = np.iinfo(np.int32).min
+
+GASOLINA = ["GAS", "GASOLINA"]
+DIESEL = ["DIE", "DIESEL"]
+
+# -------------------------------------------------------------------------
+# ESQUEMA TIPADO (executado uma única vez por análise)
+# -------------------------------------------------------------------------
+def _como_texto(serie):
+    return serie.astype(object).where(serie.isna(), serie.astype(str))
+
+def _categorizar(serie_a, serie_b):
+    # Categorias compartilhadas: os códigos de A e B são diretamente comparáveis
+    categorias = pd.Index(pd.concat([serie_a.dropna(), serie_b.dropna()]).unique())
+    dtype = pd.CategoricalDtype(categorias.sort_values())
+    return serie_a.astype(dtype), serie_b.astype(dtype)
+
+def _dias(serie):
+    datas = pd.to_datetime(serie, errors="coerce")
+    dias = datas.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]").astype("int64")
+    dias[datas.isna().to_numpy()] = DIA_NULO
+    return datas, dias.astype("int32")
+
+def tipar_planilhas(df_a, df_b):
+    df_a = normalize_df(df_a)
+    df_b = normalize_df(df_b)
+
+    for df in (df_a, df_b):
+        nota = _como_texto(df["NOTA"])
+        df["NOTA"] = nota.where(nota.isna(), nota.str.zfill(4))
+        df["TIPO"] = _como_texto(df["TIPO"])
+        df["SETOR"] = _como_texto(df["SETOR"])
+        df["VALOR"] = pd.to_numeric(df["VALOR"], errors="coerce").astype("float64")
+        df["DATA"], df["DIA"] = _dias(df["DATA"])
+
+    for col in ["NOTA", "TIPO", "SETOR"]:
+        df_a[col], df_b[col] = _categorizar(df_a[col], df_b[col])
+
+    return df_a, df_b
+
+# -------------------------------------------------------------------------
+# VERIFICAÇÕES INTERNAS (uma ordenação, todas as regras)
+# -------------------------------------------------------------------------
+REGRAS_INTRA = ["duplicadas", "negativos", "rep_mesmo_dia", "nota_diff"]
+
+def _tamanho_grupos(inicio):
+    # Para cada linha ordenada, o tamanho do grupo (contíguo) ao qual ela pertence
+    pos = np.flatnonzero(inicio)
+    tamanhos = np.diff(np.append(pos, len(inicio)))
+    return pos, np.repeat(tamanhos, tamanhos)
+
+def checar_intra(df):
+    # Espera um DataFrame saído de tipar_planilhas. Devolve, para cada regra de
+    # REGRAS_INTRA, as posições (iloc) das linhas atingidas, em ordem crescente.
+    nota = df["NOTA"].cat.codes.to_numpy()
+    dia = df["DIA"].to_numpy()
+    valor = df["VALOR"].to_numpy()
+    n = len(df)
+
+    if n == 0:
+        vazio = np.empty(0, dtype=np.intp)
+        return {regra: vazio for regra in REGRAS_INTRA}
+
+    ordem = np.lexsort((valor, dia, nota))
+    n_s, d_s, v_s = nota[ordem], dia[ordem], valor[ordem]
+
+    muda_nota = np.empty(n, dtype=bool)
+    muda_nota[0] = True
+    muda_nota[1:] = n_s[1:] != n_s[:-1]
+
+    muda_dia = muda_nota.copy()
+    muda_dia[1:] |= d_s[1:] != d_s[:-1]
+
+    # NaN conta como valor igual, como em DataFrame.duplicated
+    mesmo_valor = (v_s[1:] == v_s[:-1]) | (np.isnan(v_s[1:]) & np.isnan(v_s[:-1]))
+    muda_valor = muda_dia.copy()
+    muda_valor[1:] |= ~mesmo_valor
+
+    inicio_nota, tam_nota = _tamanho_grupos(muda_nota)
+    _, tam_valor = _tamanho_grupos(muda_valor)
+
+    # Dias válidos distintos por nota: conta os inícios de (nota, dia) com dia não nulo
+    dias_distintos = np.add.reduceat((muda_dia & (d_s != DIA_NULO)).astype(np.int32), inicio_nota)
+    tam_dias = np.repeat(dias_distintos, np.diff(np.append(inicio_nota, n)))
+
+    # Linhas sem número de nota não entram nas regras por nota
+    com_nota = n_s != -1
+
+    def posicoes(mascara_ordenada):
+        return np.sort(ordem[mascara_ordenada & com_nota])
+
+    return {
+        "duplicadas": posicoes(tam_nota > 1),
+        "negativos": np.flatnonzero(valor < 0),
+        "rep_mesmo_dia": posicoes(tam_valor > 1),
+        "nota_diff": posicoes(tam_dias > 1),
+    }
+
+# -------------------------------------------------------------------------
+# RECONCILIAÇÃO UM-PARA-UM ENTRE POSTO E PMM
+# -------------------------------------------------------------------------
+# Cada rodada pareia as linhas ainda sem par por uma chave cada vez menos
+# específica; dentro de uma mesma chave, a k-ésima linha de A fica com a
+# k-ésima de B. Assim uma nota repetida nunca gera produto cartesiano.
+NIVEIS_PAREAMENTO = [
+    ["NOTA", "DIA", "TIPO", "VALOR"],
+    ["NOTA", "DIA", "TIPO"],
+    ["NOTA", "DIA"],
+    ["NOTA"],
+]
+
+def _chaves(df):
+    return pd.DataFrame({
+        "NOTA": df["NOTA"].cat.codes.to_numpy(),
+        "DIA": df["DIA"].to_numpy(),
+        "TIPO": df["TIPO"].cat.codes.to_numpy(),
+        "VALOR": df["VALOR"].to_numpy(),
+        "POS": np.arange(len(df)),
+    })
+
+def _ordinal(chaves, nivel):
+    chaves = chaves.sort_values(["DIA", "VALOR", "POS"])
+    return chaves.assign(ORD=chaves.groupby(nivel, sort=False, dropna=False).cumcount())
+
+def reconciliar(df_a, df_b):
+    # Devolve {"a": posições em df_a, "b": posições em df_b}, alinhadas; -1 indica
+    # que a linha não tem par do outro lado (nota só em A / só em B).
+    chaves_a = _chaves(df_a)
+    chaves_b = _chaves(df_b)
+
+    sem_nota_a = chaves_a.loc[chaves_a["NOTA"] < 0, "POS"].to_numpy()
+    sem_nota_b = chaves_b.loc[chaves_b["NOTA"] < 0, "POS"].to_numpy()
+    chaves_a = chaves_a[chaves_a["NOTA"] >= 0]
+    chaves_b = chaves_b[chaves_b["NOTA"] >= 0]
+
+    pares_a, pares_b = [], []
+    for nivel in NIVEIS_PAREAMENTO:
+        if chaves_a.empty or chaves_b.empty:
+            break
+        cols = nivel + ["ORD", "POS"]
+        m = _ordinal(chaves_a, nivel)[cols].merge(
+            _ordinal(chaves_b, nivel)[cols], on=nivel + ["ORD"], suffixes=("_A", "_B")
+        )
+        pares_a.append(m["POS_A"].to_numpy())
+        pares_b.append(m["POS_B"].to_numpy())
+        chaves_a = chaves_a[~chaves_a["POS"].isin(m["POS_A"])]
+        chaves_b = chaves_b[~chaves_b["POS"].isin(m["POS_B"])]
+
+    orf_a = np.concatenate([chaves_a["POS"].to_numpy(), sem_nota_a])
+    orf_b = np.concatenate([chaves_b["POS"].to_numpy(), sem_nota_b])
+
+    pos_a = np.concatenate(pares_a + [orf_a, np.full(len(orf_b), -1)]).astype(np.intp)
+    pos_b = np.concatenate(pares_b + [np.full(len(orf_a), -1), orf_b]).astype(np.intp)
+
+    return ordenar_pares(df_a, df_b, pos_a, pos_b)
+
+def ordenar_pares(df_a, df_b, pos_a, pos_b):
+    # Mesma ordem do antigo merge externo: por nota (sem nota no fim), depois por linha
+    # Chave única (nota, linha de A ou, sem A, linha de B) em um int64: só B vem
+    # antes, pela linha de B; depois as linhas de A em ordem
+    nota = _nota_pareada(df_a, df_b, pos_a, pos_b)
+    nota = np.where(nota < 0, len(df_a["NOTA"].cat.categories), nota)
+    linha = np.where(pos_a >= 0, len(df_b) + pos_a, pos_b)
+    ordem = np.argsort(nota * (len(df_a) + len(df_b) + 1) + linha, kind="stable")
+
+    return {"a": pos_a[ordem], "b": pos_b[ordem]}
+
+def _nota_pareada(df_a, df_b, pos_a, pos_b):
+    codigos_a = df_a["NOTA"].cat.codes.to_numpy().astype(np.int64)
+    codigos_b = df_b["NOTA"].cat.codes.to_numpy().astype(np.int64)
+    de_a = codigos_a[pos_a] if len(codigos_a) else np.full(len(pos_a), -1)
+    de_b = codigos_b[pos_b] if len(codigos_b) else np.full(len(pos_b), -1)
+    return np.where(pos_a >= 0, de_a, de_b)
+
+def _lado(df, posicoes, comuns, sufixo):
+    # Só as linhas pedidas são copiadas; posições -1 viram linhas vazias (NaN)
+    validas = posicoes >= 0
+    cols = [c for c in df.columns if c != "NOTA"]
+    lado = df.iloc[posicoes[validas]][cols]
+    lado.index = np.flatnonzero(validas)
+    lado = lado.reindex(np.arange(len(posicoes)))
+    return lado.rename(columns={c: f"{c}{sufixo}" for c in comuns})
+
+def montar_comparacao(df_a, df_b, pares):
+    # Tabela no formato do antigo pd.merge(..., on="NOTA", suffixes=("_A", "_B"))
+    comuns = (set(df_a.columns) & set(df_b.columns)) - {"NOTA"}
+    lado_a = _lado(df_a, pares["a"], comuns, "_A")
+    lado_b = _lado(df_b, pares["b"], comuns, "_B")
+
+    codigos = _nota_pareada(df_a, df_b, pares["a"], pares["b"])
+    nota = pd.Categorical.from_codes(codigos, dtype=df_a["NOTA"].dtype)
+
+    merged = pd.concat([lado_a, lado_b], axis=1)
+    merged.insert(list(df_a.columns).index("NOTA"), "NOTA", nota)
+    return merged
+
+# -------------------------------------------------------------------------
+# VERIFICAÇÕES POR NOTA E PAREAMENTO
+# -------------------------------------------------------------------------
+def verificar_notas(df_a, df_b, progresso=None):
+    # Verificações internas de A e B e pareamento, para planilhas já tipadas
+    progresso = progresso or (lambda etapa: None)
+    progresso("Verificações internas")
+    with etapa("Verificações internas", len(df_a) + len(df_b)):
+        intra_a, intra_b = checar_intra(df_a), checar_intra(df_b)
+    progresso("Reconciliação")
+    with etapa("Reconciliação", len(df_a) + len(df_b)) as e:
+        pares = reconciliar(df_a, df_b)
+        e.linhas = len(pares["a"])
+    return intra_a, intra_b, pares
+
+# -------------------------------------------------------------------------
+# SUGESTÕES DE PAREAMENTO PARA NOTAS SEM PAR
+# -------------------------------------------------------------------------
+# Os candidatos vêm de dois índices, nunca da comparação de todos contra todos:
+#   1. mesmo setor/tipo/litragem com data igual ou vizinha (±1 dia);
+#   2. notas a até um dígito de distância (sem zeros à esquerda), por junções
+#      exatas: trocado em (versão sem o dígito i, posição i), a mais ou a menos
+#      em versão sem um dígito x nota original, e vizinhos invertidos em versão
+#      com dois dígitos trocados x original. Só pares a distância <= 1 saem
+#      das junções, então a distância já vem com o candidato.
+# Cada órfã fica com no máximo CANDIDATOS_POR_NOTA candidatos por índice
+# (litragens redondas repetem muito no mesmo dia, setor e tipo).
+SUGESTOES_POR_NOTA = 3
+CANDIDATOS_POR_NOTA = 50
+# Nota a um dígito de distância (2 pontos) só vale com a data (±1 dia) ou a
+# litragem do abastecimento batendo; tipo e setor iguais não bastam
+PONTUACAO_MINIMA = 4
+DISTANCIA_NENHUMA = 99  # nota ausente ou a mais de um dígito
+
+COLUNAS_SUGESTOES = [
+    "NOTA_A", "NOTA_B", "DATA_A", "DATA_B", "TIPO_A", "TIPO_B",
+    "VALOR_A", "VALOR_B", "SETOR_A", "SETOR_B", "PONTUACAO", "MOTIVO",
+]
+
+def _orfas(df, posicoes):
+    orfas = df.iloc[posicoes]
+    nota = orfas["NOTA"].astype(object)
+    return pd.DataFrame({
+        "POS": posicoes,
+        "BASE": nota.where(nota.isna(), nota.astype(str).str.lstrip("0")).to_numpy(),
+        "DIA": orfas["DIA"].to_numpy().astype(np.int64),
+        "TIPO": orfas["TIPO"].cat.codes.to_numpy(),
+        "SETOR": orfas["SETOR"].cat.codes.to_numpy(),
+        "VALOR": orfas["VALOR"].round(2).to_numpy(),
+    })
+
+def _variantes(orfas):
+    # (originais, sem um dígito com a posição I, com os dígitos I e I+1 trocados)
+    validas = orfas.dropna(subset=["BASE"])
+    base = validas["BASE"].astype(str)
+    tamanho = base.str.len()
+    originais = pd.DataFrame({"POS": validas["POS"], "VAR": base})
+    delecoes, trocas = [], []
+    for i in range(int(tamanho.max()) if len(base) else 0):
+        b = base[tamanho > i]
+        delecoes.append(pd.DataFrame({"POS": validas["POS"][tamanho > i], "VAR": b.str[:i] + b.str[i + 1:], "I": i}))
+        b = base[tamanho > i + 1]
+        trocas.append(pd.DataFrame({
+            "POS": validas["POS"][tamanho > i + 1],
+            "VAR": b.str[:i] + b.str[i + 1] + b.str[i] + b.str[i + 2:],
+        }))
+    if not delecoes:
+        return originais, pd.DataFrame(columns=["POS", "VAR", "I"]), pd.DataFrame(columns=["POS", "VAR"])
+    return originais, pd.concat(delecoes, ignore_index=True), pd.concat(trocas, ignore_index=True)
+
+def _limitar(cand, ordem):
+    # Os CANDIDATOS_POR_NOTA primeiros (por `ordem`) de cada órfã de A
+    cand = cand.sort_values(["POS_A", ordem, "POS_B"], kind="stable")
+    return cand.groupby("POS_A", sort=False).head(CANDIDATOS_POR_NOTA)
+
+def _candidatos(orf_a, orf_b):
+    # Pares (POS_A, POS_B) e DIST, a distância de edição das notas (com
+    # transposição de vizinhos) quando é 0 ou 1, senão DISTANCIA_NENHUMA
+    cols = ["DIA", "TIPO", "SETOR", "VALOR"]
+    attr_a = orf_a[(orf_a["DIA"] != DIA_NULO) & orf_a["VALOR"].notna()]
+    attr_b = orf_b[(orf_b["DIA"] != DIA_NULO) & orf_b["VALOR"].notna()]
+    attr_b = attr_b.groupby(cols, sort=False).head(CANDIDATOS_POR_NOTA)
+    vizinhos = pd.concat([attr_a.assign(DIA=attr_a["DIA"] + d, DELTA=abs(d)) for d in (0, -1, 1)])
+    por_atributos = vizinhos[["POS", "DELTA"] + cols].merge(
+        attr_b[["POS"] + cols], on=cols, suffixes=("_A", "_B")
+    )
+    por_atributos = _limitar(por_atributos, "DELTA")[["POS_A", "POS_B"]].assign(DIST=DISTANCIA_NENHUMA)
+
+    orig_a, del_a, troca_a = _variantes(orf_a)
+    orig_b, del_b, _ = _variantes(orf_b)
+    sem_posicao_a = del_a[["POS", "VAR"]].drop_duplicates()
+    sem_posicao_b = del_b[["POS", "VAR"]].drop_duplicates()
+    juncoes = [
+        (orig_a, orig_b, ["VAR"], 0),
+        (del_a, del_b, ["VAR", "I"], 1),          # um dígito trocado
+        (sem_posicao_a, orig_b, ["VAR"], 1),      # dígito a mais em A
+        (orig_a, sem_posicao_b, ["VAR"], 1),      # dígito a menos em A
+        (troca_a, orig_b, ["VAR"], 1),            # vizinhos invertidos
+    ]
+    por_nota = pd.concat([
+        x.merge(y, on=chave, suffixes=("_A", "_B"))[["POS_A", "POS_B"]].assign(DIST=dist)
+        for x, y, chave, dist in juncoes
+    ])
+    por_nota = por_nota.sort_values("DIST", kind="stable").drop_duplicates(["POS_A", "POS_B"])
+    por_nota = _limitar(por_nota, "DIST")
+
+    cand = pd.concat([por_nota, por_atributos]).astype({"POS_A": np.intp, "POS_B": np.intp, "DIST": np.int64})
+    return cand.groupby(["POS_A", "POS_B"], as_index=False, sort=False)["DIST"].min()
+
+def sugerir_pares(df_a, df_b, pares, limite=SUGESTOES_POR_NOTA):
+    orf_a = _orfas(df_a, pares["a"][pares["b"] < 0])
+    orf_b = _orfas(df_b, pares["b"][pares["a"] < 0])
+    if orf_a.empty or orf_b.empty:
+        return pd.DataFrame(columns=COLUNAS_SUGESTOES)
+
+    cand = _candidatos(orf_a, orf_b)
+    a = orf_a.set_index("POS").loc[cand["POS_A"]].reset_index(drop=True)
+    b = orf_b.set_index("POS").loc[cand["POS_B"]].reset_index(drop=True)
+
+    dist = cand["DIST"].to_numpy()
+    delta_dia = np.where(
+        (a["DIA"] == DIA_NULO) | (b["DIA"] == DIA_NULO), 99, (a["DIA"] - b["DIA"]).abs()
+    )
+    mesmo_tipo = (a["TIPO"] == b["TIPO"]) & (a["TIPO"] >= 0)
+    mesmo_setor = (a["SETOR"] == b["SETOR"]) & (a["SETOR"] >= 0)
+    mesmo_valor = np.isclose(a["VALOR"], b["VALOR"])
+
+    nota_parecida = (dist == 0) | ((dist == 1) & ((delta_dia <= 1) | mesmo_valor))
+    mesmo_abastecimento = (delta_dia <= 1) & mesmo_tipo & mesmo_setor & mesmo_valor
+
+    pontuacao = (
+        np.where(dist == 0, 4, np.where(dist == 1, 2, 0))
+        + np.where(delta_dia == 0, 2, np.where(delta_dia == 1, 1, 0))
+        + mesmo_tipo.astype(int) + mesmo_setor.astype(int) + 2 * mesmo_valor.astype(int)
+    )
+    texto_nota = np.select(
+        [dist == 0, dist == 1],
+        ["nota igual sem os zeros à esquerda", "nota com um dígito diferente ou trocado"],
+        "",
+    )
+    texto_abastecimento = np.select(
+        [mesmo_abastecimento & (delta_dia == 0), mesmo_abastecimento],
+        ["mesmo abastecimento", "mesmo abastecimento em dia vizinho"],
+        "",
+    )
+    separador = np.where((texto_nota != "") & (texto_abastecimento != ""), "; ", "")
+    motivo = np.char.add(np.char.add(texto_nota, separador), texto_abastecimento)
+
+    manter = ((nota_parecida | mesmo_abastecimento) & (pontuacao >= PONTUACAO_MINIMA)).to_numpy()
+    cand = cand.assign(PONTUACAO=pontuacao, MOTIVO=motivo)[manter]
+    cand = cand.sort_values(["PONTUACAO", "POS_A", "POS_B"], ascending=[False, True, True], kind="stable")
+    cand = cand.groupby("POS_A", sort=False).head(limite)
+
+    lado_a = df_a.iloc[cand["POS_A"]].reset_index(drop=True)
+    lado_b = df_b.iloc[cand["POS_B"]].reset_index(drop=True)
+    sugestoes = pd.DataFrame({
+        f"{col}_{lado}": origem[col]
+        for col in ["NOTA", "DATA", "TIPO", "VALOR", "SETOR"]
+        for lado, origem in (("A", lado_a), ("B", lado_b))
+    })
+    sugestoes["PONTUACAO"] = cand["PONTUACAO"].to_numpy()
+    sugestoes["MOTIVO"] = cand["MOTIVO"].to_numpy()
+    return sugestoes[COLUNAS_SUGESTOES]
+
+# -------------------------------------------------------------------------
+# LITRAGENS ATÍPICAS (REFERÊNCIA ROBUSTA POR TIPO E SETOR)
+# -------------------------------------------------------------------------
+# Cada litragem positiva é comparada à mediana do seu grupo (TIPO e SETOR, sem
+# diferenciar maiúsculas) na escala do desvio absoluto mediano (MAD): um
+# abastecimento extremo não desloca a referência, como deslocava a média. As
+# referências de todos os grupos saem de poucos groupby sobre os códigos das
+# categorias, sem laço por tipo. Grupos com menos de MINIMO_GRUPO litragens
+# usam a referência do tipo inteiro (SETOR_TODOS). As referências são uma
+# tabela pequena por planilha, então as de períodos anteriores (guardadas no
+# histórico) podem ser combinadas com as atuais em uma referência móvel.
+LIMIAR_ATIPICO = 3.5
+MINIMO_GRUPO = 8
+ESCALA_MAD = 1.4826            # MAD -> desvio padrão, em dados normais
+ESCALA_DESVIO_MEDIO = 1.2533   # idem para o desvio absoluto médio (quando o MAD é zero)
+SETOR_TODOS = "*"
+
+COLUNAS_REFERENCIAS = ["LADO", "TIPO", "SETOR", "MEDIANA", "DESVIO", "LINHAS"]
+
+def _grupos_litragem(df):
+    # Código do tipo e do setor canônicos de cada linha e o nome de cada
+    # código; o último código de cada um é "sem tipo" / "sem setor"
+    tipos, canonico_tipo = _setores_canonicos(df["TIPO"])
+    setores, canonico_setor = _setores_canonicos(df["SETOR"])
+    tipo = canonico_tipo[df["TIPO"].cat.codes.to_numpy()]
+    setor = canonico_setor[df["SETOR"].cat.codes.to_numpy()]
+    nomes_tipo = np.array([t.upper() for t in tipos] + [None], dtype=object)
+    nomes_setor = np.array([s.upper() for s in setores] + [""], dtype=object)
+    return tipo, setor, nomes_tipo, nomes_setor
+
+def _mediana_desvio(valor, grupo):
+    # Mediana, escala robusta e número de linhas de cada grupo (índice = código)
+    valor = pd.Series(valor)
+    mediana = valor.groupby(grupo).median()
+    centro = mediana.to_numpy()[np.searchsorted(mediana.index.to_numpy(), grupo)]
+    desvio = (valor - centro).abs().groupby(grupo)
+    mad, medio = desvio.median(), desvio.mean()
+    return pd.DataFrame({
+        "MEDIANA": mediana,
+        "DESVIO": np.where(mad > 0, ESCALA_MAD * mad, ESCALA_DESVIO_MEDIO * medio),
+        "LINHAS": valor.groupby(grupo).size(),
+    })
+
+def referencias_litragem(df, lado):
+    # Referência de cada (TIPO, SETOR) e de cada TIPO (SETOR_TODOS) de uma planilha
+    tipo, setor, nomes_tipo, nomes_setor = _grupos_litragem(df)
+    valor = df["VALOR"].to_numpy()
+    validas = (tipo < len(nomes_tipo) - 1) & (valor > 0)
+    tipo, setor, valor = tipo[validas], setor[validas], valor[validas]
+
+    n = len(nomes_setor)
+    por_setor = _mediana_desvio(valor, tipo * n + setor)
+    por_tipo = _mediana_desvio(valor, tipo)
+    codigos_setor = por_setor.index.to_numpy()
+    tabela = pd.concat([
+        por_setor.assign(TIPO=nomes_tipo[codigos_setor // n], SETOR=nomes_setor[codigos_setor % n]),
+        por_tipo.assign(TIPO=nomes_tipo[por_tipo.index.to_numpy()], SETOR=SETOR_TODOS),
+    ], ignore_index=True)
+    return tabela.assign(LADO=lado, LINHAS=tabela["LINHAS"].astype(np.int64))[COLUNAS_REFERENCIAS]
+
+def referencias_planilhas(df_a, df_b):
+    return pd.concat([referencias_litragem(df_a, "A"), referencias_litragem(df_b, "B")],
+                     ignore_index=True)
+
+def combinar_referencias(tabelas):
+    # Referência móvel: mediana das medianas e das escalas de cada período,
+    # com as linhas somadas (só tabelas pequenas, nenhuma planilha antiga)
+    tabela = pd.concat(tabelas, ignore_index=True)
+    combinada = tabela.groupby(["LADO", "TIPO", "SETOR"], sort=False).agg(
+        MEDIANA=("MEDIANA", "median"), DESVIO=("DESVIO", "median"), LINHAS=("LINHAS", "sum"),
+    )
+    return combinada.reset_index()[COLUNAS_REFERENCIAS]
+
+def pontuar_litragens(df, lado, referencias):
+    # Mediana de referência e pontuação (litragem - mediana) / escala de cada
+    # linha; NaN onde não há referência suficiente. A busca é feita uma vez por
+    # combinação de tipo e setor, não por linha.
+    tipo, setor, nomes_tipo, nomes_setor = _grupos_litragem(df)
+    ref = referencias[
+        (referencias["LADO"] == lado) & (referencias["LINHAS"] >= MINIMO_GRUPO)
+        & (referencias["DESVIO"] > 0)
+    ].set_index(["TIPO", "SETOR"])
+
+    n = len(nomes_setor)
+    combinacoes = np.arange(len(nomes_tipo) * n)
+    tipos = nomes_tipo[combinacoes // n]
+    por_setor = ref.index.get_indexer(pd.MultiIndex.from_arrays([tipos, nomes_setor[combinacoes % n]]))
+    por_tipo = ref.index.get_indexer(pd.MultiIndex.from_arrays([tipos, np.full(len(tipos), SETOR_TODOS)]))
+    # -1 (sem referência) pega o NaN do fim
+    escolha = np.where(por_setor >= 0, por_setor, por_tipo)
+    mediana = np.append(ref["MEDIANA"].to_numpy(), np.nan)[escolha][tipo * n + setor]
+    desvio = np.append(ref["DESVIO"].to_numpy(), np.nan)[escolha][tipo * n + setor]
+    return mediana, (df["VALOR"].to_numpy() - mediana) / desvio
+
+def litragens_atipicas(df, lado, referencias):
+    _, pontuacao = pontuar_litragens(df, lado, referencias)
+    return np.flatnonzero(pontuacao > LIMIAR_ATIPICO)
+
+# -------------------------------------------------------------------------
+# ACHADOS INDEXADOS
+# -------------------------------------------------------------------------
+# As planilhas tipadas ficam guardadas uma única vez; cada regra guarda só
+# as posições das linhas atingidas em uma das fontes:
+#   "a"/"b"      -> linhas de df_a/df_b
+#   "par"        -> linhas da comparação (posições nos arrays de `pares`)
+#   "sugestoes"  -> linhas da tabela de sugestões de pareamento
+#   "historico"  -> linhas da tabela de notas já usadas em outros períodos
+# As tabelas são montadas só quando alguém pede results[chave].
+FONTES_REGRAS = {
+    "duplicadas_a": "a",
+    "duplicadas_b": "b",
+    "negativos_a": "a",
+    "negativos_b": "b",
+    "rep_mesmo_dia_a": "a",
+    "rep_mesmo_dia_b": "b",
+    "nota_diff_a": "a",
+    "nota_diff_b": "b",
+    "litragens_atipicas_a": "a",
+    "litragens_atipicas_b": "b",
+    "merged": "par",
+    "notas_apenas_em_a": "par",
+    "notas_apenas_em_b": "par",
+    "sugestoes_pares": "sugestoes",
+    "datas_divergentes": "par",
+    "tipos_divergentes": "par",
+    "valores_divergentes": "par",
+    "notas_outro_periodo": "historico",
+    "df_a": "a",
+    "df_b": "b",
+}
+
+class Achados(Mapping):
+    def __init__(self, df_a, df_b, pares, sugestoes, indices, resumo, particoes=None, chave=None,
+                 historico=None, consumo=None):
+        # `chave` identifica este resultado (e o setor fatiado) para memoização;
+        # `consumo` é a tabela compacta de tabela_consumo para o gráfico
+        self.chave = chave or uuid.uuid4().hex
+        self.consumo = consumo
+        self.df_a = df_a
+        self.df_b = df_b
+        self.pares = pares
+        self.sugestoes = sugestoes
+        self.indices = indices
+        self.resumo = resumo
+        self.particoes = particoes
+        self.historico = historico
+
+    def __getitem__(self, chave):
+        if chave == "resumo":
+            return self.resumo
+        return self.tabela(chave)
+
+    def __iter__(self):
+        yield from self.indices
+        yield "resumo"
+
+    def __len__(self):
+        return len(self.indices) + 1
+
+    @property
+    def setores(self):
+        return self.particoes["setores"] if self.particoes else []
+
+    def contagem(self, chave):
+        return len(self.indices[chave])
+
+    def tabela(self, chave, colunas=None, linhas=None):
+        # `colunas` projeta a tabela (as que existirem) antes de copiar as linhas;
+        # `linhas` (posições na tabela da regra) monta só essas, nessa ordem
+        idx = self.indices[chave]
+        return self._montar(FONTES_REGRAS[chave], idx if linhas is None else idx[linhas], colunas)
+
+    def blocos(self, chave, tamanho):
+        # A tabela em pedaços de até `tamanho` linhas (sempre ao menos um, talvez vazio)
+        idx = self.indices[chave]
+        fonte = FONTES_REGRAS[chave]
+        for inicio in range(0, max(len(idx), 1), tamanho):
+            yield self._montar(fonte, idx[inicio:inicio + tamanho])
+
+    def _montar(self, fonte, idx, colunas=None):
+        if fonte == "par":
+            df_a, df_b = self.df_a, self.df_b
+            if colunas is not None:
+                # Só as colunas de A e B que aparecem (com ou sem sufixo) na projeção
+                base = [c for c in df_a.columns
+                        if c == "NOTA" or {c, f"{c}_A", f"{c}_B"} & set(colunas)]
+                df_a, df_b = df_a[base], df_b[base]
+            tabela = montar_comparacao(df_a, df_b, {"a": self.pares["a"][idx], "b": self.pares["b"][idx]})
+            return tabela if colunas is None else tabela[[c for c in colunas if c in tabela.columns]]
+
+        df = {"a": self.df_a, "b": self.df_b, "sugestoes": self.sugestoes,
+              "historico": self.historico}[fonte]
+        if colunas is not None:
+            df = df[[c for c in colunas if c in df.columns]]
+        return df.iloc[idx]
+
+    def fatiar(self, setor):
+        if not setor or setor == "Todos" or not self.particoes:
+            return self
+
+        nomes = [n.upper() for n in self.particoes["setores"]]
+        if setor.upper() not in nomes:
+            vazio = np.empty(0, dtype=np.intp)
+            return Achados(
+                self.df_a, self.df_b, self.pares, self.sugestoes,
+                {chave: vazio for chave in self.indices}, {k: 0 for k in self.resumo},
+                chave=f"{self.chave}:{setor.upper()}", historico=self.historico,
+                consumo=self.consumo.iloc[:0],
+            )
+        return self._particao(nomes.index(setor.upper()))
+
+    def fatias(self):
+        # (setor, achados do setor) de todas as partições; a das linhas sem setor vem com None
+        for i, nome in enumerate(self.setores + [None]):
+            yield nome, self._particao(i)
+
+    def _particao(self, i):
+        nome = self.particoes["setores"][i] if i < len(self.particoes["setores"]) else None
+        return Achados(
+            self.df_a, self.df_b, self.pares, self.sugestoes,
+            {chave: partes[i] for chave, partes in self.particoes["indices"].items()},
+            self.particoes["resumos"][i], chave=f"{self.chave}:{(nome or '').upper()}",
+            historico=self.historico, consumo=self.consumo[self.consumo["Setor"] == nome],
+        )
+
+# -------------------------------------------------------------------------
+# CONSUMO POR SETOR, COMBUSTÍVEL E ORIGEM
+# -------------------------------------------------------------------------
+# Cada TIPO distinto é classificado uma vez na primeira família que casa; a
+# posição extra no fim reúne os demais tipos e o TIPO vazio. Um único
+# bincount sobre a chave (origem, setor, família) dá os registros e os litros
+# de onde saem os totais do resumo e o gráfico de consumo.
+FAMILIAS_COMBUSTIVEL = [("Gasolina", GASOLINA), ("Diesel", DIESEL)]
+ORIGENS = ["POSTO", "PMM"]
+
+def familias_tipo(serie):
+    # Família de cada categoria de TIPO, indexável pelos códigos (inclusive -1)
+    outros = len(FAMILIAS_COMBUSTIVEL)
+    familias = [
+        next((f for f, (_, padroes) in enumerate(FAMILIAS_COMBUSTIVEL)
+              if any(p in c.upper() for p in padroes)), outros)
+        for c in serie.cat.categories
+    ]
+    return np.array(familias + [outros], dtype=np.intp)
+
+def consumo_setores(df_a, df_b, chave_a, chave_b, n):
+    # (registros, litros), cada um com forma (origem, setor, família)
+    familias = familias_tipo(df_a["TIPO"])
+    forma = (len(ORIGENS), n + 1, len(FAMILIAS_COMBUSTIVEL) + 1)
+    chave = np.concatenate([
+        np.ravel_multi_index((np.full(len(df), o), setor, familias[df["TIPO"].cat.codes.to_numpy()]), forma)
+        for o, (df, setor) in enumerate(((df_a, chave_a), (df_b, chave_b)))
+    ])
+    litros = np.concatenate([df_a["VALOR"].fillna(0).to_numpy(), df_b["VALOR"].fillna(0).to_numpy()])
+    tamanho = int(np.prod(forma))
+    return (np.bincount(chave, minlength=tamanho).reshape(forma),
+            np.bincount(chave, weights=litros, minlength=tamanho).reshape(forma))
+
+def tabela_consumo(litros, setores):
+    # Uma linha por barra do gráfico (setor x origem x família, sem o setor
+    # vazio e sem os demais tipos): o tamanho depende dos setores, não das linhas
+    familias = [f for f, _ in FAMILIAS_COMBUSTIVEL]
+    o, s, f = np.meshgrid(
+        np.arange(len(ORIGENS)), np.arange(len(setores)), np.arange(len(familias)), indexing="ij"
+    )
+    return pd.DataFrame({
+        "Setor": np.asarray(setores, dtype=object)[s.ravel()],
+        "Origem": np.asarray(ORIGENS, dtype=object)[o.ravel()],
+        "Combustível": np.asarray(familias, dtype=object)[f.ravel()],
+        "Litros": litros[:, :len(setores), :len(familias)].ravel(),
+    })
+
+# -------------------------------------------------------------------------
+# PARTIÇÕES POR SETOR
+# -------------------------------------------------------------------------
+# A análise roda uma vez sobre todos os dados; cada achado pertence ao setor
+# da sua linha (na comparação, ao setor de A e, sem A, ao de B). Para cada
+# setor guardamos só os índices e o resumo, e "Todos" é a soma das
+# partições. A última partição reúne as linhas sem setor.
+RESUMO_TOTAIS = ["Total Registros", "Litros Totais"] + [f for f, _ in FAMILIAS_COMBUSTIVEL]
+
+RESUMO_CONTAGENS = [
+    ("Duplicadas A", "duplicadas_a"),
+    ("Duplicadas B", "duplicadas_b"),
+    ("Negativos A", "negativos_a"),
+    ("Negativos B", "negativos_b"),
+    ("Repetidas A", "rep_mesmo_dia_a"),
+    ("Repetidas B", "rep_mesmo_dia_b"),
+    ("Nota dias diferentes A", "nota_diff_a"),
+    ("Nota dias diferentes B", "nota_diff_b"),
+    ("Litragens atípicas A", "litragens_atipicas_a"),
+    ("Litragens atípicas B", "litragens_atipicas_b"),
+    ("Só em A", "notas_apenas_em_a"),
+    ("Só em B", "notas_apenas_em_b"),
+    ("Datas divergentes", "datas_divergentes"),
+    ("Tipos divergentes", "tipos_divergentes"),
+    ("Valores divergentes", "valores_divergentes"),
+    ("Sugestões de pareamento", "sugestoes_pares"),
+    ("Notas de outros períodos", "notas_outro_periodo"),
+]
+
+def _setores_canonicos(serie):
+    # Setores que só diferem em maiúsculas/minúsculas formam uma partição só,
+    # como no antigo filtro por str.upper(). O código -1 (sem setor) cai na última.
+    nomes, canonico, vistos = [], [], {}
+    for c in serie.cat.categories:
+        if c.upper() not in vistos:
+            vistos[c.upper()] = len(nomes)
+            nomes.append(c)
+        canonico.append(vistos[c.upper()])
+    return nomes, np.array(canonico + [len(nomes)], dtype=np.intp)
+
+def _setor_par(codigos_a, codigos_b):
+    return np.where(codigos_a >= 0, codigos_a, codigos_b)
+
+def _chaves_setor(df_a, df_b, pares, sugestoes, historico, canonico):
+    codigos_a = df_a["SETOR"].cat.codes.to_numpy()
+    codigos_b = df_b["SETOR"].cat.codes.to_numpy()
+    par_a = np.where(pares["a"] >= 0, codigos_a[pares["a"]] if len(codigos_a) else -1, -1)
+    par_b = np.where(pares["b"] >= 0, codigos_b[pares["b"]] if len(codigos_b) else -1, -1)
+    sug = _setor_par(
+        sugestoes["SETOR_A"].cat.codes.to_numpy(), sugestoes["SETOR_B"].cat.codes.to_numpy()
+    ) if len(sugestoes) else np.empty(0, dtype=np.intp)
+    hist = historico["SETOR"].cat.codes.to_numpy() if len(historico) else np.empty(0, dtype=np.intp)
+    return {
+        "a": canonico[codigos_a],
+        "b": canonico[codigos_b],
+        "par": canonico[_setor_par(par_a, par_b)],
+        "sugestoes": canonico[sug],
+        "historico": canonico[hist],
+    }
+
+def _particionar(idx, chave, n):
+    chave = chave[idx]
+    ordem = np.argsort(chave, kind="stable")
+    limites = np.append(np.searchsorted(chave[ordem], np.arange(n + 1)), len(chave))
+    return [idx[ordem[limites[i]:limites[i + 1]]] for i in range(n + 1)]
+
+def _resumos_setores(indices, chaves, n, consumo):
+    registros, litros = consumo
+    colunas = {}
+    for o, lado in enumerate("AB"):
+        colunas[f"Total Registros {lado}"] = registros[o].sum(axis=1)
+        colunas[f"Litros Totais {lado}"] = litros[o].sum(axis=1)
+        for f, (familia, _) in enumerate(FAMILIAS_COMBUSTIVEL):
+            colunas[f"{familia} {lado}"] = litros[o, :, f]
+
+    for rotulo, chave_regra in RESUMO_CONTAGENS:
+        chave = chaves[FONTES_REGRAS[chave_regra]][indices[chave_regra]]
+        colunas[rotulo] = np.bincount(chave, minlength=n + 1)
+
+    # Mesma ordem de chaves do resumo de sempre
+    ordem = [f"{r} {lado}" for r in RESUMO_TOTAIS for lado in "AB"]
+    ordem += [r for r, _ in RESUMO_CONTAGENS]
+    inteiros = {r for r, _ in RESUMO_CONTAGENS} | {"Total Registros A", "Total Registros B"}
+
+    def montar(valores):
+        return {k: int(valores[k]) if k in inteiros else float(valores[k]) for k in ordem}
+
+    resumos = [montar({k: v[i] for k, v in colunas.items()}) for i in range(n + 1)]
+    total = montar({k: v.sum() for k, v in colunas.items()})
+    return resumos, total
+
+# -------------------------------------------------------------------------
+# FUNÇÃO PRINCIPAL DE ANÁLISE
+# -------------------------------------------------------------------------
+def _lado_par(valores, posicoes, ausente):
+    if len(valores) == 0:
+        return np.full(len(posicoes), ausente)
+    return np.where(posicoes >= 0, valores[posicoes], ausente)
+
+# Etapas informadas a `progresso` em analisar_setores, na ordem
+ETAPAS_ANALISE = ["Normalizando", "Verificações internas", "Reconciliação", "Totais e achados"]
+
+def analisar_setores(df_a, df_b, estado=None, historico=None, progresso=None):
+    # `estado` (ex.: incremental.EstadoAuditoria) reaproveita as verificações por
+    # nota de uma auditoria anterior e só refaz as notas que mudaram.
+    # `historico` (ex.: historico.HistoricoNotas) aponta notas já usadas em outros
+    # períodos e, no fim da análise, registra as deste período no índice.
+    # `progresso(etapa)` é chamado no início de cada etapa de ETAPAS_ANALISE; uma
+    # exceção lançada por ele interrompe a análise.
+    progresso = progresso or (lambda etapa: None)
+    with etapa("Análise", len(df_a) + len(df_b)):
+        progresso("Normalizando")
+        with etapa("Normalizando", len(df_a) + len(df_b)):
+            df_a, df_b = tipar_planilhas(df_a, df_b)
+
+        tabela_historico = None
+        with etapa("Referências de litragem"):
+            referencias = referencias_planilhas(df_a, df_b)
+        referencias_periodo = referencias
+        if historico is not None:
+            # Litragens comparadas à referência móvel dos últimos períodos e deste
+            with etapa("Histórico", len(df_a) + len(df_b)):
+                tabela_historico = historico.consultar(df_a, df_b)
+                referencias = combinar_referencias(historico.referencias() + [referencias])
+
+        if estado is not None:
+            progresso("Verificações internas")
+            with etapa("Verificações incrementais", len(df_a) + len(df_b)):
+                intra_a, intra_b, pares = estado.verificar(df_a, df_b)
+        else:
+            intra_a, intra_b, pares = verificar_notas(df_a, df_b, progresso)
+
+        progresso("Totais e achados")
+        achados = montar_achados(df_a, df_b, intra_a, intra_b, pares, tabela_historico,
+                                 referencias=referencias)
+
+        if historico is not None:
+            # Só uma análise completa entra no histórico: cancelada ou com erro no
+            # meio, o período não fica registrado pela metade
+            with etapa("Registrando período", len(df_a) + len(df_b)):
+                historico.registrar(df_a, df_b, referencias_periodo)
+        return achados
+
+def montar_achados(df_a, df_b, intra_a, intra_b, pares, historico=None, sugestoes=None,
+                   referencias=None):
+    # `sugestoes` já calculadas substituem sugerir_pares (o modo particionado
+    # sugere pares uma vez só, entre as notas sem par de todas as partições);
+    # `referencias` (de referencias_planilhas) idem para as litragens atípicas
+    indices = {}
+
+    # Divergências internas
+    for sufixo, intra in (("a", intra_a), ("b", intra_b)):
+        indices[f"duplicadas_{sufixo}"] = intra["duplicadas"]
+        indices[f"negativos_{sufixo}"] = intra["negativos"]
+        indices[f"rep_mesmo_dia_{sufixo}"] = intra["rep_mesmo_dia"]
+        indices[f"nota_diff_{sufixo}"] = intra["nota_diff"]
+
+    # Litragens fora do padrão do tipo e setor
+    with etapa("Litragens atípicas", len(df_a) + len(df_b)):
+        if referencias is None:
+            referencias = referencias_planilhas(df_a, df_b)
+        indices["litragens_atipicas_a"] = litragens_atipicas(df_a, "A", referencias)
+        indices["litragens_atipicas_b"] = litragens_atipicas(df_b, "B", referencias)
+
+    # Comparação entre planilhas, direto nos arrays dos pares
+    pos_a, pos_b = pares["a"], pares["b"]
+    indices["merged"] = np.arange(len(pos_a))
+    indices["notas_apenas_em_a"] = np.flatnonzero(pos_b < 0)
+    indices["notas_apenas_em_b"] = np.flatnonzero(pos_a < 0)
+
+    if sugestoes is None:
+        with etapa("Sugestões de pareamento") as e:
+            sugestoes = sugerir_pares(df_a, df_b, pares)
+            e.linhas = len(sugestoes)
+    indices["sugestoes_pares"] = np.arange(len(sugestoes))
+
+    # Lado ausente conta como divergente, como no antigo merge externo; dia nulo nunca confere
+    dia_a = _lado_par(df_a["DIA"].to_numpy(), pos_a, DIA_NULO)
+    dia_b = _lado_par(df_b["DIA"].to_numpy(), pos_b, DIA_NULO)
+    indices["datas_divergentes"] = np.flatnonzero(
+        (pos_a < 0) | (pos_b < 0) | (dia_a != dia_b) | (dia_a == DIA_NULO)
+    )
+
+    tipo_a = _lado_par(df_a["TIPO"].cat.codes.to_numpy(), pos_a, -1)
+    tipo_b = _lado_par(df_b["TIPO"].cat.codes.to_numpy(), pos_b, -1)
+    indices["tipos_divergentes"] = np.flatnonzero(tipo_a != tipo_b)
+
+    valor_a = _lado_par(df_a["VALOR"].to_numpy(), pos_a, np.nan)
+    valor_b = _lado_par(df_b["VALOR"].to_numpy(), pos_b, np.nan)
+    indices["valores_divergentes"] = np.flatnonzero(~np.isclose(
+        np.where(np.isnan(valor_a), -999999, valor_a), np.where(np.isnan(valor_b), -888888, valor_b)
+    ))
+
+    n_historico = len(historico) if historico is not None else 0
+    indices["notas_outro_periodo"] = np.arange(n_historico)
+
+    indices["df_a"] = np.arange(len(df_a))
+    indices["df_b"] = np.arange(len(df_b))
+
+    # Partições por setor e resumos (o de "Todos" é a soma das partições)
+    with etapa("Totais por setor", len(df_a) + len(df_b)):
+        setores, canonico = _setores_canonicos(df_a["SETOR"])
+        n = len(setores)
+        historico = historico if historico is not None else pd.DataFrame({"SETOR": df_a["SETOR"].iloc[:0]})
+        chaves = _chaves_setor(df_a, df_b, pares, sugestoes, historico, canonico)
+        consumo = consumo_setores(df_a, df_b, chaves["a"], chaves["b"], n)
+        resumos, resumo = _resumos_setores(indices, chaves, n, consumo)
+        particoes = {
+            "setores": setores,
+            "indices": {
+                chave: _particionar(idx, chaves[FONTES_REGRAS[chave]], n)
+                for chave, idx in indices.items()
+            },
+            "resumos": resumos,
+        }
+
+    return Achados(df_a, df_b, pares, sugestoes, indices, resumo, particoes, historico=historico,
+                   consumo=tabela_consumo(consumo[1], setores))
+
+def analisar(df_a, df_b, setor="Todos", estado=None, historico=None):
+    return analisar_setores(df_a, df_b, estado, historico).fatiar(setor)
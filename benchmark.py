@@ -0,0 +1,207 @@
+import gc
+import os
+import sys
+import json
+import time
+import ctypes
+import argparse
+import platform
+import threading
+
+from ingestao import normalize_df, ler_planilha_colunas
+from auditoria import analisar_setores
+from relatorios import gerar_excel, gerar_pdf, gerar_pdf_detalhado
+from dados_sinteticos import gerar_planilhas, gerar_arquivos, LIMITE_LINHAS_XLSX, FORMATOS_ARQUIVO
+from instrumentacao import rss
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+# Mede tempo e pico de memória de cada etapa da auditoria sobre planilhas
+# sintéticas (dados_sinteticos.py) de vários tamanhos e compara com uma base
+# gravada antes, para pegar regressões. O pico de memória é o maior RSS do
+# processo durante a etapa menos o RSS no início, amostrado por uma thread a
+# cada INTERVALO_AMOSTRA segundos (o tracemalloc deixaria a leitura e o Excel,
+# que alocam muitos objetos pequenos, dezenas de vezes mais lentos).
+TAMANHOS_PADRAO = [10_000, 100_000]
+ETAPAS = ["leitura", "normalize_df", "analisar", "gerar_excel", "gerar_pdf", "gerar_pdf_detalhado"]
+
+# Cada etapa roda REPETICOES vezes e fica a melhor medida (o ruído da máquina só piora)
+REPETICOES = 3
+
+ARQUIVO_BASE = "benchmark_base.json"
+DADOS_DIR = os.environ.get("COMPARADOR_BENCHMARK_DIR", ".benchmark_dados")
+
+# Regressão: mais lento/maior que a base além da tolerância E da folga absoluta
+# (etapas de milissegundos oscilam muito em termos relativos)
+TOLERANCIA_TEMPO = 0.25
+TOLERANCIA_MEMORIA = 0.20
+FOLGA_SEGUNDOS = 0.05
+FOLGA_MB = 2.0
+
+INTERVALO_AMOSTRA = 0.005
+
+# -------------------------------------------------------------------------
+# MEDIÇÃO
+# -------------------------------------------------------------------------
+def _devolver_memoria():
+    # Devolve ao sistema o que a etapa anterior liberou, para o RSS inicial de
+    # cada etapa não esconder o seu pico (glibc; nos demais sistemas, nada)
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def medir(funcao):
+    # Executa `funcao()`; devolve o resultado e {segundos, pico_mb}
+    _devolver_memoria()
+    inicial = rss()
+    pico = [inicial or 0]
+    parar = threading.Event()
+
+    def amostrar():
+        while not parar.wait(INTERVALO_AMOSTRA):
+            pico[0] = max(pico[0], rss())
+
+    amostrador = threading.Thread(target=amostrar, daemon=True) if inicial is not None else None
+    if amostrador:
+        amostrador.start()
+    try:
+        inicio = time.perf_counter()
+        resultado = funcao()
+        segundos = time.perf_counter() - inicio
+    finally:
+        parar.set()
+        if amostrador:
+            amostrador.join()
+    pico_mb = (max(pico[0], rss() or 0) - inicial) / 2 ** 20 if inicial is not None else 0.0
+    return resultado, {"segundos": round(segundos, 4), "pico_mb": round(pico_mb, 2)}
+
+def _melhor(medidas):
+    # Entre repetições, o menor tempo e o menor pico (o ruído só aumenta os dois)
+    return {k: min(m[k] for m in medidas) for k in medidas[0]}
+
+def _arquivos(linhas, semente, formato):
+    # Os arquivos de cada tamanho e formato são gerados uma vez e reaproveitados
+    pasta = os.path.join(DADOS_DIR, f"{linhas}-{semente}")
+    caminhos = os.path.join(pasta, f"POSTO.{formato}"), os.path.join(pasta, f"PMM.{formato}")
+    if not all(os.path.exists(c) for c in caminhos):
+        caminhos, _ = gerar_arquivos(linhas, pasta, semente=semente, formato=formato)
+    return caminhos
+
+def medir_tamanho(linhas, etapas=ETAPAS, semente=0, repeticoes=REPETICOES, log=print, formato="xlsx"):
+    # {etapa: {segundos, pico_mb}} para planilhas sintéticas de `linhas` linhas
+    # lidas de arquivos em `formato`. Acima do limite do XLSX a leitura usa CSV
+    # e não há Excel.
+    posto, pmm, _ = gerar_planilhas(linhas, semente=semente)
+    cabe_xlsx = max(len(posto), len(pmm)) <= LIMITE_LINHAS_XLSX
+    if formato == "xlsx" and not cabe_xlsx:
+        formato = "csv"
+        log("  (acima do limite do XLSX: leitura em CSV)")
+
+    passos = []
+    if "leitura" in etapas:
+        caminhos = _arquivos(linhas, semente, formato)
+        passos.append(("leitura", lambda: [ler_planilha_colunas(c) for c in caminhos]))
+    if "normalize_df" in etapas:
+        passos.append(("normalize_df", lambda: [normalize_df(df) for df in (posto, pmm)]))
+    passos.append(("analisar", lambda: analisar_setores(posto, pmm)))
+    if "gerar_excel" in etapas and cabe_xlsx:
+        passos.append(("gerar_excel", lambda: gerar_excel(resultado)))
+    if "gerar_pdf" in etapas:
+        passos.append(("gerar_pdf", lambda: gerar_pdf(resultado)))
+    if "gerar_pdf_detalhado" in etapas:
+        passos.append(("gerar_pdf_detalhado", lambda: gerar_pdf_detalhado(resultado)))
+
+    medidas = {"linhas": len(posto) + len(pmm)}
+    resultado = None
+    for etapa, funcao in passos:
+        rodadas = []
+        for _ in range(repeticoes):
+            saida, medida = medir(funcao)
+            rodadas.append(medida)
+        if etapa == "analisar":
+            resultado = saida
+        del saida
+        if etapa in etapas:
+            medidas[etapa] = _melhor(rodadas)
+            log(f"  {etapa:<20} {medidas[etapa]['segundos']:>9.3f} s {medidas[etapa]['pico_mb']:>10.1f} MB")
+    return medidas
+
+# -------------------------------------------------------------------------
+# COMPARAÇÃO COM A BASE
+# -------------------------------------------------------------------------
+def comparar(atual, base):
+    # Lista de (tamanho, etapa, medida, base, atual) que pioraram além da tolerância
+    regressoes = []
+    for tamanho, etapas in atual.items():
+        for etapa, medida in etapas.items():
+            anterior = base.get(tamanho, {}).get(etapa)
+            if etapa == "linhas" or anterior is None:
+                continue
+            for chave, tolerancia, folga in (("segundos", TOLERANCIA_TEMPO, FOLGA_SEGUNDOS),
+                                             ("pico_mb", TOLERANCIA_MEMORIA, FOLGA_MB)):
+                if medida[chave] > anterior[chave] * (1 + tolerancia) and medida[chave] - anterior[chave] > folga:
+                    regressoes.append((tamanho, etapa, chave, anterior[chave], medida[chave]))
+    return regressoes
+
+def rodar_benchmark(tamanhos=TAMANHOS_PADRAO, etapas=ETAPAS, semente=0, repeticoes=REPETICOES, log=print,
+                    formato="xlsx"):
+    resultados = {}
+    for linhas in tamanhos:
+        log(f"\n--- {linhas} linhas por planilha ---")
+        resultados[str(linhas)] = medir_tamanho(linhas, etapas, semente, repeticoes, log, formato)
+    return {
+        "python": platform.python_version(),
+        "maquina": platform.machine(),
+        "semente": semente,
+        "formato": formato,
+        "resultados": resultados,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede tempo e memória da auditoria em dados sintéticos.")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS_PADRAO,
+                        help="linhas por planilha (ex.: 10000 100000 1000000 5000000)")
+    parser.add_argument("--etapas", nargs="+", choices=ETAPAS, default=ETAPAS)
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--formato", choices=FORMATOS_ARQUIVO, default="xlsx",
+                        help="formato dos arquivos lidos na etapa de leitura (padrão: xlsx)")
+    parser.add_argument("--repeticoes", type=int, default=REPETICOES,
+                        help=f"fica o melhor de N rodadas (padrão: {REPETICOES})")
+    parser.add_argument("--base", default=ARQUIVO_BASE, help=f"medição de referência (padrão: {ARQUIVO_BASE})")
+    parser.add_argument("--gravar-base", action="store_true", help="grava esta medição como a nova base")
+    parser.add_argument("--saida", help="grava esta medição em JSON")
+    args = parser.parse_args()
+
+    medicao = rodar_benchmark(args.tamanhos, args.etapas, args.semente, args.repeticoes, formato=args.formato)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(medicao, f, indent=1)
+
+    if args.gravar_base:
+        with open(args.base, "w", encoding="utf-8") as f:
+            json.dump(medicao, f, indent=1)
+        print(f"\n✔ Base gravada em '{args.base}'.")
+        sys.exit(0)
+
+    if not os.path.exists(args.base):
+        print(f"\n(sem base em '{args.base}'; use --gravar-base para criar uma)")
+        sys.exit(0)
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    if base.get("semente") != medicao["semente"]:
+        print(f"\n⚠ A base usa a semente {base.get('semente')}; os dados não são os mesmos.")
+    if base.get("formato", "xlsx") != medicao["formato"]:
+        print(f"\n⚠ A base lê arquivos {base.get('formato', 'xlsx')}; a leitura não é comparável.")
+
+    regressoes = comparar(medicao["resultados"], base["resultados"])
+    if not regressoes:
+        print("\n✔ Nenhuma regressão em relação à base.")
+        sys.exit(0)
+    print("\n❌ Regressões em relação à base:")
+    for tamanho, etapa, chave, anterior, atual in regressoes:
+        print(f"  - {tamanho} linhas, {etapa}, {chave}: {anterior} -> {atual}")
+    sys.exit(1)
@@ -1,19 +1,36 @@
+import sys
+import argparse
+
 import pandas as pd
 import numpy as np
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.pagesizes import A4
+from ingestao import carregar_planilha
+from auditoria import (
+    tipar_planilhas, verificar_notas, montar_comparacao, referencias_planilhas,
+    combinar_referencias, pontuar_litragens, LIMIAR_ATIPICO,
+)
+from incremental import EstadoAuditoria
+from historico import HistoricoNotas, COLUNAS_HISTORICO
+from instrumentacao import etapa, perfilar
+from relatorios import (
+    escrever_pdf_paginado, blocos_dataframe, COLUNAS_PLANILHA, COLUNAS_COMPARACAO,
+)
 
 
 # --- CONFIGURAÇÃO ---
 ARQUIVO_A = 'POSTO.xlsx'
 ARQUIVO_B = 'PMM.xlsx'
+ARQUIVO_PDF = 'relatorio_abastecimentos.pdf'
+
+# Nomes das colunas após a normalização feita em ingestao.normalize_df
+COLUNA_DATA = 'DATA'
+COLUNA_NOTA = 'NOTA'
+COLUNA_TIPO = 'TIPO'
+COLUNA_VALOR = 'VALOR'
+COLUNA_SETOR = 'SETOR'
 
-COLUNA_DATA = 'Data'
-COLUNA_NOTA = 'Numero_Nota'
-COLUNA_TIPO = 'Tipo_Combustivel'
-COLUNA_VALOR = 'Litragem'
-COLUNA_SETOR = 'Setor'
+# "texto" imprime o relatório legível; "csv" e "jsonl" gravam uma tabela única
+# com todas as ocorrências (coluna REGRA indica a verificação)
+FORMATOS_SAIDA = ['texto', 'csv', 'jsonl']
 
 
 # --------------------
@@ -23,221 +40,341 @@ def formatar_data(series):
     return datas_convertidas.dt.strftime('%d/%m/%Y').fillna('Data Inválida/Nula')
 
 
-# Substitua sua função 'comparar_planilhas' por esta versão corrigida
+def _texto(series):
+    # Mesmo texto que o f-string de cada valor (NaN vira "nan")
+    return series.astype(str)
+
+
+def gravar_achados(achados, formato, saida):
+    arquivo = sys.stdout if saida in (None, '-') else open(saida, 'w', encoding='utf-8', newline='')
+    try:
+        if formato == 'csv':
+            tabela = pd.concat(achados, ignore_index=True) if achados else pd.DataFrame(columns=['REGRA', 'PLANILHA'])
+            tabela.to_csv(arquivo, index=False, date_format='%Y-%m-%d')
+        else:
+            # Em JSON Lines cada verificação leva só as suas colunas
+            for tabela in achados:
+                linhas = tabela.to_json(orient='records', lines=True, date_format='iso', force_ascii=False)
+                arquivo.write(linhas.rstrip('\n') + '\n')
+    finally:
+        if arquivo is not sys.stdout:
+            arquivo.close()
+
+
+def comparar_planilhas(arquivo_a=ARQUIVO_A, arquivo_b=ARQUIVO_B, formato='texto', saida=None,
+                       arquivo_pdf=ARQUIVO_PDF, estado=None, historico=None):
+    # Devolve o resumo da comparação (None se as planilhas não puderam ser lidas);
+    # sem `arquivo_pdf`, o PDF detalhado não é gerado. `estado` é um
+    # incremental.EstadoAuditoria para reaproveitar a auditoria anterior;
+    # `historico` é um historico.HistoricoNotas do período desta auditoria.
+    # Com tabela estruturada no stdout, as mensagens legíveis vão para o stderr
+    if formato != 'texto' and saida in (None, '-'):
+        def log(*args):
+            print(*args, file=sys.stderr)
+    else:
+        log = print
+
+    achados = []
+
+    def registrar(regra, planilha, tabela, titulo, linhas):
+        # Uma tabela por verificação; o texto é montado de forma vetorizada
+        if tabela.empty:
+            return
+        if formato == 'texto':
+            log('\n'.join(([titulo] if titulo else []) + linhas.tolist()))
+        else:
+            achados.append(tabela.assign(REGRA=regra, PLANILHA=planilha)[
+                ['REGRA', 'PLANILHA'] + list(tabela.columns)
+            ])
 
-def comparar_planilhas():
     try:
-        df_a = pd.read_excel(ARQUIVO_A)
-        df_b = pd.read_excel(ARQUIVO_B)
+        with etapa("Leitura A") as e:
+            df_a = carregar_planilha(arquivo_a)
+            e.linhas = len(df_a)
+        with etapa("Leitura B") as e:
+            df_b = carregar_planilha(arquivo_b)
+            e.linhas = len(df_b)
 
-        print(f"✔ Planilha '{ARQUIVO_A}' carregada com {len(df_a)} registros.")
-        print(f"✔ Planilha '{ARQUIVO_B}' carregada com {len(df_b)} registros.\n")
+        log(f"✔ Planilha '{arquivo_a}' carregada com {len(df_a)} registros.")
+        log(f"✔ Planilha '{arquivo_b}' carregada com {len(df_b)} registros.\n")
 
     except FileNotFoundError as e:
-        print(f"❌ ERRO: Arquivo não encontrado! Verifique se o nome '{e.filename}' está correto.")
+        log(f"❌ ERRO: Arquivo não encontrado! Verifique se o nome '{e.filename}' está correto.")
         return
     except Exception as e:
-        print(f"❌ ERRO inesperado ao ler as planilhas: {e}")
+        log(f"❌ ERRO inesperado ao ler as planilhas: {e}")
         return
 
-    df_a[COLUNA_NOTA] = df_a[COLUNA_NOTA].astype(str).str.zfill(4)
-    df_b[COLUNA_NOTA] = df_b[COLUNA_NOTA].astype(str).str.zfill(4)
+    with etapa("Normalizando", len(df_a) + len(df_b)):
+        df_a, df_b = tipar_planilhas(df_a, df_b)
+
+    if estado is not None:
+        # Reauditoria incremental: só as notas que mudaram são verificadas de novo
+        with etapa("Verificações incrementais", len(df_a) + len(df_b)):
+            intra_a, intra_b, pares = estado.verificar(df_a, df_b)
+        log(f"↻ {estado.ultima['notas_refeitas']} de {estado.ultima['notas']} notas verificadas de novo.")
+    else:
+        # Todas as verificações internas de cada planilha em uma única passada
+        intra_a, intra_b, pares = verificar_notas(df_a, df_b)
 
     # =====================================================================
-    # 1. VALORES NEGATIVOS E LITRAGENS ANORMALMENTE ALTAS (sem limites fixos)
+    # 1. VALORES NEGATIVOS
     # =====================================================================
-    print("\n--- VERIFICANDO VALORES INVÁLIDOS DE LITRAGEM ---")
-
-    negativos_a = df_a[df_a[COLUNA_VALOR] < 0]
-    negativos_b = df_b[df_b[COLUNA_VALOR] < 0]
-
-    if not negativos_a.empty:
-        print(f"\n[ERRO] Litragens negativas na planilha {ARQUIVO_A}:")
-        for _, row in negativos_a.iterrows():
-            print(f"  - Nota: {row[COLUNA_NOTA]} | Litragem: {row[COLUNA_VALOR]}")
-
-    if not negativos_b.empty:
-        print(f"\n[ERRO] Litragens negativas na planilha {ARQUIVO_B}:")
-        for _, row in negativos_b.iterrows():
-            print(f"  - Nota: {row[COLUNA_NOTA]} | Litragem: {row[COLUNA_VALOR]}")
+    log("\n--- VERIFICANDO VALORES INVÁLIDOS DE LITRAGEM ---")
 
-    # Detectar valores incomuns estatisticamente (acima do percentil 99)
-    limite_alto_a = df_a[COLUNA_VALOR].quantile(0.99)
-    limite_alto_b = df_b[COLUNA_VALOR].quantile(0.99)
+    def litragens(regra, titulo, df, nome_arquivo):
+        registrar(
+            regra, nome_arquivo, df[COLUNAS_PLANILHA], f"\n{titulo} {nome_arquivo}:",
+            "  - Nota: " + _texto(df[COLUNA_NOTA]) + " | Litragem: " + _texto(df[COLUNA_VALOR]),
+        )
 
-    altos_a = df_a[df_a[COLUNA_VALOR] > limite_alto_a]
-    altos_b = df_b[df_b[COLUNA_VALOR] > limite_alto_b]
+    negativos_a = df_a.iloc[intra_a["negativos"]]
+    negativos_b = df_b.iloc[intra_b["negativos"]]
 
-    if not altos_a.empty:
-        print(f"\n[ALERTA] Litragens incomuns (muito acima do normal) na planilha {ARQUIVO_A}:")
-        for _, row in altos_a.iterrows():
-            print(f"  - Nota: {row[COLUNA_NOTA]} | Litragem: {row[COLUNA_VALOR]}")
-
-    if not altos_b.empty:
-        print(f"\n[ALERTA] Litragens incomuns (muito acima do normal) na planilha {ARQUIVO_B}:")
-        for _, row in altos_b.iterrows():
-            print(f"  - Nota: {row[COLUNA_NOTA]} | Litragem: {row[COLUNA_VALOR]}")
+    litragens("negativos", "[ERRO] Litragens negativas na planilha", negativos_a, arquivo_a)
+    litragens("negativos", "[ERRO] Litragens negativas na planilha", negativos_b, arquivo_b)
 
     # =====================================================================
-    # 2. LITROS INCOMPATÍVEIS COM O TIPO (estatístico, sem limites fixos)
+    # 2. LITRAGENS ATÍPICAS PARA O TIPO E O SETOR (mediana e MAD, sem limites fixos)
     # =====================================================================
-    print("\n--- ANALISANDO CONSISTÊNCIA ENTRE TIPO DE COMBUSTÍVEL E LITRAGEM ---")
-
-    def analisar_tipo(df, nome_arquivo):
-        for tipo in df[COLUNA_TIPO].dropna().unique():
-            tipo_filtro = str(tipo).upper()
-            subset = df[df[COLUNA_TIPO].str.upper() == tipo_filtro]
-
-            if subset.empty:
-                continue
-
-            media = subset[COLUNA_VALOR].mean()
-
-            # Procurar registros muito fora da média
-            suspeitos = subset[subset[COLUNA_VALOR] > media * 2]
-
-            for _, row in suspeitos.iterrows():
-                print(f"[ALERTA] Litragem fora do padrão do tipo na planilha {nome_arquivo}:")
-                print(f"  - Nota {row[COLUNA_NOTA]} | Tipo: {tipo_filtro} | Litragem: {row[COLUNA_VALOR]} (média: {media:.1f})")
-
-    analisar_tipo(df_a, ARQUIVO_A)
-    analisar_tipo(df_b, ARQUIVO_B)
+    log("\n--- ANALISANDO LITRAGENS FORA DO PADRÃO DO TIPO E DO SETOR ---")
+
+    # Com período informado, a referência é móvel: os últimos períodos e este
+    with etapa("Referências de litragem"):
+        referencias = referencias_planilhas(df_a, df_b)
+        referencias_periodo = referencias
+        if historico is not None:
+            referencias = combinar_referencias(historico.referencias() + [referencias])
+
+    def atipicas(df, lado, nome_arquivo):
+        mediana, pontuacao = pontuar_litragens(df, lado, referencias)
+        atipica = pontuacao > LIMIAR_ATIPICO
+        linhas = df[atipica]
+        mediana = pd.Series(mediana[atipica], index=linhas.index).round(1)
+        pontuacao = pd.Series(pontuacao[atipica], index=linhas.index).round(1)
+
+        registrar(
+            "litragem_atipica", nome_arquivo,
+            linhas[COLUNAS_PLANILHA].assign(MEDIANA=mediana, PONTUACAO=pontuacao),
+            f"\n[ALERTA] Litragens fora do padrão do tipo e do setor na planilha {nome_arquivo}:",
+            "  - Nota " + _texto(linhas[COLUNA_NOTA]) + " | Tipo: " + _texto(linhas[COLUNA_TIPO])
+            + " | Setor: " + _texto(linhas[COLUNA_SETOR]) + " | Litragem: " + _texto(linhas[COLUNA_VALOR])
+            + " (mediana: " + _texto(mediana) + ", pontuação: " + _texto(pontuacao) + ")",
+        )
+        return linhas
+
+    with etapa("Litragens atípicas", len(df_a) + len(df_b)):
+        atipicas_a = atipicas(df_a, "A", arquivo_a)
+        atipicas_b = atipicas(df_b, "B", arquivo_b)
 
     # =====================================================================
     # 3. NOTAS REPETIDAS NO MESMO DIA COM MESMA LITRAGEM
     # =====================================================================
-    print("\n--- CHECANDO NOTAS DUPLICADAS NO MESMO DIA E MESMA LITRAGEM ---")
+    log("\n--- CHECANDO NOTAS DUPLICADAS NO MESMO DIA E MESMA LITRAGEM ---")
 
-    def repetidas_mesmo_dia(df, nome_arquivo):
-        df_aux = df.copy()
-        df_aux['DataFmt'] = pd.to_datetime(df_aux[COLUNA_DATA], errors='coerce').dt.strftime("%d/%m/%Y")
+    def repetidas_mesmo_dia(df, intra, nome_arquivo):
+        duplicadas = df.iloc[intra["rep_mesmo_dia"]]
 
-        duplicadas = df_aux[df_aux.duplicated(subset=['DataFmt', COLUNA_NOTA, COLUNA_VALOR], keep=False)]
+        registrar(
+            "rep_mesmo_dia", nome_arquivo, duplicadas[COLUNAS_PLANILHA],
+            f"\n[ALERTA] Notas repetidas no mesmo dia e com a mesma litragem em {nome_arquivo}:",
+            "  - Data: " + formatar_data(duplicadas[COLUNA_DATA]) + " | Nota: " + _texto(duplicadas[COLUNA_NOTA])
+            + " | Litragem: " + _texto(duplicadas[COLUNA_VALOR]),
+        )
 
-        if not duplicadas.empty:
-            print(f"\n[ALERTA] Notas repetidas no mesmo dia e com a mesma litragem em {nome_arquivo}:")
-            for _, row in duplicadas.iterrows():
-                print(
-                    f"  - Data: {row['DataFmt']} | Nota: {row[COLUNA_NOTA]} | Litragem: {row[COLUNA_VALOR]}"
-                )
-
-    repetidas_mesmo_dia(df_a, ARQUIVO_A)
-    repetidas_mesmo_dia(df_b, ARQUIVO_B)
+    repetidas_mesmo_dia(df_a, intra_a, arquivo_a)
+    repetidas_mesmo_dia(df_b, intra_b, arquivo_b)
 
     # =====================================================================
     # 4. MESMA NOTA EM DIAS DIFERENTES
     # =====================================================================
-    print("\n--- VERIFICANDO MESMA NOTA EM DIAS DIFERENTES ---")
-
-    def nota_em_dias_diferentes(df, nome_arquivo):
-        df_aux = df.copy()
-        df_aux['DataFmt'] = pd.to_datetime(df_aux[COLUNA_DATA], errors='coerce').dt.strftime("%d/%m/%Y")
+    log("\n--- VERIFICANDO MESMA NOTA EM DIAS DIFERENTES ---")
 
-        conflitos = df_aux.groupby(COLUNA_NOTA)['DataFmt'].nunique()
-        conflitos = conflitos[conflitos > 1]
+    def nota_em_dias_diferentes(df, intra, nome_arquivo):
+        conflitos = df.iloc[intra["nota_diff"]]
 
-        if not conflitos.empty:
-            print(f"\n[ERRO] Mesma nota utilizada em dias diferentes na planilha {nome_arquivo}:")
-            for nota in conflitos.index:
-                datas = df_aux[df_aux[COLUNA_NOTA] == nota]['DataFmt'].unique()
-                print(f"  - Nota {nota} usada nas datas: {', '.join(datas)}")
+        datas = pd.DataFrame({COLUNA_NOTA: conflitos[COLUNA_NOTA], COLUNA_DATA: formatar_data(conflitos[COLUNA_DATA])})
+        datas = datas.drop_duplicates().groupby(COLUNA_NOTA, observed=True)[COLUNA_DATA].agg(', '.join)
+        registrar(
+            "nota_diff", nome_arquivo, conflitos[COLUNAS_PLANILHA],
+            f"\n[ERRO] Mesma nota utilizada em dias diferentes na planilha {nome_arquivo}:",
+            "  - Nota " + _texto(datas.index.to_series()) + " usada nas datas: " + datas,
+        )
 
-    nota_em_dias_diferentes(df_a, ARQUIVO_A)
-    nota_em_dias_diferentes(df_b, ARQUIVO_B)
+    nota_em_dias_diferentes(df_a, intra_a, arquivo_a)
+    nota_em_dias_diferentes(df_b, intra_b, arquivo_b)
 
     # =====================================================================
-    # 5. MERGE E VERIFICAÇÕES ORIGINAIS
+    # 5. PAREAMENTO UM-PARA-UM E VERIFICAÇÕES ORIGINAIS
     # =====================================================================
-    df_merged = pd.merge(df_a, df_b, on=COLUNA_NOTA, suffixes=('_A', '_B'), how='outer')
-
-    print("\n--- INICIANDO ANÁLISE DE DIVERGÊNCIAS ---")
-
-    notas_apenas_em_a = df_merged[df_merged[f'{COLUNA_VALOR}_B'].isnull()]
-    notas_apenas_em_b = df_merged[df_merged[f'{COLUNA_VALOR}_A'].isnull()]
-
-    if not notas_apenas_em_a.empty:
-        print(f"\n[AVISO] Notas APENAS na planilha {ARQUIVO_A}:")
-        for _, row in notas_apenas_em_a.iterrows():
-            data_formatada = formatar_data(pd.Series([row[f'{COLUNA_DATA}_A']])).iloc[0]
-            print(f"  - Data: {data_formatada} | Nota: {row[COLUNA_NOTA]} | Litragem: {row[f'{COLUNA_VALOR}_A']}")
-
-    if not notas_apenas_em_b.empty:
-        print(f"\n[AVISO] Notas APENAS na planilha {ARQUIVO_B}:")
-        for _, row in notas_apenas_em_b.iterrows():
-            data_formatada = formatar_data(pd.Series([row[f'{COLUNA_DATA}_B']])).iloc[0]
-            print(
-                f"  - Data: {data_formatada} | Nota: {row[COLUNA_NOTA]} | Litragem: {row[f'{COLUNA_VALOR}_B']} (Setor: {row[COLUNA_SETOR]})"
-            )
-
-    df_comum = df_merged.dropna(subset=[f'{COLUNA_VALOR}_A', f'{COLUNA_VALOR}_B']).copy()
+    with etapa("Comparação", len(pares['a'])):
+        df_merged = montar_comparacao(df_a, df_b, pares)
+
+    log("\n--- INICIANDO ANÁLISE DE DIVERGÊNCIAS ---")
+
+    notas_apenas_em_a = df_merged[pares['b'] < 0]
+    notas_apenas_em_b = df_merged[pares['a'] < 0]
+
+    registrar(
+        "apenas_em_a", arquivo_a, notas_apenas_em_a[COLUNAS_COMPARACAO],
+        f"\n[AVISO] Notas APENAS na planilha {arquivo_a}:",
+        "  - Data: " + formatar_data(notas_apenas_em_a[f'{COLUNA_DATA}_A']) + " | Nota: "
+        + _texto(notas_apenas_em_a[COLUNA_NOTA]) + " | Litragem: " + _texto(notas_apenas_em_a[f'{COLUNA_VALOR}_A']),
+    )
+    registrar(
+        "apenas_em_b", arquivo_b, notas_apenas_em_b[COLUNAS_COMPARACAO],
+        f"\n[AVISO] Notas APENAS na planilha {arquivo_b}:",
+        "  - Data: " + formatar_data(notas_apenas_em_b[f'{COLUNA_DATA}_B']) + " | Nota: "
+        + _texto(notas_apenas_em_b[COLUNA_NOTA]) + " | Litragem: " + _texto(notas_apenas_em_b[f'{COLUNA_VALOR}_B'])
+        + " (Setor: " + _texto(notas_apenas_em_b[f'{COLUNA_SETOR}_B']) + ")",
+    )
+
+    df_comum = df_merged[(pares['a'] >= 0) & (pares['b'] >= 0)].copy()
 
     # DATAS DIVERGENTES
     df_comum[f'{COLUNA_DATA}_A'] = pd.to_datetime(df_comum[f'{COLUNA_DATA}_A'], errors='coerce')
     df_comum[f'{COLUNA_DATA}_B'] = pd.to_datetime(df_comum[f'{COLUNA_DATA}_B'], errors='coerce')
 
     datas_erradas = df_comum[df_comum[f'{COLUNA_DATA}_A'] != df_comum[f'{COLUNA_DATA}_B']]
-    if not datas_erradas.empty:
-        print("\n[ERRO] Datas divergentes:")
-        for _, row in datas_erradas.iterrows():
-            print(
-                f"  - Nota {row[COLUNA_NOTA]} | "
-                f"{formatar_data(pd.Series([row[f'{COLUNA_DATA}_A']])).iloc[0]} vs "
-                f"{formatar_data(pd.Series([row[f'{COLUNA_DATA}_B']])).iloc[0]}"
-            )
+    registrar(
+        "datas_divergentes", None, datas_erradas[COLUNAS_COMPARACAO], "\n[ERRO] Datas divergentes:",
+        "  - Nota " + _texto(datas_erradas[COLUNA_NOTA]) + " | " + formatar_data(datas_erradas[f'{COLUNA_DATA}_A'])
+        + " vs " + formatar_data(datas_erradas[f'{COLUNA_DATA}_B']),
+    )
 
     # TIPOS DIVERGENTES
     tipos_trocados = df_comum[df_comum[f'{COLUNA_TIPO}_A'] != df_comum[f'{COLUNA_TIPO}_B']]
-    if not tipos_trocados.empty:
-        print("\n[ERRO] Tipos divergentes:")
-        for _, row in tipos_trocados.iterrows():
-            print(
-                f"  - Nota {row[COLUNA_NOTA]} | {row[f'{COLUNA_TIPO}_A']} vs {row[f'{COLUNA_TIPO}_B']}"
-            )
+    registrar(
+        "tipos_divergentes", None, tipos_trocados[COLUNAS_COMPARACAO], "\n[ERRO] Tipos divergentes:",
+        "  - Nota " + _texto(tipos_trocados[COLUNA_NOTA]) + " | " + _texto(tipos_trocados[f'{COLUNA_TIPO}_A'])
+        + " vs " + _texto(tipos_trocados[f'{COLUNA_TIPO}_B']),
+    )
 
     # LITRAGEM DIVERGENTE
     valores_errados = df_comum[~np.isclose(df_comum[f'{COLUNA_VALOR}_A'], df_comum[f'{COLUNA_VALOR}_B'])]
-    if not valores_errados.empty:
-        print("\n[ERRO] Litragem divergente:")
-        for _, row in valores_errados.iterrows():
-            print(
-                f"  - Nota {row[COLUNA_NOTA]} | {row[f'{COLUNA_VALOR}_A']}L vs {row[f'{COLUNA_VALOR}_B']}L"
-            )
-
-    print("\n--- ANÁLISE CONCLUÍDA ---")
+    registrar(
+        "valores_divergentes", None, valores_errados[COLUNAS_COMPARACAO], "\n[ERRO] Litragem divergente:",
+        "  - Nota " + _texto(valores_errados[COLUNA_NOTA]) + " | " + _texto(valores_errados[f'{COLUNA_VALOR}_A'])
+        + "L vs " + _texto(valores_errados[f'{COLUNA_VALOR}_B']) + "L",
+    )
 
     # =====================================================================
-    # 7. GERAR RELATÓRIO EM PDF
+    # 6. NOTAS JÁ USADAS EM OUTROS PERÍODOS
     # =====================================================================
-    print("Gerando relatório em PDF...")
-
-    styles = getSampleStyleSheet()
-    pdf = SimpleDocTemplate("relatorio_abastecimentos.pdf", pagesize=A4)
-
-    story = []
-
-    def add(titulo, conteudo):
-        story.append(Paragraph(f"<b>{titulo}</b>", styles["Heading3"]))
-        story.append(Paragraph(conteudo, styles["BodyText"]))
-        story.append(Spacer(1, 12))
+    notas_outro_periodo = None
+    if historico is not None:
+        log("\n--- VERIFICANDO NOTAS JÁ USADAS EM OUTROS PERÍODOS ---")
+
+        with etapa("Histórico", len(df_a) + len(df_b)):
+            notas_outro_periodo = historico.consultar(df_a, df_b)
+
+        for lado, nome_arquivo in (("A", arquivo_a), ("B", arquivo_b)):
+            reusadas = notas_outro_periodo[notas_outro_periodo["PLANILHA"] == lado]
+            registrar(
+                "nota_outro_periodo", nome_arquivo, reusadas.drop(columns="PLANILHA"),
+                f"\n[ALERTA] Notas já usadas em outros períodos na planilha {nome_arquivo}:",
+                "  - Nota " + _texto(reusadas[COLUNA_NOTA]) + " | Data: " + formatar_data(reusadas[COLUNA_DATA])
+                + " | Período anterior: " + reusadas["PERIODO_ANTERIOR"]
+                + " (" + formatar_data(reusadas["DATA_ANTERIOR"]) + ")",
+            )
 
-    add("Resumo Executivo",
-        f"""
-        Total Registros A: {len(df_a)}<br/>
-        Total Registros B: {len(df_b)}<br/>
-        Notas apenas em A: {len(notas_apenas_em_a)}<br/>
-        Notas apenas em B: {len(notas_apenas_em_b)}<br/>
-        Datas Divergentes: {len(datas_erradas)}<br/>
-        Tipos Divergentes: {len(tipos_trocados)}<br/>
-        Litragens Divergentes: {len(valores_errados)}<br/>
-        """)
+    if formato != 'texto':
+        with etapa("Tabela de ocorrências", sum(len(t) for t in achados)):
+            gravar_achados(achados, formato, saida)
 
-    add("Observações Importantes",
-        "Este relatório foi gerado automaticamente pelo sistema de auditoria de abastecimentos.")
+    if historico is not None:
+        # O período só entra no histórico depois de todas as verificações
+        with etapa("Registrando período", len(df_a) + len(df_b)):
+            historico.registrar(df_a, df_b, referencias_periodo)
 
-    pdf.build(story)
+    log("\n--- ANÁLISE CONCLUÍDA ---")
 
-    print("📑 PDF 'relatorio_abastecimentos.pdf' gerado com sucesso!")
+    # =====================================================================
+    # 7. GERAR RELATÓRIO EM PDF
+    # =====================================================================
+    resumo = {
+        "Total Registros A": len(df_a),
+        "Total Registros B": len(df_b),
+        "Litragens atípicas A": len(atipicas_a),
+        "Litragens atípicas B": len(atipicas_b),
+        "Notas apenas em A": len(notas_apenas_em_a),
+        "Notas apenas em B": len(notas_apenas_em_b),
+        "Datas Divergentes": len(datas_erradas),
+        "Tipos Divergentes": len(tipos_trocados),
+        "Litragens Divergentes": len(valores_errados),
+    }
+    if notas_outro_periodo is not None:
+        resumo["Notas de Outros Períodos"] = len(notas_outro_periodo)
+
+    if not arquivo_pdf:
+        return resumo
+
+    log("Gerando relatório em PDF...")
+
+    # Detalhamento paginado de cada verificação (só as que têm ocorrências)
+    detalhes = [
+        ("Negativos A", COLUNAS_PLANILHA, negativos_a),
+        ("Negativos B", COLUNAS_PLANILHA, negativos_b),
+        ("Litragens Atípicas A", COLUNAS_PLANILHA, atipicas_a),
+        ("Litragens Atípicas B", COLUNAS_PLANILHA, atipicas_b),
+        ("Repetidas Mesmo Dia A", COLUNAS_PLANILHA, df_a.iloc[intra_a["rep_mesmo_dia"]]),
+        ("Repetidas Mesmo Dia B", COLUNAS_PLANILHA, df_b.iloc[intra_b["rep_mesmo_dia"]]),
+        ("Nota em Dias Diferentes A", COLUNAS_PLANILHA, df_a.iloc[intra_a["nota_diff"]]),
+        ("Nota em Dias Diferentes B", COLUNAS_PLANILHA, df_b.iloc[intra_b["nota_diff"]]),
+        ("Somente na A", COLUNAS_COMPARACAO, notas_apenas_em_a),
+        ("Somente na B", COLUNAS_COMPARACAO, notas_apenas_em_b),
+        ("Datas Divergentes", COLUNAS_COMPARACAO, datas_erradas),
+        ("Tipos Divergentes", COLUNAS_COMPARACAO, tipos_trocados),
+        ("Litragens Divergentes", COLUNAS_COMPARACAO, valores_errados),
+    ]
+    if notas_outro_periodo is not None:
+        detalhes.append(("Notas de Outros Períodos", COLUNAS_HISTORICO, notas_outro_periodo))
+    secoes = [
+        (titulo, colunas, len(df), blocos_dataframe(df))
+        for titulo, colunas, df in detalhes
+        if len(df) > 0
+    ]
+
+    def progresso(pagina, total):
+        if pagina == total or pagina % 100 == 0:
+            log(f"  ... página {pagina}/{total}")
+
+    with etapa("PDF detalhado", sum(total for _, _, total, _ in secoes)):
+        escrever_pdf_paginado(
+            arquivo_pdf, "Relatório de Auditoria", resumo, secoes,
+            observacoes="Este relatório foi gerado automaticamente pelo sistema de auditoria de abastecimentos.",
+            progresso=progresso,
+        )
+
+    log(f"📑 PDF '{arquivo_pdf}' gerado com sucesso!")
+
+    return resumo
 
 
 if __name__ == "__main__":
-    comparar_planilhas()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Compara as planilhas do posto e da prefeitura.")
+    parser.add_argument("--posto", default=ARQUIVO_A,
+                        help=f"planilha do posto em XLSX, CSV ou Parquet (padrão: {ARQUIVO_A})")
+    parser.add_argument("--pmm", default=ARQUIVO_B,
+                        help=f"planilha da prefeitura em XLSX, CSV ou Parquet (padrão: {ARQUIVO_B})")
+    parser.add_argument("--pdf", default=ARQUIVO_PDF,
+                        help=f"PDF detalhado (padrão: {ARQUIVO_PDF}; vazio para não gerar)")
+    parser.add_argument("--formato", choices=FORMATOS_SAIDA, default="texto",
+                        help="texto legível (padrão) ou tabela de ocorrências em CSV/JSON Lines")
+    parser.add_argument("--saida", default="-",
+                        help="arquivo da tabela de ocorrências (padrão: stdout)")
+    parser.add_argument("--estado", help="pasta do estado para reauditoria incremental (ex.: .estado_auditoria/posto1)")
+    parser.add_argument("--periodo", help="período desta auditoria (ex.: 2024-03); registra as notas no "
+                                          "histórico e aponta as já usadas em outros períodos")
+    parser.add_argument("--perfil", "--profile", nargs="?", const="-", metavar="ARQUIVO",
+                        help="mede tempo, linhas e pico de memória de cada etapa e grava em JSON "
+                             "(padrão: stderr)")
+    args = parser.parse_args()
+    estado = EstadoAuditoria(args.estado) if args.estado else None
+    historico = HistoricoNotas(args.periodo) if args.periodo else None
+    if args.perfil:
+        with perfilar() as perfil, etapa("Comparação das planilhas"):
+            comparar_planilhas(args.posto, args.pmm, args.formato, args.saida, args.pdf, estado, historico)
+        perfil.gravar_json(sys.stderr if args.perfil == "-" else args.perfil)
+    else:
+        comparar_planilhas(args.posto, args.pmm, args.formato, args.saida, args.pdf, estado, historico)
\ No newline at end of file
@@ -0,0 +1,199 @@
+import os
+import argparse
+
+import pandas as pd
+import numpy as np
+
+from ingestao import EXPECTED_COLS
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+# Planilhas POSTO/PMM sintéticas para medir o desempenho sem dados reais da
+# prefeitura. Os mesmos abastecimentos vão para as duas planilhas e cada tipo
+# de problema é injetado numa fração controlada das linhas (TAXAS_PADRAO).
+TAXAS_PADRAO = {
+    "duplicadas": 0.01,   # linhas repetidas (metade no mesmo dia e litragem, metade em outro dia)
+    "negativos": 0.002,   # litragem com o sinal trocado
+    "atipicas": 0.002,    # litragem muito acima do padrão do tipo
+    "orfas": 0.02,        # abastecimentos que só aparecem em uma das planilhas (metade em cada)
+    "datas": 0.01,        # data diferente na PMM
+    "tipos": 0.005,       # tipo diferente na PMM
+    "litros": 0.01,       # litragem diferente na PMM
+    "grafias": 0.01,      # tipo e setor em outra caixa (o tipo trocado também conta como tipo divergente)
+}
+
+TIPOS = np.array(["Gasolina", "Diesel", "Diesel S10", "Etanol"])
+PESOS_TIPOS = [0.5, 0.2, 0.2, 0.1]
+LITROS_TIPO = np.array([40.0, 120.0, 110.0, 35.0])  # média de cada tipo
+SETORES = np.array(["Saude", "Educacao", "Obras", "Administracao", "Transporte", "Assistencia Social"])
+
+INICIO_PERIODO = "2024-01-01"
+DIAS_PERIODO = 365
+
+# Uma planilha XLSX tem no máximo 1.048.576 linhas (uma é o cabeçalho);
+# CSV e Parquet não têm limite
+LIMITE_LINHAS_XLSX = 1_048_575
+FORMATOS_ARQUIVO = ["xlsx", "csv", "parquet"]
+
+# -------------------------------------------------------------------------
+# GERAÇÃO
+# -------------------------------------------------------------------------
+def _escolher(livres, taxa, n):
+    # Tira round(taxa * n) posições ainda livres (sem outro problema injetado)
+    k = min(int(round(taxa * n)), len(livres))
+    return livres[:k], livres[k:]
+
+def _grafias(rng, valores, taxa):
+    trocar = rng.random(len(valores)) < taxa
+    maiusculas = rng.random(len(valores)) < 0.5
+    valores = valores.astype(object)
+    valores[trocar & maiusculas] = [v.upper() for v in valores[trocar & maiusculas]]
+    valores[trocar & ~maiusculas] = [v.lower() for v in valores[trocar & ~maiusculas]]
+    return valores
+
+def _repetir(rng, df, taxa):
+    # Cópias de algumas linhas; metade delas em outro dia
+    k = int(round(taxa * len(df)))
+    copias = df.iloc[rng.choice(len(df), k, replace=False)].copy()
+    outro_dia = np.arange(k) % 2 == 1
+    copias.loc[copias.index[outro_dia], "DATA"] += pd.to_timedelta(rng.integers(1, 6, outro_dia.sum()), unit="D")
+    return pd.concat([df, copias], ignore_index=True), k
+
+def _cabecalhos(rng):
+    # Um dos nomes aceitos em EXPECTED_COLS para cada coluna
+    return {key.upper(): rng.choice(nomes) for key, nomes in EXPECTED_COLS.items()}
+
+def gerar_planilhas(linhas, taxas=None, semente=0, variantes=True):
+    # Devolve (posto, pmm, injetados): duas planilhas com cerca de `linhas`
+    # linhas cada, no formato lido de um XLSX (colunas com os nomes do arquivo),
+    # e quantas linhas de cada problema foram injetadas. Com `variantes`, os
+    # nomes das colunas mudam entre as planilhas e tipo/setor variam a grafia.
+    taxas = {**TAXAS_PADRAO, **(taxas or {})}
+    rng = np.random.default_rng(semente)
+
+    # Abastecimentos verdadeiros, iguais nas duas planilhas
+    tipo = rng.choice(len(TIPOS), linhas, p=PESOS_TIPOS)
+    base = pd.DataFrame({
+        "DATA": pd.Timestamp(INICIO_PERIODO) + pd.to_timedelta(rng.integers(0, DIAS_PERIODO, linhas), unit="D"),
+        "NOTA": rng.permutation(linhas) + 1000,
+        "TIPO": TIPOS[tipo],
+        "VALOR": np.round(rng.gamma(8.0, LITROS_TIPO[tipo] / 8.0), 2),
+        "SETOR": SETORES[rng.integers(0, len(SETORES), linhas)],
+    })
+    posto, pmm = base.copy(), base.copy()
+    injetados = {}
+
+    # Divergências entre as planilhas, cada uma em linhas diferentes
+    livres = rng.permutation(linhas)
+    orfas, livres = _escolher(livres, taxas["orfas"], linhas)
+    so_posto, so_pmm = orfas[: len(orfas) // 2], orfas[len(orfas) // 2:]
+    injetados["so_posto"], injetados["so_pmm"] = len(so_posto), len(so_pmm)
+
+    datas, livres = _escolher(livres, taxas["datas"], linhas)
+    pmm.loc[datas, "DATA"] += pd.to_timedelta(rng.choice([-3, -2, -1, 1, 2, 3], len(datas)), unit="D")
+    injetados["datas"] = len(datas)
+
+    tipos, livres = _escolher(livres, taxas["tipos"], linhas)
+    outro = (tipo[tipos] + rng.integers(1, len(TIPOS), len(tipos))) % len(TIPOS)
+    pmm.loc[tipos, "TIPO"] = TIPOS[outro]
+    injetados["tipos"] = len(tipos)
+
+    litros, livres = _escolher(livres, taxas["litros"], linhas)
+    pmm.loc[litros, "VALOR"] = np.round(pmm.loc[litros, "VALOR"] + rng.uniform(0.5, 20.0, len(litros)), 2)
+    injetados["litros"] = len(litros)
+
+    # Problemas internos de cada planilha, também em linhas ainda livres
+    for nome, df in (("posto", posto), ("pmm", pmm)):
+        negativos, livres_lado = _escolher(rng.permutation(livres), taxas["negativos"], linhas)
+        df.loc[negativos, "VALOR"] = -df.loc[negativos, "VALOR"]
+        atipicas, _ = _escolher(livres_lado, taxas["atipicas"], linhas)
+        df.loc[atipicas, "VALOR"] = np.round(df.loc[atipicas, "VALOR"] * rng.uniform(5.0, 8.0, len(atipicas)), 2)
+        injetados[f"negativos_{nome}"] = len(negativos)
+        injetados[f"atipicas_{nome}"] = len(atipicas)
+
+    posto = posto.drop(index=so_pmm)
+    pmm = pmm.drop(index=so_posto)
+
+    planilhas = []
+    for nome, df in (("posto", posto), ("pmm", pmm)):
+        df, repetidas = _repetir(rng, df.reset_index(drop=True), taxas["duplicadas"])
+        injetados[f"duplicadas_{nome}"] = repetidas
+        df = df.iloc[rng.permutation(len(df))].reset_index(drop=True)
+        if variantes:
+            df["TIPO"] = _grafias(rng, df["TIPO"].to_numpy(), taxas["grafias"])
+            df["SETOR"] = _grafias(rng, df["SETOR"].to_numpy(), taxas["grafias"])
+            df = df.rename(columns=_cabecalhos(rng))
+        planilhas.append(df)
+
+    return planilhas[0], planilhas[1], injetados
+
+# -------------------------------------------------------------------------
+# GRAVAÇÃO
+# -------------------------------------------------------------------------
+def gravar_xlsx(df, caminho, titulo=None):
+    # Grava em modo write-only; `titulo` vira uma linha antes do cabeçalho,
+    # como nas planilhas exportadas pelos sistemas do posto
+    from openpyxl import Workbook
+
+    if len(df) > LIMITE_LINHAS_XLSX:
+        raise ValueError(f"{len(df)} linhas não cabem em uma planilha XLSX (máximo {LIMITE_LINHAS_XLSX})")
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    if titulo:
+        ws.append([titulo])
+        ws.append([])
+    ws.append(list(df.columns))
+    # Timestamp é um datetime, então as colunas vão direto como listas de objetos
+    colunas = [df[c].astype(object).tolist() for c in df.columns]
+    for linha in zip(*colunas):
+        ws.append(linha)
+    wb.save(caminho)
+
+def gravar_csv(df, caminho):
+    # Como as exportações do sistema do posto: ";", vírgula decimal e dia/mês/ano
+    df.to_csv(caminho, sep=";", decimal=",", index=False, date_format="%d/%m/%Y")
+
+def gravar_parquet(df, caminho):
+    df.to_parquet(caminho, index=False)
+
+def gerar_arquivos(linhas, pasta, taxas=None, semente=0, variantes=True, formato="xlsx"):
+    # Grava POSTO e PMM (um de FORMATOS_ARQUIVO) em `pasta`; devolve os caminhos
+    # e o que foi injetado
+    posto, pmm, injetados = gerar_planilhas(linhas, taxas, semente, variantes)
+    os.makedirs(pasta, exist_ok=True)
+    caminhos = os.path.join(pasta, f"POSTO.{formato}"), os.path.join(pasta, f"PMM.{formato}")
+    if formato == "xlsx":
+        titulo = "Relatório de abastecimentos" if variantes else None
+        gravar_xlsx(posto, caminhos[0], titulo)
+        gravar_xlsx(pmm, caminhos[1])
+    elif formato == "csv":
+        gravar_csv(posto, caminhos[0])
+        gravar_csv(pmm, caminhos[1])
+    elif formato == "parquet":
+        gravar_parquet(posto, caminhos[0])
+        gravar_parquet(pmm, caminhos[1])
+    else:
+        raise ValueError(f"Formato desconhecido: {formato} (use um de {', '.join(FORMATOS_ARQUIVO)})")
+    return caminhos, injetados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera planilhas POSTO/PMM sintéticas com problemas injetados.")
+    parser.add_argument("linhas", type=int, help="abastecimentos por planilha (ex.: 10000)")
+    parser.add_argument("--saida", default="dados_sinteticos", help="pasta dos arquivos (padrão: dados_sinteticos)")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--formato", choices=FORMATOS_ARQUIVO, default="xlsx",
+                        help="xlsx (padrão; até ~1 milhão de linhas), csv ou parquet")
+    parser.add_argument("--sem-variantes", action="store_true",
+                        help="cabeçalhos e grafias fixos (sem nomes alternativos de coluna)")
+    for taxa, padrao in TAXAS_PADRAO.items():
+        parser.add_argument(f"--taxa-{taxa}", type=float, default=padrao, help=f"padrão: {padrao}")
+    args = parser.parse_args()
+
+    taxas = {taxa: getattr(args, f"taxa_{taxa}") for taxa in TAXAS_PADRAO}
+    caminhos, injetados = gerar_arquivos(args.linhas, args.saida, taxas, args.semente, not args.sem_variantes,
+                                         args.formato)
+    print(f"✔ {caminhos[0]} e {caminhos[1]} gerados.")
+    for problema, linhas in injetados.items():
+        print(f"  - {problema}: {linhas}")
@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import threading
+
+import pandas as pd
+import numpy as np
+
+from auditoria import DIA_NULO, referencias_planilhas
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+# Índice das notas de todos os períodos já auditados. Cada período vira um
+# segmento com os pares (hash da nota, dia) únicos e ordenados, gravado como
+# dois .npy lidos por mmap: consultar uma planilha é uma busca binária por
+# segmento, sem abrir planilhas antigas nem carregar o histórico na memória.
+# O hash de 64 bits dá colisão desprezível mesmo com milhões de notas.
+HISTORICO_DIR = os.environ.get("COMPARADOR_HISTORICO_DIR", ".historico_notas")
+
+# Cada período guarda também as referências de litragem por tipo e setor
+# (auditoria.referencias_planilhas, uma tabela pequena); a referência móvel
+# combina as dos últimos JANELA_REFERENCIAS períodos com as do atual.
+JANELA_REFERENCIAS = 6
+
+COLUNAS_HISTORICO = [
+    "PLANILHA", "NOTA", "DATA", "TIPO", "VALOR", "SETOR", "PERIODO_ANTERIOR", "DATA_ANTERIOR",
+]
+
+_trava = threading.Lock()
+
+def _hash_notas(notas):
+    # Hash de cada categoria uma vez; as linhas usam os códigos
+    return pd.util.hash_array(np.asarray(notas, dtype=object))
+
+def _id_periodo(periodo):
+    return re.sub(r"[^\w.-]+", "_", periodo.strip()).strip("._") or "periodo"
+
+def _chaves(df):
+    # (hash da nota, dia) de cada linha com nota
+    codigos = df["NOTA"].cat.codes.to_numpy()
+    com_nota = codigos >= 0
+    hashes = _hash_notas(df["NOTA"].cat.categories)
+    return np.flatnonzero(com_nota), hashes[codigos[com_nota]], df["DIA"].to_numpy()[com_nota]
+
+def _par(nota, dia):
+    # (índice da nota, dia) em um int64 só, ordenável e comparável
+    return (nota.astype(np.int64) << 32) + (dia.astype(np.int64) - int(DIA_NULO))
+
+class HistoricoNotas:
+    def __init__(self, periodo, pasta=HISTORICO_DIR):
+        # `periodo`: rótulo da auditoria atual (ex.: "2024-03"); o próprio
+        # período é ignorado na consulta, então reprocessá-lo não gera alertas
+        self.periodo = periodo.strip()
+        self.pasta = pasta
+
+    def _indice(self):
+        try:
+            with open(os.path.join(self.pasta, "periodos.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return []
+
+    def _arquivos(self, periodo_id):
+        base = os.path.join(self.pasta, periodo_id)
+        return f"{base}.notas.npy", f"{base}.dias.npy"
+
+    def _arquivo_referencias(self, periodo_id):
+        return os.path.join(self.pasta, f"{periodo_id}.litragens.csv")
+
+    def periodos(self):
+        return [p["periodo"] for p in self._indice()]
+
+    def registrar(self, df_a, df_b, referencias=None):
+        # Grava (ou regrava) o segmento do período atual com as notas de A e B
+        # de planilhas já tipadas; `referencias` evita recalcular as de litragem
+        if referencias is None:
+            referencias = referencias_planilhas(df_a, df_b)
+        _, h_a, d_a = _chaves(df_a)
+        _, h_b, d_b = _chaves(df_b)
+        h = np.concatenate([h_a, h_b])
+        d = np.concatenate([d_a, d_b]).astype(np.int32)
+        ordem = np.lexsort((d, h))
+        h, d = h[ordem], d[ordem]
+        unico = np.ones(len(h), dtype=bool)
+        unico[1:] = (h[1:] != h[:-1]) | (d[1:] != d[:-1])
+        h, d = h[unico], d[unico]
+
+        periodo_id = _id_periodo(self.periodo)
+        arq_notas, arq_dias = self._arquivos(periodo_id)
+        with _trava:
+            os.makedirs(self.pasta, exist_ok=True)
+            for arquivo, valores in ((arq_notas, h), (arq_dias, d)):
+                tmp = f"{arquivo}.{os.getpid()}.tmp.npy"
+                np.save(tmp, valores)
+                os.replace(tmp, arquivo)
+            arquivo = self._arquivo_referencias(periodo_id)
+            tmp = f"{arquivo}.{os.getpid()}.tmp"
+            referencias.to_csv(tmp, index=False)
+            os.replace(tmp, arquivo)
+
+            indice = [p for p in self._indice() if p["id"] != periodo_id]
+            indice.append({"periodo": self.periodo, "id": periodo_id, "notas": int(len(h))})
+            caminho = os.path.join(self.pasta, "periodos.json")
+            tmp = f"{caminho}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(indice, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, caminho)
+
+    def referencias(self, janela=JANELA_REFERENCIAS):
+        # Tabelas de referência de litragem dos últimos `janela` períodos antes do atual
+        segmentos = [p for p in self._indice() if p["id"] != _id_periodo(self.periodo)]
+        tabelas = []
+        for seg in segmentos[-janela:] if janela else []:
+            try:
+                tabelas.append(pd.read_csv(
+                    self._arquivo_referencias(seg["id"]), keep_default_na=False,
+                    dtype={"LADO": str, "TIPO": str, "SETOR": str},
+                ))
+            except FileNotFoundError:
+                continue
+        return tabelas
+
+    def consultar(self, df_a, df_b):
+        # Linhas de A e B cuja nota aparece em outro período num dia que não está
+        # entre os dias dela neste período (a mesma nota num dia deste período é o
+        # mesmo abastecimento reenviado, como na planilha cumulativa enviada de novo)
+        segmentos = [p for p in self._indice() if p["id"] != _id_periodo(self.periodo)]
+
+        pos_a, h_a, d_a = _chaves(df_a)
+        pos_b, h_b, d_b = _chaves(df_b)
+        # Notas distintas em ordem de hash: as buscas binárias percorrem o segmento
+        # (mmap) em ordem crescente, lendo as mesmas páginas em sequência
+        notas, nota_linha = np.unique(np.concatenate([h_a, h_b]), return_inverse=True)
+        dias_atuais = np.unique(_par(nota_linha, np.concatenate([d_a, d_b])))
+
+        periodo = np.full(len(notas), -1)
+        dia_anterior = np.full(len(notas), DIA_NULO, dtype=np.int32)
+        for i, seg in enumerate(segmentos):
+            arq_notas, arq_dias = self._arquivos(seg["id"])
+            try:
+                seg_h = np.load(arq_notas, mmap_mode="r")
+                seg_d = np.load(arq_dias, mmap_mode="r")
+            except (FileNotFoundError, ValueError):
+                continue
+            if len(seg_h) == 0:
+                continue
+
+            inicio = np.searchsorted(seg_h, notas, side="left")
+            quantos = np.searchsorted(seg_h, notas, side="right") - inicio
+            pendentes = np.flatnonzero((quantos > 0) & (periodo < 0))
+            # Todos os dias guardados das notas ainda não achadas, com o índice da nota
+            quantos = quantos[pendentes]
+            nota_seg = np.repeat(pendentes, quantos)
+            deslocamento = inicio[pendentes] - np.cumsum(quantos) + quantos
+            linhas = np.arange(len(nota_seg)) + np.repeat(deslocamento, quantos)
+            dias = np.asarray(seg_d[linhas])
+            pares = _par(nota_seg, dias)
+            achado = np.searchsorted(dias_atuais, pares)
+            outro_dia = dias_atuais[np.minimum(achado, len(dias_atuais) - 1)] != pares
+
+            # O primeiro dia de fora de cada nota (os dias vêm ordenados dentro da nota)
+            achadas, primeiro = np.unique(nota_seg[outro_dia], return_index=True)
+            periodo[achadas] = i
+            dia_anterior[achadas] = dias[outro_dia][primeiro]
+
+        # De volta às linhas (A antes de B)
+        periodo = periodo[nota_linha]
+        dia_anterior = dia_anterior[nota_linha]
+        nomes = np.array([s["periodo"] for s in segmentos] + [""], dtype=object)
+
+        partes = []
+        for planilha, df, posicoes, fatia in (("A", df_a, pos_a, slice(0, len(h_a))),
+                                              ("B", df_b, pos_b, slice(len(h_a), None))):
+            achadas = periodo[fatia] >= 0
+            linhas = df.iloc[posicoes[achadas]]
+            dias = dia_anterior[fatia][achadas].astype("int64")
+            partes.append(pd.DataFrame({
+                "PLANILHA": planilha,
+                "NOTA": linhas["NOTA"].to_numpy(),
+                "DATA": linhas["DATA"].to_numpy(),
+                "TIPO": linhas["TIPO"].to_numpy(),
+                "VALOR": linhas["VALOR"].to_numpy(),
+                "SETOR": linhas["SETOR"].to_numpy(),
+                "PERIODO_ANTERIOR": nomes[periodo[fatia][achadas]],
+                "DATA_ANTERIOR": pd.to_datetime(
+                    np.where(dias == DIA_NULO, np.datetime64("NaT"), dias.astype("datetime64[D]"))
+                ),
+            }))
+
+        tabela = pd.concat(partes, ignore_index=True)
+        for col in ["NOTA", "TIPO", "SETOR"]:
+            tabela[col] = tabela[col].astype(df_a[col].dtype)
+        return tabela[COLUNAS_HISTORICO]
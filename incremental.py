@@ -0,0 +1,253 @@
+import os
+import re
+import glob
+import json
+import uuid
+import threading
+
+import pandas as pd
+import numpy as np
+
+from auditoria import checar_intra, reconciliar, ordenar_pares
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+# Estado das auditorias anteriores, uma pasta por auditoria (ex.: por posto).
+# Cada nota guarda uma assinatura das suas linhas em A e em B e os achados
+# em coordenadas da própria nota (k-ésima linha da nota), então só as notas
+# cuja assinatura mudou precisam ser verificadas e pareadas de novo.
+#   notas.parquet  -> uma linha por nota (o id da nota é a posição da linha)
+#   intra.parquet  -> achados por nota de checar_intra (LADO 0=A/1=B, REGRA)
+#   pares.parquet  -> pareamento das notas com mais de uma linha em A ou B
+ESTADO_DIR = os.environ.get("COMPARADOR_ESTADO_DIR", ".estado_auditoria")
+ESTADO_VERSAO = 1  # incrementar quando as regras por nota ou o pareamento mudarem
+
+# Regras de checar_intra que dependem só das linhas da própria nota
+# ("negativos" é por linha e é sempre recalculada)
+REGRAS_POR_NOTA = ["duplicadas", "rep_mesmo_dia", "nota_diff"]
+
+# Colunas que as regras por nota e o pareamento enxergam
+COLUNAS_ASSINATURA = ["DIA", "TIPO", "VALOR"]
+
+_MISTURA_ORDINAL = np.uint64(0x9E3779B97F4A7C15)
+
+_travas = {}
+_travas_lock = threading.Lock()
+
+def pasta_estado(nome):
+    # Nome livre da auditoria -> pasta dentro de ESTADO_DIR
+    seguro = re.sub(r"[^\w.-]+", "_", nome.strip()).strip("._")
+    return os.path.join(ESTADO_DIR, seguro or "padrao")
+
+def _trava(pasta):
+    with _travas_lock:
+        return _travas.setdefault(os.path.abspath(pasta), threading.Lock())
+
+# -------------------------------------------------------------------------
+# LINHAS AGRUPADAS POR NOTA
+# -------------------------------------------------------------------------
+class _IndiceNotas:
+    # Para um lado já tipado: posição de cada linha dentro da sua nota (na
+    # ordem da planilha), contagem e assinatura de cada nota
+    def __init__(self, df):
+        self.codigos = df["NOTA"].cat.codes.to_numpy().astype(np.int64)
+        n_notas = len(df["NOTA"].cat.categories)
+
+        self.ordem = np.argsort(self.codigos, kind="stable")
+        ordenados = self.codigos[self.ordem]
+        self.inicio = np.searchsorted(ordenados, np.arange(n_notas + 1))
+        self.contagem = np.diff(self.inicio)
+
+        k_ordenado = np.arange(len(df)) - np.searchsorted(ordenados, ordenados)
+        self.k = np.empty(len(df), dtype=np.int64)
+        self.k[self.ordem] = k_ordenado
+
+        # Soma (com estouro) dos hashes de (linha, k): muda se qualquer linha da
+        # nota mudar, entrar, sair ou trocar de ordem
+        h = pd.util.hash_pandas_object(df[COLUNAS_ASSINATURA], index=False).to_numpy()
+        h = pd.util.hash_array(h ^ (self.k.astype(np.uint64) * _MISTURA_ORDINAL))
+        acumulado = np.concatenate([[np.uint64(0)], np.cumsum(h[self.ordem], dtype=np.uint64)])
+        self.assinatura = acumulado[self.inicio[1:]] - acumulado[self.inicio[:-1]]
+
+    def posicoes(self, codigos, k):
+        return self.ordem[self.inicio[codigos] + k]
+
+def _mapear(valores, posicoes):
+    # valores[posicoes], com -1 onde a posição é -1 (lado sem par)
+    saida = np.full(len(posicoes), -1, dtype=np.intp)
+    validas = posicoes >= 0
+    saida[validas] = valores[posicoes[validas]]
+    return saida
+
+# -------------------------------------------------------------------------
+# ESTADO PERSISTIDO
+# -------------------------------------------------------------------------
+class EstadoAuditoria:
+    def __init__(self, pasta):
+        self.pasta = pasta
+        # Resumo da última verificação (quantas notas e linhas foram refeitas)
+        self.ultima = None
+
+    def _arquivo(self, nome, geracao):
+        return os.path.join(self.pasta, f"{nome}-{geracao}.parquet")
+
+    def _ler(self):
+        try:
+            with open(os.path.join(self.pasta, "estado.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("versao") != ESTADO_VERSAO:
+                return None
+            return {
+                nome: pd.read_parquet(self._arquivo(nome, meta["geracao"]))
+                for nome in ("notas", "intra", "pares")
+            }
+        except Exception:
+            # Sem estado, estado corrompido ou pyarrow ausente: verificação completa
+            return None
+
+    def _gravar(self, tabelas):
+        # Arquivos novos primeiro; estado.json só passa a apontar para eles no fim
+        geracao = uuid.uuid4().hex
+        meta = os.path.join(self.pasta, "estado.json")
+        tmp = f"{meta}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.pasta, exist_ok=True)
+            for nome, tabela in tabelas.items():
+                tabela.to_parquet(self._arquivo(nome, geracao), index=False)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"versao": ESTADO_VERSAO, "geracao": geracao}, f)
+            os.replace(tmp, meta)
+        except Exception:
+            for nome in tabelas:
+                if os.path.exists(self._arquivo(nome, geracao)):
+                    os.remove(self._arquivo(nome, geracao))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        for antigo in glob.glob(os.path.join(self.pasta, "*-*.parquet")):
+            if not antigo.endswith(f"-{geracao}.parquet"):
+                os.remove(antigo)
+
+    def verificar(self, df_a, df_b):
+        # Mesmo retorno de checar_intra(df_a), checar_intra(df_b) e reconciliar(df_a, df_b)
+        # para planilhas já tipadas, refazendo só as notas que mudaram
+        with _trava(self.pasta):
+            return self._verificar(df_a, df_b)
+
+    def _verificar(self, df_a, df_b):
+        notas = df_a["NOTA"].cat.categories
+        ind_a, ind_b = _IndiceNotas(df_a), _IndiceNotas(df_b)
+        lados = [(df_a, ind_a), (df_b, ind_b)]
+
+        atual = pd.DataFrame({
+            "NOTA": notas,
+            "N_A": ind_a.contagem,
+            "ASSINATURA_A": ind_a.assinatura,
+            "N_B": ind_b.contagem,
+            "ASSINATURA_B": ind_b.assinatura,
+        })
+
+        # Nota id do estado anterior -> código atual (-1 se a nota sumiu)
+        anterior = self._ler()
+        mudou = np.ones(len(notas), dtype=bool)
+        if anterior is not None:
+            ant = anterior["notas"]
+            codigo_atual = notas.get_indexer(ant["NOTA"])
+            existe = codigo_atual >= 0
+            iguais = np.ones(existe.sum(), dtype=bool)
+            for col in ["N_A", "ASSINATURA_A", "N_B", "ASSINATURA_B"]:
+                iguais &= ant[col].to_numpy()[existe] == atual[col].to_numpy()[codigo_atual[existe]]
+            mudou[codigo_atual[existe][iguais]] = False
+
+            def reaproveitar(tabela):
+                # Linhas guardadas de notas que não mudaram, já com o código atual
+                codigos = codigo_atual[tabela["NOTA_ID"].to_numpy()]
+                manter = codigos >= 0
+                manter[manter] = ~mudou[codigos[manter]]
+                return tabela[manter], codigos[manter]
+
+        # Linhas sem nota (código -1) sempre entram na verificação
+        refazer = np.append(mudou, True)
+        sub = [np.flatnonzero(refazer[ind.codigos]) for _, ind in lados]
+
+        intra = []
+        for lado, (df, ind) in enumerate(lados):
+            novo = checar_intra(df.iloc[sub[lado]])
+            regras = {"negativos": np.flatnonzero(df["VALOR"].to_numpy() < 0)}
+            for r, regra in enumerate(REGRAS_POR_NOTA):
+                partes = [sub[lado][novo[regra]]]
+                if anterior is not None:
+                    t = anterior["intra"]
+                    guardado, codigos = reaproveitar(t[(t["LADO"] == lado) & (t["REGRA"] == r)])
+                    partes.append(ind.posicoes(codigos, guardado["K"].to_numpy()))
+                regras[regra] = np.sort(np.concatenate(partes)).astype(np.intp)
+            intra.append(regras)
+
+        novo = reconciliar(df_a.iloc[sub[0]], df_b.iloc[sub[1]])
+        pos_a = [_mapear(sub[0], novo["a"])]
+        pos_b = [_mapear(sub[1], novo["b"])]
+        if anterior is not None:
+            # Notas 1x1 ou de um lado só têm pareamento óbvio e não são guardadas
+            inalteradas = np.flatnonzero(~mudou)
+            n_a, n_b = ind_a.contagem[inalteradas], ind_b.contagem[inalteradas]
+
+            um_a_um = inalteradas[(n_a == 1) & (n_b == 1)]
+            pos_a.append(ind_a.posicoes(um_a_um, 0))
+            pos_b.append(ind_b.posicoes(um_a_um, 0))
+
+            for notas_lado, ind, mesmo, outro in ((inalteradas[n_b == 0], ind_a, pos_a, pos_b),
+                                                   (inalteradas[n_a == 0], ind_b, pos_b, pos_a)):
+                marcadas = np.zeros(len(notas) + 1, dtype=bool)
+                marcadas[notas_lado] = True
+                orfas = np.flatnonzero(marcadas[ind.codigos])
+                mesmo.append(orfas)
+                outro.append(np.full(len(orfas), -1, dtype=np.intp))
+
+            guardado, codigos = reaproveitar(anterior["pares"])
+            for saida, ind, k in ((pos_a, ind_a, guardado["K_A"]), (pos_b, ind_b, guardado["K_B"])):
+                k = k.to_numpy()
+                posicoes = np.full(len(k), -1, dtype=np.intp)
+                tem = k >= 0
+                posicoes[tem] = ind.posicoes(codigos[tem], k[tem])
+                saida.append(posicoes)
+        pares = ordenar_pares(df_a, df_b, np.concatenate(pos_a), np.concatenate(pos_b))
+
+        self._gravar(_tabelas(atual, lados, intra, pares))
+        self.ultima = {
+            "notas": len(notas),
+            "notas_refeitas": int(mudou.sum()),
+            "linhas_refeitas": len(sub[0]) + len(sub[1]),
+        }
+        return intra[0], intra[1], pares
+
+def _tabelas(atual, lados, intra, pares):
+    # Achados em coordenadas de nota: (id da nota em `notas`, k-ésima linha da nota)
+    partes = []
+    for lado, (_, ind) in enumerate(lados):
+        for r, regra in enumerate(REGRAS_POR_NOTA):
+            pos = intra[lado][regra]
+            partes.append(pd.DataFrame({
+                "LADO": np.full(len(pos), lado, dtype=np.int8),
+                "REGRA": np.full(len(pos), r, dtype=np.int8),
+                "NOTA_ID": ind.codigos[pos].astype(np.int32),
+                "K": ind.k[pos].astype(np.int32),
+            }))
+
+    ind_a, ind_b = lados[0][1], lados[1][1]
+    pos_a, pos_b = pares["a"], pares["b"]
+    codigos = np.where(pos_a >= 0, _mapear(ind_a.codigos, pos_a), _mapear(ind_b.codigos, pos_b))
+    n_a = np.append(ind_a.contagem, 0)[codigos]
+    n_b = np.append(ind_b.contagem, 0)[codigos]
+    guardar = (codigos >= 0) & (n_a > 0) & (n_b > 0) & ((n_a > 1) | (n_b > 1))
+
+    return {
+        "notas": atual,
+        "intra": pd.concat(partes, ignore_index=True),
+        "pares": pd.DataFrame({
+            "NOTA_ID": codigos[guardar].astype(np.int32),
+            "K_A": _mapear(ind_a.k, pos_a)[guardar].astype(np.int32),
+            "K_B": _mapear(ind_b.k, pos_b)[guardar].astype(np.int32),
+        }),
+    }
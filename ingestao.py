@@ -0,0 +1,541 @@
+import os
+import csv
+import sys
+import hashlib
+import threading
+import importlib.util
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+EXPECTED_COLS = {
+    "data": ["data", "Data"],
+    "nota": ["numero_nota", "Numero_Nota", "nota"],
+    "tipo": ["tipo_combustivel", "Tipo_Combustivel", "combustivel", "Tipo"],
+    "valor": ["litragem", "Litragem", "litros", "Valor"],
+    "setor": ["setor", "Setor", "departamento", "secretaria"]
+}
+
+# Cache de planilhas já lidas e normalizadas, indexado pelo hash do conteúdo.
+# Em memória guardamos até CACHE_MEMORIA_MB de planilhas (LRU, pelo tamanho dos
+# DataFrames); em disco, cada planilha vira um arquivo Parquet em CACHE_DIR
+# (quando o pyarrow existe) e a pasta fica com até CACHE_DISCO_MB, apagando os
+# arquivos usados há mais tempo (a data de modificação é renovada a cada uso).
+CACHE_DIR = os.environ.get("COMPARADOR_CACHE_DIR", ".cache_planilhas")
+CACHE_MEMORIA_MB = int(os.environ.get("COMPARADOR_CACHE_MEMORIA_MB", "512"))
+CACHE_DISCO_MB = int(os.environ.get("COMPARADOR_CACHE_DISCO_MB", "2048"))
+CACHE_VERSAO = 3  # incrementar quando a leitura/normalização mudar o formato de saída
+
+# Quantas linhas iniciais são examinadas à procura do cabeçalho
+LINHAS_BUSCA_CABECALHO = 20
+
+# Tamanho dos blocos da leitura em partes (ler_planilha_em_blocos e CSV)
+LINHAS_POR_BLOCO_LEITURA = 100_000
+
+# Formatos aceitos, pela extensão; sem extensão conhecida, pelos primeiros
+# bytes (XLSX é um zip e Parquet começa com "PAR1")
+FORMATOS_PLANILHA = ["xlsx", "csv", "parquet"]
+EXTENSOES_PLANILHA = {
+    ".xlsx": "xlsx", ".xlsm": "xlsx",
+    ".csv": "csv", ".txt": "csv",
+    ".parquet": "parquet", ".pq": "parquet",
+}
+
+# CSV: o separador é o mais frequente no início do arquivo; sem UTF-8 válido,
+# a codificação é Latin-1 (exportações antigas do Windows)
+SEPARADORES_CSV = [";", ",", "\t", "|"]
+AMOSTRA_CSV = 64 * 1024
+
+# Pasta de trabalho com uma aba por mês: as abas que reconhecem ao menos
+# MINIMO_COLUNAS_ABA colunas esperadas são empilhadas e, havendo mais de uma,
+# o nome de cada aba vai para COLUNA_PERIODO
+MINIMO_COLUNAS_ABA = 3
+COLUNA_PERIODO = "PERIODO"
+
+_cache = OrderedDict()  # chave -> (DataFrame, bytes)
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+# -------------------------------------------------------------------------
+# NORMALIZAÇÃO
+# -------------------------------------------------------------------------
+def guess_column(df, keys):
+    return _guess_nome(df.columns, keys)
+
+def _guess_nome(colunas, keys):
+    df_cols = {str(c).lower(): c for c in colunas}
+    for key in keys:
+        if key.lower() in df_cols:
+            return df_cols[key.lower()]
+    for k in keys:
+        for c in colunas:
+            if k.lower() in str(c).lower():
+                return c
+    return None
+
+def normalize_df(df):
+    df = df.copy()
+    new_cols = {}
+    for key, variations in EXPECTED_COLS.items():
+        found = guess_column(df, variations)
+        if found:
+            new_cols[found] = key.upper()
+    if new_cols:
+        df.rename(columns=new_cols, inplace=True)
+
+    for key in EXPECTED_COLS:
+        if key.upper() not in df.columns:
+            df[key.upper()] = np.nan
+
+    return df
+
+# -------------------------------------------------------------------------
+# LEITURA PROJETADA (SÓ AS CINCO COLUNAS DA AUDITORIA)
+# -------------------------------------------------------------------------
+def _mapear_cabecalho(cabecalho):
+    # Mesma regra de normalize_df, mas devolvendo {posição da coluna: nome normalizado}
+    nomes = [c for c in cabecalho if c is not None and str(c).strip()]
+    mapa = {}
+    for key, variations in EXPECTED_COLS.items():
+        found = _guess_nome(nomes, variations)
+        if found is not None:
+            mapa[found] = key.upper()
+    return {i: mapa[c] for i, c in enumerate(cabecalho) if c in mapa}
+
+def _achar_cabecalho(linhas):
+    # Escolhe, entre as primeiras linhas, a que reconhece mais colunas esperadas
+    melhor, melhor_mapa = None, {}
+    for n, linha in enumerate(linhas):
+        mapa = _mapear_cabecalho(list(linha))
+        if len(mapa) > len(melhor_mapa):
+            melhor, melhor_mapa = n, mapa
+    return melhor, melhor_mapa
+
+def _tipar_colunas(df):
+    for key in EXPECTED_COLS:
+        if key.upper() not in df.columns:
+            df[key.upper()] = np.nan
+
+    df["DATA"] = pd.to_datetime(df["DATA"], errors="coerce")
+    df["VALOR"] = pd.to_numeric(df["VALOR"], errors="coerce").astype("float64")
+
+    # Notas numéricas inteiras viram texto sem ".0" (21.0 -> "21")
+    nota = df["NOTA"].astype(object)
+    num = pd.to_numeric(nota, errors="coerce")
+    inteira = num.notna() & (num == np.floor(num))
+    nota = nota.where(nota.isna(), nota.astype(str))
+    nota[inteira] = num[inteira].astype("int64").astype(str)
+    df["NOTA"] = nota
+
+    colunas = [key.upper() for key in EXPECTED_COLS]
+    for col in ["TIPO", "SETOR"] + ([COLUNA_PERIODO] if COLUNA_PERIODO in df.columns else []):
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        if col == COLUNA_PERIODO:
+            colunas.append(col)
+
+    return df[colunas]
+
+def _datas_texto(serie):
+    # ISO (2024-03-31, com ou sem hora) ou dia primeiro (31/03/2024); o formato
+    # livre, bem mais lento, fica só para o que sobrar
+    datas = pd.to_datetime(serie, format="ISO8601", errors="coerce")
+    for formato in ["%d/%m/%Y", "mixed"]:
+        resto = datas.isna() & serie.notna()
+        if not resto.any():
+            break
+        datas[resto] = pd.to_datetime(serie[resto], format=formato, dayfirst=True, errors="coerce")
+    return datas
+
+def _numeros_texto(serie):
+    # "1.234,5" (padrão brasileiro) e "1234.5" convivem na mesma coluna
+    virgula = serie.str.contains(",", regex=False, na=False)
+    brasil = serie[virgula].str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    return pd.to_numeric(serie.mask(virgula, brasil), errors="coerce")
+
+def _tipar_texto(df):
+    # CSV (tudo texto) e Parquet: datas e litragens em texto, categorias do
+    # Parquet como objetos, e então _tipar_colunas
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    if "DATA" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["DATA"]):
+        df["DATA"] = _datas_texto(df["DATA"])
+    if "VALOR" in df.columns and not pd.api.types.is_numeric_dtype(df["VALOR"]):
+        df["VALOR"] = _numeros_texto(df["VALOR"])
+    return _tipar_colunas(df)
+
+# -------------------------------------------------------------------------
+# FORMATO DO ARQUIVO
+# -------------------------------------------------------------------------
+def _rebobinar(fonte):
+    if not isinstance(fonte, (str, os.PathLike)):
+        fonte.seek(0)
+
+def _inicio(fonte, n):
+    # Primeiros `n` bytes, sem mudar a posição de um arquivo aberto
+    if isinstance(fonte, (str, os.PathLike)):
+        with open(fonte, "rb") as f:
+            return f.read(n)
+    pos = fonte.tell()
+    fonte.seek(0)
+    dados = fonte.read(n)
+    fonte.seek(pos)
+    return dados
+
+def formato_planilha(fonte):
+    # Um de FORMATOS_PLANILHA; `fonte` é um caminho ou um arquivo com `name`
+    # (ex.: UploadedFile do Streamlit)
+    nome = str(fonte) if isinstance(fonte, (str, os.PathLike)) else getattr(fonte, "name", "")
+    extensao = os.path.splitext(nome)[1].lower()
+    if extensao in EXTENSOES_PLANILHA:
+        return EXTENSOES_PLANILHA[extensao]
+    inicio = _inicio(fonte, 4)
+    if inicio.startswith(b"PK"):
+        return "xlsx"
+    if inicio == b"PAR1":
+        return "parquet"
+    return "csv"
+
+def _abas_dados(topos):
+    # `topos`: [(aba, primeiras linhas)]; devolve [(aba, linha do cabeçalho, mapa)]
+    # das abas de dados. Se nenhuma reconhece MINIMO_COLUNAS_ABA colunas, vale
+    # só a primeira, com o que ela reconhecer (uma planilha de uma aba só)
+    achadas = [(aba, *_achar_cabecalho(topo)) for aba, topo in topos]
+    abas = [a for a in achadas if len(a[2]) >= MINIMO_COLUNAS_ABA]
+    if not abas and achadas and achadas[0][1] is not None:
+        abas = achadas[:1]
+    return abas
+
+def _ler_xlsx_calamine(fonte):
+    topos = pd.read_excel(fonte, engine="calamine", sheet_name=None, header=None,
+                          nrows=LINHAS_BUSCA_CABECALHO)
+    abas = _abas_dados([(aba, topo.itertuples(index=False, name=None)) for aba, topo in topos.items()])
+    if not abas:
+        return None
+    partes = []
+    for aba, linha, mapa in abas:
+        _rebobinar(fonte)
+        df = pd.read_excel(
+            fonte, engine="calamine", sheet_name=aba, header=None, skiprows=linha + 1, usecols=sorted(mapa)
+        )
+        df.columns = [mapa[i] for i in sorted(mapa)]
+        df = df.dropna(how="all")
+        if len(abas) > 1:
+            df[COLUNA_PERIODO] = aba
+        partes.append(df)
+    return partes[0] if len(partes) == 1 else pd.concat(partes, ignore_index=True)
+
+def _bloco(valores, mapa, periodo):
+    bloco = pd.DataFrame({mapa[i]: v for i, v in valores.items()})
+    if periodo is not None:
+        bloco[COLUNA_PERIODO] = periodo
+    return bloco
+
+def _blocos_aba(registros, mapa, linhas, periodo):
+    indices = sorted(mapa)
+    valores = {i: [] for i in indices}
+    n = 0
+    for linha in registros:
+        vals = [linha[i] if i < len(linha) else None for i in indices]
+        if any(v is not None for v in vals):
+            for i, v in zip(indices, vals):
+                valores[i].append(v)
+            n += 1
+        if n >= linhas:
+            yield _bloco(valores, mapa, periodo)
+            valores = {i: [] for i in indices}
+            n = 0
+    if n:
+        yield _bloco(valores, mapa, periodo)
+
+def _blocos_xlsx_openpyxl(fonte, linhas):
+    # Blocos de até `linhas` registros com as colunas reconhecidas, lidos em modo
+    # read-only, aba por aba; nenhum bloco se nenhum cabeçalho for reconhecido
+    from openpyxl import load_workbook
+
+    wb = load_workbook(fonte, read_only=True, data_only=True)
+    try:
+        topos = [
+            (ws.title, list(ws.iter_rows(max_row=LINHAS_BUSCA_CABECALHO, values_only=True)))
+            for ws in wb.worksheets
+        ]
+        abas = _abas_dados(topos)
+        entregues = False
+        for aba, n_cab, mapa in abas:
+            registros = wb[aba].iter_rows(min_row=n_cab + 2, values_only=True)
+            for bloco in _blocos_aba(registros, mapa, linhas, aba if len(abas) > 1 else None):
+                entregues = True
+                yield bloco
+
+        if abas and not entregues:
+            _, _, mapa = abas[0]
+            yield _bloco({i: [] for i in sorted(mapa)}, mapa, "" if len(abas) > 1 else None)
+    finally:
+        wb.close()
+
+def _ler_xlsx_openpyxl(fonte):
+    blocos = list(_blocos_xlsx_openpyxl(fonte, sys.maxsize))
+    if not blocos:
+        return None
+    return blocos[0] if len(blocos) == 1 else pd.concat(blocos, ignore_index=True)
+
+def _formato_csv(fonte):
+    # (separador, codificação, primeiras linhas) a partir do início do arquivo
+    amostra = _inicio(fonte, AMOSTRA_CSV)
+    try:
+        texto, codificacao = amostra.decode("utf-8-sig"), "utf-8-sig"
+    except UnicodeDecodeError as erro:
+        if erro.start >= len(amostra) - 3:
+            # A amostra cortou um caractere no meio
+            texto, codificacao = amostra[:erro.start].decode("utf-8-sig"), "utf-8-sig"
+        else:
+            texto, codificacao = amostra.decode("latin-1"), "latin-1"
+    topo = texto.splitlines()[:LINHAS_BUSCA_CABECALHO]
+    separador = max(SEPARADORES_CSV, key=lambda sep: sum(linha.count(sep) for linha in topo))
+    return separador, codificacao, topo
+
+def _blocos_csv(fonte, linhas):
+    # Só as colunas reconhecidas, lidas como texto (sem inferência de tipos a
+    # cada bloco) e tipadas bloco a bloco
+    separador, codificacao, topo = _formato_csv(fonte)
+    n_cab, mapa = _achar_cabecalho(csv.reader(topo, delimiter=separador))
+    if n_cab is None:
+        return
+    indices = sorted(mapa)
+    _rebobinar(fonte)
+    leitor = pd.read_csv(
+        fonte, sep=separador, encoding=codificacao, encoding_errors="replace", header=None,
+        skiprows=n_cab + 1, usecols=indices, dtype=str, chunksize=linhas,
+    )
+    entregues = False
+    with leitor:
+        for bloco in leitor:
+            bloco = bloco[indices].dropna(how="all")
+            bloco.columns = [mapa[i] for i in indices]
+            entregues = True
+            yield _tipar_texto(bloco)
+    if not entregues:
+        yield _tipar_texto(pd.DataFrame({mapa[i]: pd.Series(dtype=object) for i in indices}))
+
+def _colunas_parquet(arquivo):
+    # {nome no arquivo: nome normalizado} das colunas reconhecidas
+    nomes = arquivo.schema_arrow.names
+    return {nomes[i]: nome for i, nome in _mapear_cabecalho(nomes).items()}
+
+def _blocos_parquet(fonte, linhas):
+    # Só as colunas reconhecidas são lidas do arquivo (projeção)
+    import pyarrow.parquet as pq
+
+    arquivo = pq.ParquetFile(fonte)
+    colunas = _colunas_parquet(arquivo)
+    if not colunas:
+        return
+    entregues = False
+    for lote in arquivo.iter_batches(batch_size=linhas, columns=list(colunas)):
+        entregues = True
+        yield _tipar_texto(lote.to_pandas().rename(columns=colunas))
+    if not entregues:
+        vazio = arquivo.schema_arrow.empty_table().select(list(colunas))
+        yield _tipar_texto(vazio.to_pandas().rename(columns=colunas))
+
+def _ler_parquet(fonte):
+    import pyarrow.parquet as pq
+
+    colunas = _colunas_parquet(pq.ParquetFile(fonte))
+    if not colunas:
+        return None
+    _rebobinar(fonte)
+    return _tipar_texto(pd.read_parquet(fonte, columns=list(colunas)).rename(columns=colunas))
+
+def _blocos_formato(fonte, formato, linhas):
+    # Blocos já tipados; nenhum se o cabeçalho não for reconhecido
+    _rebobinar(fonte)
+    if formato == "csv":
+        yield from _blocos_csv(fonte, linhas)
+    elif formato == "parquet":
+        yield from _blocos_parquet(fonte, linhas)
+    else:
+        for bloco in _blocos_xlsx_openpyxl(fonte, linhas):
+            yield _tipar_colunas(bloco)
+
+def _ler_completa(fonte, formato):
+    # Nenhum cabeçalho reconhecido: lê tudo e deixa normalize_df achar as colunas
+    _rebobinar(fonte)
+    if formato == "csv":
+        separador, codificacao, _ = _formato_csv(fonte)
+        df = pd.read_csv(fonte, sep=separador, encoding=codificacao, encoding_errors="replace", dtype=str)
+        return _tipar_texto(normalize_df(df))
+    if formato == "parquet":
+        return _tipar_texto(normalize_df(pd.read_parquet(fonte)))
+    return _tipar_colunas(normalize_df(pd.read_excel(fonte)))
+
+def ler_planilha_colunas(fonte):
+    # Lê só DATA/NOTA/TIPO/VALOR/SETOR (e PERIODO, nas pastas com uma aba por
+    # mês) de um XLSX, CSV ou Parquet; no XLSX usa python-calamine se estiver instalado
+    formato = formato_planilha(fonte)
+    _rebobinar(fonte)
+    if formato == "xlsx":
+        if importlib.util.find_spec("python_calamine") is not None:
+            df = _ler_xlsx_calamine(fonte)
+        else:
+            df = _ler_xlsx_openpyxl(fonte)
+        if df is not None:
+            return _tipar_colunas(df)
+    elif formato == "parquet":
+        df = _ler_parquet(fonte)
+        if df is not None:
+            return df
+    else:
+        blocos = list(_blocos_csv(fonte, LINHAS_POR_BLOCO_LEITURA))
+        if blocos:
+            return blocos[0] if len(blocos) == 1 else pd.concat(blocos, ignore_index=True)
+
+    return _ler_completa(fonte, formato)
+
+# -------------------------------------------------------------------------
+# CACHE POR HASH DE CONTEÚDO
+# -------------------------------------------------------------------------
+def hash_arquivo(fonte):
+    # `fonte` pode ser um caminho ou um objeto de arquivo (ex.: UploadedFile do Streamlit)
+    h = hashlib.sha256()
+    h.update(f"v{CACHE_VERSAO}".encode())
+    if isinstance(fonte, (str, os.PathLike)):
+        with open(fonte, "rb") as f:
+            for bloco in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloco)
+    else:
+        pos = fonte.tell()
+        fonte.seek(0)
+        for bloco in iter(lambda: fonte.read(1 << 20), b""):
+            h.update(bloco)
+        fonte.seek(pos)
+    return h.hexdigest()
+
+def _caminho_sidecar(chave):
+    return os.path.join(CACHE_DIR, f"{chave}.parquet")
+
+def _usar_sidecar(caminho):
+    # Renova a data de modificação: o sidecar passa a ser o último a ser apagado
+    try:
+        os.utime(caminho)
+    except OSError:
+        pass
+
+def _ler_sidecar(chave):
+    caminho = _caminho_sidecar(chave)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        df = pd.read_parquet(caminho)
+    except Exception:
+        # Sidecar corrompido ou pyarrow ausente: ignora e relê a planilha
+        return None
+    _usar_sidecar(caminho)
+    return df
+
+def _podar_sidecars(manter):
+    # Apaga os sidecars usados há mais tempo até a pasta caber em CACHE_DISCO_MB
+    arquivos = []
+    for nome in os.listdir(CACHE_DIR):
+        caminho = os.path.join(CACHE_DIR, nome)
+        try:
+            info = os.stat(caminho)
+        except OSError:
+            continue
+        if nome.endswith(".parquet") and caminho != manter:
+            arquivos.append((info.st_mtime, info.st_size, caminho))
+        else:
+            arquivos.append((float("inf"), info.st_size, None))
+    total = sum(tamanho for _, tamanho, _ in arquivos)
+    for _, tamanho, caminho in sorted(arquivos, key=lambda a: a[0]):
+        if total <= CACHE_DISCO_MB * 1024 * 1024 or caminho is None:
+            break
+        try:
+            os.remove(caminho)
+        except OSError:
+            # Já apagado por outro processo
+            pass
+        total -= tamanho
+
+def _gravar_sidecar(chave, df):
+    caminho = _caminho_sidecar(chave)
+    tmp = f"{caminho}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, caminho)
+    except Exception:
+        # Colunas com tipos mistos ou pyarrow ausente: segue só com o cache em memória
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return
+    _podar_sidecars(caminho)
+
+def _guardar_em_memoria(chave, df):
+    global _cache_bytes
+    tamanho = int(df.memory_usage(index=True, deep=True).sum())
+    limite = CACHE_MEMORIA_MB * 1024 * 1024
+    with _cache_lock:
+        if chave in _cache:
+            _cache_bytes -= _cache.pop(chave)[1]
+        if tamanho > limite:
+            # Maior que o cache inteiro: não expulsa as outras por nada
+            return
+        _cache[chave] = (df, tamanho)
+        _cache_bytes += tamanho
+        while _cache_bytes > limite:
+            _cache_bytes -= _cache.popitem(last=False)[1][1]
+
+def limpar_cache():
+    global _cache_bytes
+    with _cache_lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+def carregar_planilha(fonte):
+    chave = hash_arquivo(fonte)
+
+    with _cache_lock:
+        if chave in _cache:
+            _cache.move_to_end(chave)
+            return _cache[chave][0].copy()
+
+    df = _ler_sidecar(chave)
+    if df is None:
+        df = ler_planilha_colunas(fonte)
+        _gravar_sidecar(chave, df)
+
+    _guardar_em_memoria(chave, df)
+    return df.copy()
+
+def ler_planilha_em_blocos(fonte, linhas=LINHAS_POR_BLOCO_LEITURA):
+    # Mesmo conteúdo de carregar_planilha, entregue em blocos de até `linhas`
+    # registros sem montar a planilha inteira na memória. Se ela já estiver no
+    # cache em disco, os blocos vêm do Parquet.
+    caminho = _caminho_sidecar(hash_arquivo(fonte))
+    arquivo = None
+    if os.path.exists(caminho):
+        try:
+            import pyarrow.parquet as pq
+            arquivo = pq.ParquetFile(caminho)
+        except Exception:
+            arquivo = None
+    if arquivo is not None:
+        _usar_sidecar(caminho)
+        for lote in arquivo.iter_batches(batch_size=linhas):
+            yield lote.to_pandas()
+        return
+
+    formato = formato_planilha(fonte)
+    vazio = True
+    for bloco in _blocos_formato(fonte, formato, linhas):
+        vazio = False
+        yield bloco
+
+    if vazio:
+        # Nenhum cabeçalho reconhecido: leitura completa, como em ler_planilha_colunas
+        yield _ler_completa(fonte, formato)
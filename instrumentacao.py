@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import threading
+import contextvars
+
+import pandas as pd
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+# Tempo, linhas e pico de memória de cada etapa da auditoria. O código marca
+# as etapas com `with etapa("Reconciliação", linhas):`; sem um perfil ativo
+# (perfilar), etapa() devolve sempre o mesmo objeto vazio, então o custo é
+# uma leitura de ContextVar por etapa. Com perfil ativo, uma thread amostra o
+# RSS do processo enquanto houver etapa aberta: o pico de uma etapa é o maior
+# RSS durante ela menos o RSS no início (inclui as etapas internas e, com
+# várias análises ao mesmo tempo, também as das outras).
+INTERVALO_AMOSTRA = 0.01
+
+COLUNAS_PERFIL = ["Etapa", "Vezes", "Segundos", "Linhas", "Pico MB"]
+
+_perfil_atual = contextvars.ContextVar("perfil_atual", default=None)
+_nivel = contextvars.ContextVar("nivel_etapa", default=0)
+
+def rss():
+    # Memória residente do processo em bytes (Linux); None onde não há /proc
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+# -------------------------------------------------------------------------
+# ETAPAS
+# -------------------------------------------------------------------------
+class _EtapaNula:
+    # Etapa sem perfil ativo: aceita e descarta `linhas`
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, nome, valor):
+        pass
+
+_NULA = _EtapaNula()
+
+class Registro:
+    def __init__(self, perfil, nome, linhas):
+        self.perfil = perfil
+        self.etapa = nome
+        self.linhas = linhas
+        self.nivel = 0
+        self.segundos = None
+        self.pico_mb = None
+        self._rss = None
+        self._pico = 0
+
+    def __enter__(self):
+        self.nivel = _nivel.get()
+        self._token = _nivel.set(self.nivel + 1)
+        self.perfil._abrir(self)
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.segundos = time.perf_counter() - self._inicio
+        self.perfil._fechar(self)
+        _nivel.reset(self._token)
+        return False
+
+    def como_dict(self):
+        return {"etapa": self.etapa, "nivel": self.nivel, "segundos": round(self.segundos or 0.0, 4),
+                "linhas": self.linhas, "pico_mb": self.pico_mb}
+
+def etapa(nome, linhas=None):
+    # `linhas` pode ser informado depois: `with etapa(...) as e: ...; e.linhas = n`
+    perfil = _perfil_atual.get()
+    if perfil is None:
+        return _NULA
+    return Registro(perfil, nome, linhas)
+
+# -------------------------------------------------------------------------
+# PERFIL
+# -------------------------------------------------------------------------
+class Perfil:
+    def __init__(self):
+        self.registros = []
+        self._abertos = []
+        self._trava = threading.Lock()
+        self._amostrador = None
+        self._parar = threading.Event()
+
+    def _amostrar(self):
+        while not self._parar.wait(INTERVALO_AMOSTRA):
+            atual = rss()
+            with self._trava:
+                for registro in self._abertos:
+                    registro._pico = max(registro._pico, atual)
+
+    def _abrir(self, registro):
+        registro._rss = rss()
+        registro._pico = registro._rss or 0
+        with self._trava:
+            self.registros.append(registro)
+            self._abertos.append(registro)
+            if registro._rss is not None and self._amostrador is None:
+                self._parar.clear()
+                self._amostrador = threading.Thread(target=self._amostrar, daemon=True,
+                                                    name="perfil-memoria")
+                self._amostrador.start()
+
+    def _fechar(self, registro):
+        atual = rss()
+        with self._trava:
+            self._abertos.remove(registro)
+            if registro._rss is not None:
+                registro.pico_mb = round((max(registro._pico, atual) - registro._rss) / 2 ** 20, 2)
+            parar = not self._abertos and self._amostrador is not None
+            if parar:
+                self._parar.set()
+                self._amostrador = None
+
+    def tabela(self):
+        # Uma linha por nome de etapa (somando as repetições, ex.: uma por partição),
+        # na ordem em que apareceram; o recuo mostra as etapas internas
+        with self._trava:
+            registros = [r for r in self.registros if r.segundos is not None]
+        if not registros:
+            return pd.DataFrame(columns=COLUNAS_PERFIL)
+        df = pd.DataFrame([r.como_dict() for r in registros])
+        df["Etapa"] = [
+            "· " * nivel + nome for nivel, nome in zip(df["nivel"], df["etapa"])
+        ]
+        tabela = df.groupby("Etapa", sort=False).agg(
+            Vezes=("etapa", "size"), Segundos=("segundos", "sum"),
+            Linhas=("linhas", "sum"), **{"Pico MB": ("pico_mb", "max")},
+        ).reset_index()
+        tabela["Linhas"] = tabela["Linhas"].astype("Int64").where(
+            df.groupby("Etapa", sort=False)["linhas"].count().to_numpy() > 0
+        )
+        return tabela[COLUNAS_PERFIL]
+
+    def como_dict(self):
+        with self._trava:
+            registros = [r.como_dict() for r in self.registros if r.segundos is not None]
+        return {
+            "total_segundos": round(sum(r["segundos"] for r in registros if r["nivel"] == 0), 4),
+            "etapas": registros,
+        }
+
+    def gravar_json(self, destino):
+        # `destino`: caminho ou arquivo aberto (ex.: sys.stderr)
+        texto = json.dumps(self.como_dict(), ensure_ascii=False, indent=1)
+        if isinstance(destino, (str, os.PathLike)):
+            with open(destino, "w", encoding="utf-8") as f:
+                f.write(texto + "\n")
+        else:
+            destino.write(texto + "\n")
+
+class perfilar:
+    # with perfilar() as perfil: ... ativa `perfil` (ou um novo) para as etapas
+    # marcadas nesta thread/contexto; passe um já existente para acumular nele
+    def __init__(self, perfil=None):
+        self.perfil = perfil if perfil is not None else Perfil()
+
+    def __enter__(self):
+        self._token = _perfil_atual.set(self.perfil)
+        return self.perfil
+
+    def __exit__(self, *exc):
+        _perfil_atual.reset(self._token)
+        return False
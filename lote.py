@@ -0,0 +1,171 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import traceback
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from comparador_de_notas import comparar_planilhas, FORMATOS_SAIDA
+from incremental import EstadoAuditoria
+from ingestao import EXTENSOES_PLANILHA
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+# Numa pasta, cada "<prefixo>POSTO.<ext>" forma par com "<prefixo>PMM.<ext>" no
+# mesmo diretório (ex.: 2024-01/POSTO.xlsx ou 2024-01_POSTO.csv); as extensões
+# são as de ingestao.EXTENSOES_PLANILHA e, havendo mais de uma PMM, vale a de
+# mesma extensão
+SUFIXO_POSTO = "posto"
+SUFIXO_PMM = "pmm"
+
+# Manifesto CSV: uma linha por par, caminhos relativos ao próprio manifesto
+COLUNAS_MANIFESTO = ["par", "posto", "pmm"]
+
+SAIDA_LOTE = "relatorios_lote"
+ARQUIVO_RESUMO_LOTE = "resumo_lote.csv"
+
+# -------------------------------------------------------------------------
+# DESCOBERTA DOS PARES
+# -------------------------------------------------------------------------
+def _nome_par(raiz, pasta, prefixo):
+    partes = [p for p in os.path.relpath(pasta, raiz).split(os.sep) if p != "."]
+    prefixo = prefixo.rstrip("_- .")
+    if prefixo:
+        partes.append(prefixo)
+    return "__".join(partes) or "par"
+
+def pares_da_pasta(raiz):
+    pares = []
+    for pasta, _, arquivos in os.walk(raiz):
+        por_nome = {a.lower(): a for a in arquivos}
+        for nome in sorted(arquivos):
+            base, extensao = os.path.splitext(nome)
+            extensao = extensao.lower()
+            if extensao not in EXTENSOES_PLANILHA or not base.lower().endswith(SUFIXO_POSTO):
+                continue
+            prefixo = base[:-len(SUFIXO_POSTO)]
+            candidatos = [prefixo.lower() + SUFIXO_PMM + e for e in [extensao, *EXTENSOES_PLANILHA]]
+            pmm = next((por_nome[c] for c in candidatos if c in por_nome), None)
+            if pmm is None:
+                continue
+            pares.append((_nome_par(raiz, pasta, prefixo), os.path.join(pasta, nome), os.path.join(pasta, pmm)))
+    return sorted(pares)
+
+def pares_do_manifesto(caminho):
+    base = os.path.dirname(os.path.abspath(caminho))
+    with open(caminho, newline="", encoding="utf-8-sig") as f:
+        linhas = list(csv.DictReader(f))
+    faltando = [c for c in COLUNAS_MANIFESTO if linhas and c not in linhas[0]]
+    if faltando:
+        raise ValueError(f"Manifesto sem as colunas: {', '.join(faltando)}")
+    return [
+        (l["par"], os.path.join(base, l["posto"]), os.path.join(base, l["pmm"]))
+        for l in linhas
+    ]
+
+def descobrir_pares(origem):
+    pares = pares_da_pasta(origem) if os.path.isdir(origem) else pares_do_manifesto(origem)
+
+    # Cada par tem a sua pasta de saída: nomes repetidos ganham sufixo
+    vistos = {}
+    unicos = []
+    for par, a, b in pares:
+        vistos[par] = vistos.get(par, 0) + 1
+        unicos.append((par if vistos[par] == 1 else f"{par}-{vistos[par]}", a, b))
+    return unicos
+
+# -------------------------------------------------------------------------
+# EXECUÇÃO
+# -------------------------------------------------------------------------
+def auditar_par(par, arquivo_a, arquivo_b, saida, formato="csv", gerar_pdf=True, estado=None):
+    # Roda em um processo do pool; qualquer falha vira uma linha de erro no resumo
+    pasta = os.path.join(saida, par)
+    os.makedirs(pasta, exist_ok=True)
+    log = os.path.join(pasta, "relatorio.txt")
+    inicio = time.perf_counter()
+    linha = {"PAR": par, "ARQUIVO_A": arquivo_a, "ARQUIVO_B": arquivo_b, "STATUS": "ok", "ERRO": "",
+             "SEGUNDOS": 0.0}
+
+    try:
+        with open(log, "w", encoding="utf-8") as f, redirect_stdout(f):
+            resumo = comparar_planilhas(
+                arquivo_a, arquivo_b, formato,
+                saida=os.path.join(pasta, f"achados.{formato}"),
+                arquivo_pdf=os.path.join(pasta, "relatorio_abastecimentos.pdf") if gerar_pdf else None,
+                estado=EstadoAuditoria(os.path.join(estado, par)) if estado else None,
+            )
+        if resumo is None:
+            # comparar_planilhas já registrou o motivo no log
+            with open(log, encoding="utf-8") as f:
+                mensagens = [l.strip() for l in f if l.strip()]
+            erro = mensagens[-1].lstrip("❌ ") if mensagens else "falha na leitura"
+            linha.update(STATUS="erro", ERRO=erro)
+        else:
+            linha.update(resumo)
+    except Exception as e:
+        with open(log, "a", encoding="utf-8") as f:
+            traceback.print_exc(file=f)
+        linha.update(STATUS="erro", ERRO=f"{type(e).__name__}: {e}")
+
+    linha["SEGUNDOS"] = round(time.perf_counter() - inicio, 2)
+    return linha
+
+def rodar_lote(pares, saida=SAIDA_LOTE, workers=None, formato="csv", gerar_pdf=True, estado=None):
+    # `estado`: pasta com o estado incremental de cada par (uma subpasta por par)
+    os.makedirs(saida, exist_ok=True)
+    linhas = []
+    total = len(pares)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futuros = {
+            pool.submit(auditar_par, par, a, b, saida, formato, gerar_pdf, estado): (par, a, b)
+            for par, a, b in pares
+        }
+        for n, futuro in enumerate(as_completed(futuros), 1):
+            par, a, b = futuros[futuro]
+            try:
+                linha = futuro.result()
+            except Exception as e:
+                # Processo do pool morreu (ex.: falta de memória): só este par falha
+                linha = {"PAR": par, "ARQUIVO_A": a, "ARQUIVO_B": b, "STATUS": "erro",
+                         "ERRO": f"{type(e).__name__}: {e}", "SEGUNDOS": 0.0}
+            linhas.append(linha)
+            marca = "✔" if linha["STATUS"] == "ok" else f"❌ {linha['ERRO']}"
+            print(f"[{n}/{total}] {par} {marca}", flush=True)
+
+    # convert_dtypes mantém as contagens inteiras mesmo com pares que falharam
+    resumo = pd.DataFrame(linhas).convert_dtypes()
+    if len(resumo):
+        resumo = resumo.sort_values("PAR", kind="stable")
+    resumo.to_csv(os.path.join(saida, ARQUIVO_RESUMO_LOTE), index=False)
+    return resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara vários pares POSTO/PMM em paralelo.")
+    parser.add_argument("origem", help="pasta com os pares ou manifesto CSV (colunas: par, posto, pmm)")
+    parser.add_argument("--saida", default=SAIDA_LOTE, help=f"pasta dos relatórios (padrão: {SAIDA_LOTE})")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processos em paralelo (padrão: número de núcleos)")
+    parser.add_argument("--formato", choices=[f for f in FORMATOS_SAIDA if f != "texto"], default="csv",
+                        help="formato da tabela de ocorrências de cada par")
+    parser.add_argument("--sem-pdf", action="store_true", help="não gera o PDF detalhado de cada par")
+    parser.add_argument("--estado", help="pasta do estado incremental (uma subpasta por par)")
+    args = parser.parse_args()
+
+    pares = descobrir_pares(args.origem)
+    if not pares:
+        print(f"❌ Nenhum par POSTO/PMM encontrado em '{args.origem}'.")
+        sys.exit(1)
+
+    print(f"Comparando {len(pares)} pares...")
+    resumo = rodar_lote(pares, args.saida, args.workers, args.formato, not args.sem_pdf, args.estado)
+    falhas = int((resumo["STATUS"] != "ok").sum())
+    print(f"\n📊 Resumo consolidado em '{os.path.join(args.saida, ARQUIVO_RESUMO_LOTE)}'"
+          f" ({len(resumo) - falhas} ok, {falhas} com erro).")
+    sys.exit(1 if falhas else 0)
@@ -0,0 +1,546 @@
+import os
+import shutil
+import tempfile
+import uuid
+import weakref
+from collections.abc import Mapping
+
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ingestao import ler_planilha_em_blocos, LINHAS_POR_BLOCO_LEITURA
+from instrumentacao import etapa
+from auditoria import (
+    FONTES_REGRAS, COLUNAS_SUGESTOES, tipar_planilhas, verificar_notas, montar_achados,
+    sugerir_pares, COLUNAS_REFERENCIAS, ESCALA_MAD, ESCALA_DESVIO_MEDIO, SETOR_TODOS,
+)
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+# Modo fora da memória: todas as regras (exceto as sugestões de pareamento)
+# dependem só das linhas da mesma nota, então A e B são espalhados por hash
+# da nota em baldes no disco e analisados em partições (grupos de baldes)
+# que cabem no orçamento de memória. Só os achados (em Parquet, por regra) e
+# os resumos são juntados no fim; as sugestões rodam uma vez, sobre as notas
+# sem par de todas as partições.
+MEMORIA_MB = int(os.environ.get("COMPARADOR_MEMORIA_MB", "512"))
+PARTICOES_DIR = os.environ.get("COMPARADOR_PARTICOES_DIR", ".particoes_auditoria")
+NUM_BALDES = 128
+
+# Pico aproximado da análise em memória por linha de entrada (planilhas
+# tipadas, pareamento e tabelas de achados), medido com tracemalloc
+BYTES_POR_LINHA = 600
+
+LINHAS_POR_BLOCO = 50_000
+
+# Referências de litragem: faixas por passada na seleção da mediana e do MAD
+# e memória por litragem candidata lida na passada final
+FAIXAS_SELECAO = 1024
+BYTES_POR_CANDIDATO = 32
+
+ESQUEMA_ENTRADA = pa.schema([
+    ("DATA", pa.timestamp("ns")),
+    ("NOTA", pa.string()),
+    ("TIPO", pa.string()),
+    ("VALOR", pa.float64()),
+    ("SETOR", pa.string()),
+])
+
+# -------------------------------------------------------------------------
+# ESPALHAMENTO POR NOTA
+# -------------------------------------------------------------------------
+def _blocos(fonte):
+    if isinstance(fonte, pd.DataFrame):
+        for inicio in range(0, max(len(fonte), 1), LINHAS_POR_BLOCO_LEITURA):
+            yield fonte.iloc[inicio:inicio + LINHAS_POR_BLOCO_LEITURA]
+    else:
+        yield from ler_planilha_em_blocos(fonte)
+
+def _baldes(bloco, inicio):
+    # Mesma nota (já com os zeros à esquerda de tipar_planilhas) -> mesmo balde;
+    # linhas sem nota não se relacionam entre si e são distribuídas pela posição
+    nota = bloco["NOTA"].astype(object)
+    vazia = nota.isna().to_numpy()
+    texto = nota.where(vazia, nota.astype(str).str.zfill(4)).to_numpy()
+    baldes = np.arange(inicio, inicio + len(bloco)) % NUM_BALDES
+    baldes[~vazia] = pd.util.hash_array(texto[~vazia]) % np.uint64(NUM_BALDES)
+    return baldes
+
+def _espalhar(fonte, pasta, lado):
+    # Grava as linhas de um lado em NUM_BALDES arquivos; devolve as linhas por balde
+    escritores = {}
+    linhas = np.zeros(NUM_BALDES, dtype=np.int64)
+    inicio = 0
+    try:
+        for bloco in _blocos(fonte):
+            bloco = bloco[list(ESQUEMA_ENTRADA.names)]
+            baldes = _baldes(bloco, inicio)
+            inicio += len(bloco)
+            ordem = np.argsort(baldes, kind="stable")
+            limites = np.searchsorted(baldes[ordem], np.arange(NUM_BALDES + 1))
+            # Uma conversão para Arrow por bloco; cada balde é uma fatia dela
+            tabela = pa.Table.from_pandas(bloco, schema=ESQUEMA_ENTRADA, preserve_index=False)
+            tabela = tabela.take(pa.array(ordem))
+            for b in np.flatnonzero(np.diff(limites)):
+                if b not in escritores:
+                    escritores[b] = pq.ParquetWriter(
+                        os.path.join(pasta, f"{lado}-{b}.parquet"), ESQUEMA_ENTRADA
+                    )
+                escritores[b].write_table(tabela.slice(limites[b], limites[b + 1] - limites[b]))
+                linhas[b] += limites[b + 1] - limites[b]
+    finally:
+        for escritor in escritores.values():
+            escritor.close()
+    return linhas
+
+def _ler_baldes(pasta, lado, baldes):
+    partes = [
+        pd.read_parquet(os.path.join(pasta, f"{lado}-{b}.parquet"))
+        for b in baldes if os.path.exists(os.path.join(pasta, f"{lado}-{b}.parquet"))
+    ]
+    if not partes:
+        return pd.DataFrame({c: pd.Series(dtype=t.to_pandas_dtype()) for c, t in
+                             zip(ESQUEMA_ENTRADA.names, ESQUEMA_ENTRADA.types)})
+    return pd.concat(partes, ignore_index=True)
+
+# -------------------------------------------------------------------------
+# REFERÊNCIAS DE LITRAGEM EM PASSADAS PELOS BALDES
+# -------------------------------------------------------------------------
+# A mediana e o MAD de cada tipo e setor dependem de todas as litragens do
+# grupo, espalhadas por todos os baldes. Cada estatística de ordem (a k-ésima
+# litragem de um grupo) é achada em passadas pelos baldes, um bloco por vez:
+# a passada conta as litragens de cada grupo em FAIXAS_SELECAO faixas do
+# intervalo que ainda contém a k-ésima e estreita o intervalo para a faixa
+# dela. Quando os intervalos abertos somam poucas litragens (o orçamento de
+# memória), elas são lidas e ordenadas. Litragens válidas e desvios são >= 0,
+# e para esses floats os bits lidos como int64 têm a mesma ordem dos valores:
+# as faixas são de inteiros, sem arredondamento, e o resultado é o mesmo de
+# auditoria.referencias_litragem. A memória fica em grupos x faixas.
+
+class _GruposLitragem:
+    # Grupo (TIPO, SETOR) e grupo do tipo inteiro (SETOR_TODOS) de cada linha,
+    # com os mesmos nomes canônicos (maiúsculas) de auditoria.referencias_litragem
+    def __init__(self):
+        self.chaves = []
+        self._ids = {}
+
+    def _id(self, chave):
+        if chave not in self._ids:
+            self._ids[chave] = len(self.chaves)
+            self.chaves.append(chave)
+        return self._ids[chave]
+
+    def codigos(self, lote):
+        # (grupo por setor, grupo por tipo, litragem) das linhas com tipo e litragem > 0
+        tipo, setor = lote.column("TIPO"), lote.column("SETOR")
+        tipos = [str(t).upper() for t in tipo.dictionary.to_pylist()]
+        setores = [str(c).upper() for c in setor.dictionary.to_pylist()] + [""]
+        valor = lote.column("VALOR").to_numpy(zero_copy_only=False)
+        validas = tipo.is_valid().to_numpy(zero_copy_only=False) & (valor > 0)
+        codigo_tipo = tipo.indices.to_numpy(zero_copy_only=False)[validas].astype(np.int64)
+        codigo_setor = setor.indices.fill_null(len(setores) - 1).to_numpy(zero_copy_only=False)[validas]
+        # Poucos pares distintos por bloco: os ids saem de um dicionário, não por linha
+        pares, inverso = np.unique(codigo_tipo * len(setores) + codigo_setor, return_inverse=True)
+        por_setor = np.array([self._id((tipos[p // len(setores)], setores[p % len(setores)])) for p in pares],
+                             dtype=np.int64)
+        por_tipo = np.array([self._id((tipos[p // len(setores)], SETOR_TODOS)) for p in pares],
+                            dtype=np.int64)
+        return por_setor[inverso], por_tipo[inverso], valor[validas]
+
+def _litragens(pasta, lado, grupos):
+    # Gera (grupo, litragem) de todos os baldes de um lado, em blocos; cada
+    # litragem aparece no grupo do seu setor e no do seu tipo
+    for b in range(NUM_BALDES):
+        arquivo = os.path.join(pasta, f"{lado}-{b}.parquet")
+        if not os.path.exists(arquivo):
+            continue
+        leitor = pq.ParquetFile(arquivo, read_dictionary=["TIPO", "SETOR"])
+        for lote in leitor.iter_batches(batch_size=LINHAS_POR_BLOCO, columns=["TIPO", "SETOR", "VALOR"]):
+            por_setor, por_tipo, valor = grupos.codigos(lote)
+            yield np.concatenate([por_setor, por_tipo]), np.concatenate([valor, valor])
+
+def _chave_ordem(valores):
+    return np.ascontiguousarray(valores, dtype=np.float64).view(np.int64)
+
+def _selecionar(blocos, ks, linhas, minimo, maximo, limite):
+    # ks[g, j]: posição (a partir de 0) procurada entre as `linhas[g]` do grupo
+    # g, com chaves de ordem entre minimo[g] e maximo[g]; `blocos()` devolve um
+    # novo iterador de (grupo, valores). Devolve os valores dessas posições.
+    n_grupos, m = ks.shape
+    inicio = np.repeat(minimo[:, None], m, axis=1).astype(np.int64)
+    fim = np.repeat(maximo[:, None] + 1, m, axis=1).astype(np.int64)
+    abaixo = np.zeros((n_grupos, m), dtype=np.int64)
+    no_intervalo = np.repeat(linhas[:, None], m, axis=1).astype(np.int64)
+
+    while True:
+        aberto = fim - inicio > 1
+        if no_intervalo[aberto].sum() <= limite:
+            break
+        # Uma passada: contagem de cada intervalo aberto em FAIXAS_SELECAO faixas
+        largura = -(-(fim - inicio) // FAIXAS_SELECAO)
+        contagem = np.zeros(n_grupos * m * FAIXAS_SELECAO, dtype=np.int64)
+        for grupo, valores in blocos():
+            chave = _chave_ordem(valores)
+            for j in range(m):
+                dentro = aberto[grupo, j] & (chave >= inicio[grupo, j]) & (chave < fim[grupo, j])
+                g = grupo[dentro]
+                faixa = (chave[dentro] - inicio[g, j]) // largura[g, j]
+                contagem += np.bincount((g * m + j) * FAIXAS_SELECAO + faixa, minlength=len(contagem))
+        contagem = contagem.reshape(n_grupos, m, FAIXAS_SELECAO)
+        acumulado = np.cumsum(contagem, axis=2)
+        faixa = (acumulado <= (ks - abaixo)[:, :, None]).sum(axis=2)
+        faixa = np.minimum(faixa, FAIXAS_SELECAO - 1)
+        antes = np.take_along_axis(acumulado, faixa[:, :, None], axis=2)[:, :, 0] - \
+            np.take_along_axis(contagem, faixa[:, :, None], axis=2)[:, :, 0]
+        novo_inicio = inicio + faixa * largura
+        abaixo = np.where(aberto, abaixo + antes, abaixo)
+        no_intervalo = np.where(
+            aberto, np.take_along_axis(contagem, faixa[:, :, None], axis=2)[:, :, 0], no_intervalo
+        )
+        fim = np.where(aberto, np.minimum(novo_inicio + largura, fim), fim)
+        inicio = np.where(aberto, novo_inicio, inicio)
+
+    # Intervalos de um valor só já são a resposta; os demais são lidos e ordenados
+    resultado = inicio.copy()
+    aberto = fim - inicio > 1
+    if aberto.any():
+        alvos, chaves = [], []
+        for grupo, valores in blocos():
+            chave = _chave_ordem(valores)
+            for j in range(m):
+                dentro = aberto[grupo, j] & (chave >= inicio[grupo, j]) & (chave < fim[grupo, j])
+                alvos.append(grupo[dentro] * m + j)
+                chaves.append(chave[dentro])
+        alvos, chaves = np.concatenate(alvos), np.concatenate(chaves)
+        ordem = np.lexsort((chaves, alvos))
+        alvos, chaves = alvos[ordem], chaves[ordem]
+        primeiro = np.searchsorted(alvos, np.arange(n_grupos * m))
+        escolhido = (primeiro + (ks - abaixo).ravel())[aberto.ravel()]
+        resultado[aberto] = chaves[escolhido]
+    return resultado.view(np.float64)
+
+def _totais(blocos, grupos):
+    # Uma passada: linhas, soma e menor e maior chave de ordem de cada grupo
+    linhas, soma = np.zeros(0, dtype=np.int64), np.zeros(0)
+    minimo, maximo = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    for grupo, valores in blocos:
+        novos = len(grupos.chaves) - len(linhas)
+        linhas, soma = np.append(linhas, np.zeros(novos, dtype=np.int64)), np.append(soma, np.zeros(novos))
+        minimo = np.append(minimo, np.full(novos, np.iinfo(np.int64).max))
+        maximo = np.append(maximo, np.zeros(novos, dtype=np.int64))
+        chave = _chave_ordem(valores)
+        linhas += np.bincount(grupo, minlength=len(linhas))
+        soma += np.bincount(grupo, weights=valores, minlength=len(linhas))
+        np.minimum.at(minimo, grupo, chave)
+        np.maximum.at(maximo, grupo, chave)
+    return linhas, soma, minimo, maximo
+
+def _referencias_baldes(pasta, lado, memoria_mb=MEMORIA_MB):
+    # Mesmo resultado de referencias_litragem sobre todas as linhas do lado,
+    # sem juntá-las: só blocos de um balde e contagens por grupo na memória
+    grupos = _GruposLitragem()
+    linhas, _, minimo, maximo = _totais(_litragens(pasta, lado, grupos), grupos)
+    if not grupos.chaves:
+        return pd.DataFrame(columns=COLUNAS_REFERENCIAS)
+
+    # Mediana: média das litragens nas posições (n-1)//2 e n//2 do grupo
+    ks = np.stack([(linhas - 1) // 2, linhas // 2], axis=1)
+    limite = max(int(memoria_mb * 1024 * 1024) // BYTES_POR_CANDIDATO, 1)
+    ordem = _selecionar(lambda: _litragens(pasta, lado, grupos), ks, linhas, minimo, maximo, limite)
+    mediana = (ordem[:, 0] + ordem[:, 1]) / 2
+
+    # MAD: a mesma seleção sobre os desvios absolutos até a mediana
+    def desvios():
+        for grupo, valores in _litragens(pasta, lado, grupos):
+            yield grupo, np.abs(valores - mediana[grupo])
+
+    _, soma, minimo, maximo = _totais(desvios(), grupos)
+    ordem = _selecionar(desvios, ks, linhas, minimo, maximo, limite)
+    mad, medio = (ordem[:, 0] + ordem[:, 1]) / 2, soma / linhas
+
+    tabela = pd.DataFrame(grupos.chaves, columns=["TIPO", "SETOR"]).assign(
+        MEDIANA=mediana,
+        DESVIO=np.where(mad > 0, ESCALA_MAD * mad, ESCALA_DESVIO_MEDIO * medio),
+        LINHAS=linhas,
+        LADO=lado.upper(),
+    )
+    return tabela[COLUNAS_REFERENCIAS]
+
+def _particoes(linhas, orcamento):
+    # Baldes consecutivos agrupados enquanto a estimativa cabe no orçamento
+    # (um balde maior que o orçamento vai sozinho)
+    limite = max(orcamento // BYTES_POR_LINHA, 1)
+    grupos, atual, soma = [], [], 0
+    for b in range(NUM_BALDES):
+        if atual and soma + linhas[b] > limite:
+            grupos.append(atual)
+            atual, soma = [], 0
+        atual.append(b)
+        soma += linhas[b]
+    grupos.append(atual)
+    return grupos
+
+# -------------------------------------------------------------------------
+# ACHADOS GRAVADOS EM DISCO
+# -------------------------------------------------------------------------
+def _para_arrow(df, setor, esquema=None):
+    # Categorias viram texto (cada partição tem as suas) e as colunas auxiliares
+    # DIA saem; _SETOR guarda o setor canônico de cada linha para o fatiamento
+    # (o dicionário inteiro das notas da partição não é convertido a cada bloco)
+    colunas = {}
+    for col in df.columns:
+        if col.startswith("DIA"):
+            continue
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # Código -1 (vazio) pega o None do fim
+            categorias = np.append(np.asarray(serie.cat.categories, dtype=object), None)
+            colunas[col] = pa.array(categorias[serie.cat.codes.to_numpy()], pa.string())
+        else:
+            colunas[col] = pa.Array.from_pandas(serie)
+    colunas["_SETOR"] = pa.array(np.full(len(df), setor, dtype=object), pa.string())
+    tabela = pa.table(colunas)
+    if esquema is None:
+        esquema = pa.schema([
+            pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in tabela.schema
+        ])
+    return tabela.cast(esquema)
+
+class _Gravador:
+    # Um arquivo Parquet por regra, com as linhas de todas as partições. Cada
+    # row group tem um setor só e até LINHAS_POR_BLOCO linhas; `row_groups`
+    # guarda (setor, linhas) de cada um, para a leitura de uma página abrir
+    # só os row groups dela
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.escritores = {}
+        self.contagens = {chave: {} for chave in FONTES_REGRAS}
+        self.row_groups = {chave: [] for chave in FONTES_REGRAS}
+
+    def gravar(self, chave, setor, tabela):
+        if chave not in self.escritores:
+            t = _para_arrow(tabela, setor)
+            self.escritores[chave] = pq.ParquetWriter(os.path.join(self.pasta, f"{chave}.parquet"), t.schema)
+        else:
+            t = _para_arrow(tabela, setor, self.escritores[chave].schema)
+        if len(t):
+            self.escritores[chave].write_table(t, row_group_size=LINHAS_POR_BLOCO)
+            self.contagens[chave][setor] = self.contagens[chave].get(setor, 0) + len(t)
+            for inicio in range(0, len(t), LINHAS_POR_BLOCO):
+                self.row_groups[chave].append((setor, min(LINHAS_POR_BLOCO, len(t) - inicio)))
+
+    def fechar(self):
+        for escritor in self.escritores.values():
+            escritor.close()
+
+class _PastaAchados:
+    # Pasta dos achados de uma análise; apagada quando o resultado e todas as
+    # suas fatias deixam de existir
+    def __init__(self, caminho):
+        self.caminho = caminho
+        weakref.finalize(self, shutil.rmtree, caminho, True)
+
+def _somar(destino, resumo):
+    for k, v in resumo.items():
+        destino[k] = destino.get(k, 0) + v
+
+class AchadosEmDisco(Mapping):
+    # Mesma interface de auditoria.Achados, lendo as tabelas dos arquivos por regra
+    def __init__(self, pasta, contagens, row_groups, resumos, nomes, consumo, setor=None, chave=None):
+        self.chave = chave or uuid.uuid4().hex
+        self.pasta = pasta
+        self.consumo = consumo
+        self.contagens = contagens  # {regra: {setor canônico: linhas}}
+        self.row_groups = row_groups  # {regra: [(setor canônico, linhas) de cada row group]}
+        self.resumos = resumos      # {setor canônico: resumo}; "" = sem setor
+        self.nomes = nomes          # {setor canônico: nome exibido}
+        self.setor = setor
+        if setor is None:
+            self.resumo = {}
+            for resumo in resumos.values():
+                _somar(self.resumo, resumo)
+        else:
+            vazio = {k: 0 for k in next(iter(resumos.values()), {})}
+            self.resumo = resumos.get(setor, vazio)
+
+    def __getitem__(self, chave):
+        if chave == "resumo":
+            return self.resumo
+        return self.tabela(chave)
+
+    def __iter__(self):
+        yield from FONTES_REGRAS
+        yield "resumo"
+
+    def __len__(self):
+        return len(FONTES_REGRAS) + 1
+
+    @property
+    def setores(self):
+        return sorted(self.nomes[s] for s in self.nomes if s)
+
+    def contagem(self, chave):
+        por_setor = self.contagens[chave]
+        return sum(por_setor.values()) if self.setor is None else por_setor.get(self.setor, 0)
+
+    def _arquivo(self, chave):
+        return os.path.join(self.pasta.caminho, f"{chave}.parquet")
+
+    def _grupos(self, chave):
+        # Row groups do setor da fatia (todos, sem fatia) e as linhas de cada um
+        grupos = [(i, n) for i, (setor, n) in enumerate(self.row_groups[chave])
+                  if self.setor is None or setor == self.setor]
+        indices = np.array([i for i, _ in grupos], dtype=np.int64)
+        return indices, np.array([n for _, n in grupos], dtype=np.int64)
+
+    def _colunas(self, arquivo, colunas):
+        nomes = [c for c in arquivo.schema_arrow.names if c != "_SETOR"]
+        return nomes if colunas is None else [c for c in colunas if c in nomes]
+
+    def tabela(self, chave, colunas=None, linhas=None):
+        # Como Achados.tabela; só os row groups com as linhas pedidas são lidos
+        if not os.path.exists(self._arquivo(chave)):
+            return pd.DataFrame()
+        arquivo = pq.ParquetFile(self._arquivo(chave))
+        colunas = self._colunas(arquivo, colunas)
+        indices, tamanhos = self._grupos(chave)
+        if linhas is not None:
+            # Posição na fatia -> (row group, posição nele); a leitura junta só
+            # os row groups usados, na ordem do arquivo
+            linhas = np.asarray(linhas, dtype=np.int64)
+            inicios = np.cumsum(tamanhos) - tamanhos
+            grupo = np.searchsorted(inicios, linhas, side="right") - 1
+            usados = np.unique(grupo)
+            posicao = np.zeros(len(tamanhos), dtype=np.int64)
+            posicao[usados] = np.cumsum(tamanhos[usados]) - tamanhos[usados]
+            linhas = posicao[grupo] + linhas - inicios[grupo]
+            indices = indices[usados]
+        if not len(indices):
+            tabela = arquivo.schema_arrow.empty_table().select(colunas)
+        else:
+            tabela = arquivo.read_row_groups(indices.tolist(), columns=colunas)
+        if linhas is not None:
+            tabela = tabela.take(pa.array(linhas, type=pa.int64()))
+        return tabela.to_pandas()
+
+    def blocos(self, chave, tamanho):
+        # A tabela em pedaços de até `tamanho` linhas (sempre ao menos um, talvez vazio)
+        if not os.path.exists(self._arquivo(chave)):
+            yield pd.DataFrame()
+            return
+        arquivo = pq.ParquetFile(self._arquivo(chave))
+        colunas = self._colunas(arquivo, None)
+        indices, _ = self._grupos(chave)
+        entregues = 0
+        if len(indices):
+            lotes = arquivo.iter_batches(batch_size=tamanho, row_groups=indices.tolist(), columns=colunas)
+            for lote in lotes:
+                entregues += 1
+                yield lote.to_pandas()
+        if not entregues:
+            yield arquivo.schema_arrow.empty_table().select(colunas).to_pandas()
+
+    def fatiar(self, setor):
+        if not setor or setor == "Todos":
+            return self
+        consumo = self.consumo[self.consumo["Setor"].str.upper() == setor.upper()]
+        return AchadosEmDisco(self.pasta, self.contagens, self.row_groups, self.resumos, self.nomes, consumo,
+                              setor.upper(), f"{self.chave}:{setor.upper()}")
+
+# -------------------------------------------------------------------------
+# FUNÇÃO PRINCIPAL
+# -------------------------------------------------------------------------
+def analisar_particionado(fonte_a, fonte_b, memoria_mb=MEMORIA_MB, progresso=None):
+    # `fonte_a`/`fonte_b`: caminhos, arquivos enviados ou DataFrames já lidos.
+    # O pico de memória fica perto de `memoria_mb` independente do tamanho das
+    # planilhas; os achados ficam em disco até o resultado ser descartado.
+    # `progresso(parte, total)` é chamado a cada partição analisada.
+    os.makedirs(PARTICOES_DIR, exist_ok=True)
+    pasta = tempfile.mkdtemp(dir=PARTICOES_DIR)
+    baldes = os.path.join(pasta, "baldes")
+    os.makedirs(baldes)
+    try:
+        with etapa("Espalhando em baldes") as e:
+            linhas = _espalhar(fonte_a, baldes, "a") + _espalhar(fonte_b, baldes, "b")
+            e.linhas = int(linhas.sum())
+        grupos = _particoes(linhas, memoria_mb * 1024 * 1024)
+        with etapa("Referências de litragem"):
+            referencias = pd.concat([_referencias_baldes(baldes, "a", memoria_mb),
+                                     _referencias_baldes(baldes, "b", memoria_mb)], ignore_index=True)
+
+        gravador = _Gravador(pasta)
+        resumos, nomes, consumos = {}, {}, []
+        # As notas sem par de cada partição vão para o disco; só as sugestões,
+        # no fim, leem as de todas as partições
+        orfas = {lado: pq.ParquetWriter(os.path.join(baldes, f"orfas-{lado}.parquet"), ESQUEMA_ENTRADA)
+                 for lado in ("a", "b")}
+        try:
+            for n, grupo in enumerate(grupos, 1):
+                with etapa("Lendo partição") as e:
+                    df_a, df_b = tipar_planilhas(_ler_baldes(baldes, "a", grupo), _ler_baldes(baldes, "b", grupo))
+                    e.linhas = len(df_a) + len(df_b)
+                intra_a, intra_b, pares = verificar_notas(df_a, df_b)
+                achados = montar_achados(df_a, df_b, intra_a, intra_b, pares,
+                                         sugestoes=pd.DataFrame(columns=COLUNAS_SUGESTOES),
+                                         referencias=referencias)
+
+                consumos.append(achados.consumo)
+                with etapa("Gravando achados"):
+                    for nome, fatia in achados.fatias():
+                        setor = nome.upper() if nome is not None else ""
+                        nomes[setor] = min(nomes.get(setor, nome or ""), nome or "")
+                        _somar(resumos.setdefault(setor, {}), fatia.resumo)
+                        for chave in FONTES_REGRAS:
+                            if chave != "sugestoes_pares":
+                                for bloco in fatia.blocos(chave, LINHAS_POR_BLOCO):
+                                    gravador.gravar(chave, setor, bloco)
+
+                colunas = list(ESQUEMA_ENTRADA.names)
+                texto = {"NOTA": object, "TIPO": object, "SETOR": object}
+                for lado, df, outro in (("a", df_a, "b"), ("b", df_b, "a")):
+                    sem_par = df.iloc[pares[lado][pares[outro] < 0]][colunas].astype(texto)
+                    orfas[lado].write_table(
+                        pa.Table.from_pandas(sem_par, schema=ESQUEMA_ENTRADA, preserve_index=False))
+                del df_a, df_b, achados, intra_a, intra_b, pares
+                if progresso:
+                    progresso(n, len(grupos))
+
+            # Sugestões entre as notas sem par de todas as partições
+            for escritor in orfas.values():
+                escritor.close()
+            orf_a, orf_b = tipar_planilhas(pd.read_parquet(os.path.join(baldes, "orfas-a.parquet")),
+                                           pd.read_parquet(os.path.join(baldes, "orfas-b.parquet")))
+            sem_par = {
+                "a": np.concatenate([np.arange(len(orf_a)), np.full(len(orf_b), -1)]).astype(np.intp),
+                "b": np.concatenate([np.full(len(orf_a), -1), np.arange(len(orf_b))]).astype(np.intp),
+            }
+            with etapa("Sugestões de pareamento", len(orf_a) + len(orf_b)):
+                sugestoes = sugerir_pares(orf_a, orf_b, sem_par)
+            setor = sugestoes["SETOR_A"].astype(object).where(
+                sugestoes["SETOR_A"].notna(), sugestoes["SETOR_B"].astype(object)
+            ).fillna("").astype(str).str.upper()
+            for s, parte in sugestoes.groupby(setor.to_numpy(), sort=False):
+                resumos.setdefault(s, {k: 0 for k in next(iter(resumos.values()))})
+                resumos[s]["Sugestões de pareamento"] += len(parte)
+                gravador.gravar("sugestoes_pares", s, parte)
+            if "sugestoes_pares" not in gravador.escritores:
+                gravador.gravar("sugestoes_pares", "", sugestoes)
+        finally:
+            for escritor in orfas.values():
+                escritor.close()
+            gravador.fechar()
+    except BaseException:
+        shutil.rmtree(pasta, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(baldes, ignore_errors=True)
+
+    # Consumo das partições somado por setor (com o nome exibido de cada setor)
+    consumo = pd.concat(consumos, ignore_index=True)
+    consumo["Setor"] = consumo["Setor"].str.upper().map(nomes)
+    consumo = consumo.groupby(["Origem", "Setor", "Combustível"], sort=False, as_index=False)["Litros"].sum()
+    return AchadosEmDisco(_PastaAchados(pasta), gravador.contagens, gravador.row_groups, resumos, nomes,
+                          consumo[["Setor", "Origem", "Combustível", "Litros"]])
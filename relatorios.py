@@ -0,0 +1,303 @@
+import math
+import threading
+import contextvars
+from io import BytesIO
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from openpyxl import Workbook
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Frame
+from reportlab.platypus.doctemplate import LayoutError
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib import colors
+from reportlab.pdfgen import canvas
+
+from instrumentacao import etapa
+from historico import COLUNAS_HISTORICO
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+# Linhas montadas e gravadas por vez; o Excel é escrito em modo write-only,
+# então a memória fica limitada a um bloco, não ao tamanho do relatório.
+LINHAS_POR_BLOCO = 5000
+
+ABAS_PRINCIPAIS = [("POSTO", "df_a"), ("PMM", "df_b"), ("Comparacao", "merged")]
+
+# PDF detalhado: as linhas são montadas em lotes de páginas e desenhadas
+# direto no canvas, então memória e tempo crescem só com o número de páginas
+LINHAS_POR_PAGINA = 30
+PAGINAS_POR_LOTE = 20
+MARGEM_PDF = 36
+ALTURA_LINHA_PDF = 14
+TAMANHO_FONTE_TABELA = 7
+LARGURA_CARACTERE_PDF = TAMANHO_FONTE_TABELA * 0.6  # Courier
+
+COLUNAS_PLANILHA = ["DATA", "NOTA", "TIPO", "VALOR", "SETOR"]
+COLUNAS_COMPARACAO = ["NOTA", "DATA_A", "DATA_B", "TIPO_A", "TIPO_B", "VALOR_A", "VALOR_B", "SETOR_A", "SETOR_B"]
+# Sugestões no PDF: as 12 colunas de auditoria.COLUNAS_SUGESTOES não cabem na largura da página
+COLUNAS_SUGESTOES_PDF = ["NOTA_A", "NOTA_B", "DATA_A", "DATA_B", "VALOR_A", "VALOR_B", "PONTUACAO", "MOTIVO"]
+
+SECOES_PDF = [
+    ("duplicadas_a", "Duplicadas A", COLUNAS_PLANILHA),
+    ("duplicadas_b", "Duplicadas B", COLUNAS_PLANILHA),
+    ("negativos_a", "Negativos A", COLUNAS_PLANILHA),
+    ("negativos_b", "Negativos B", COLUNAS_PLANILHA),
+    ("rep_mesmo_dia_a", "Repetidas Mesmo Dia A", COLUNAS_PLANILHA),
+    ("rep_mesmo_dia_b", "Repetidas Mesmo Dia B", COLUNAS_PLANILHA),
+    ("nota_diff_a", "Nota em Dias Diferentes A", COLUNAS_PLANILHA),
+    ("nota_diff_b", "Nota em Dias Diferentes B", COLUNAS_PLANILHA),
+    ("litragens_atipicas_a", "Litragens Atípicas A", COLUNAS_PLANILHA),
+    ("litragens_atipicas_b", "Litragens Atípicas B", COLUNAS_PLANILHA),
+    ("notas_apenas_em_a", "Somente na A", COLUNAS_COMPARACAO),
+    ("notas_apenas_em_b", "Somente na B", COLUNAS_COMPARACAO),
+    ("sugestoes_pares", "Sugestões de Pareamento", COLUNAS_SUGESTOES_PDF),
+    ("datas_divergentes", "Datas Divergentes", COLUNAS_COMPARACAO),
+    ("tipos_divergentes", "Tipos Divergentes", COLUNAS_COMPARACAO),
+    ("valores_divergentes", "Valores Divergentes", COLUNAS_COMPARACAO),
+    ("notas_outro_periodo", "Notas de Outros Períodos", COLUNAS_HISTORICO),
+]
+
+# Relatórios já gerados (ou em geração), por resultado de análise
+MEMO_MAX_ITENS = 16
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="relatorios")
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+# -------------------------------------------------------------------------
+# EXCEL
+# -------------------------------------------------------------------------
+def _escrever_aba(wb, nome, blocos):
+    ws = wb.create_sheet(nome)
+    for n, bloco in enumerate(blocos):
+        if n == 0:
+            ws.append([str(c) for c in bloco.columns])
+        valores = bloco.astype(object).where(bloco.notna(), None)
+        for linha in valores.itertuples(index=False, name=None):
+            ws.append(linha)
+
+def gerar_excel(results):
+    with etapa("Excel"):
+        wb = Workbook(write_only=True)
+
+        _escrever_aba(wb, "Resumo", [pd.DataFrame([results["resumo"]])])
+        for nome, chave in ABAS_PRINCIPAIS:
+            with etapa(f"Aba {nome}", results.contagem(chave)):
+                _escrever_aba(wb, nome, results.blocos(chave, LINHAS_POR_BLOCO))
+
+        principais = {chave for _, chave in ABAS_PRINCIPAIS} | {"resumo"}
+        achados = [c for c in results if c not in principais and results.contagem(c) > 0]
+        with etapa("Abas dos achados", sum(results.contagem(c) for c in achados)):
+            for chave in achados:
+                _escrever_aba(wb, chave[:31], results.blocos(chave, LINHAS_POR_BLOCO))
+
+        buf = BytesIO()
+        with etapa("Gravando Excel"):
+            wb.save(buf)
+        buf.seek(0)
+        return buf
+
+# -------------------------------------------------------------------------
+# PDF
+# -------------------------------------------------------------------------
+def gerar_pdf(results):
+    with etapa("PDF resumo"):
+        return _gerar_pdf(results)
+
+def _gerar_pdf(results):
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4)
+    styles = getSampleStyleSheet()
+    story = []
+
+    story.append(Paragraph("<b>Relatório de Auditoria</b>", styles["Title"]))
+    story.append(Spacer(1, 8))
+    story.append(Paragraph(f"Gerado em {datetime.now()}", styles["BodyText"]))
+    story.append(Spacer(1, 8))
+
+    for k, v in results["resumo"].items():
+        if isinstance(v, float):
+            story.append(Paragraph(f"<b>{k}:</b> {v:.2f}", styles["BodyText"]))
+        else:
+            story.append(Paragraph(f"<b>{k}:</b> {v}", styles["BodyText"]))
+        story.append(Spacer(1, 4))
+
+    doc.build(story)
+    buf.seek(0)
+    return buf
+
+# -------------------------------------------------------------------------
+# PDF DETALHADO (PAGINADO, MEMÓRIA LIMITADA)
+# -------------------------------------------------------------------------
+def _largura_colunas(n_cols):
+    # A largura da coluna é um número inteiro de caracteres, para a grade
+    # coincidir com o texto monoespaçado
+    util = landscape(A4)[0] - 2 * MARGEM_PDF
+    chars = max(int(util / n_cols / LARGURA_CARACTERE_PDF), 2)
+    return chars * LARGURA_CARACTERE_PDF, chars
+
+def _formatar_bloco(bloco, colunas):
+    # Cada linha vira uma string de colunas com largura fixa (fonte monoespaçada)
+    bloco = bloco[[c for c in colunas if c in bloco.columns]]
+    _, chars = _largura_colunas(len(bloco.columns))
+    linhas = pd.Series("", index=bloco.index)
+    for col in bloco.columns:
+        serie = bloco[col]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            texto = serie.dt.strftime("%d/%m/%Y").fillna("")
+        elif pd.api.types.is_float_dtype(serie):
+            texto = serie.map(lambda v: "" if pd.isna(v) else f"{v:.2f}")
+        else:
+            valores = pd.Series(serie.to_numpy(dtype=object), index=serie.index)
+            texto = valores.where(valores.notna(), "").astype(str)
+        linhas = linhas + " " + texto.str.slice(0, chars - 2).str.ljust(chars - 1)
+    cabecalho = "".join(" " + str(c)[:chars - 2].ljust(chars - 1) for c in bloco.columns)
+    return cabecalho, len(bloco.columns), linhas.tolist()
+
+def _pagina_tabela(c, titulo, cabecalho, n_cols, linhas, pagina):
+    # Grade desenhada direto no canvas, com uma linha de texto por registro
+    largura, altura = landscape(A4)
+    larg_col, _ = _largura_colunas(n_cols)
+    util = larg_col * n_cols
+    topo = altura - MARGEM_PDF - 16
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(MARGEM_PDF, altura - MARGEM_PDF, titulo)
+
+    c.setFillColor(colors.lightgrey)
+    c.rect(MARGEM_PDF, topo - ALTURA_LINHA_PDF, util, ALTURA_LINHA_PDF, stroke=0, fill=1)
+    c.setFillColor(colors.black)
+    c.setStrokeColor(colors.grey)
+    c.setLineWidth(0.25)
+    c.grid(
+        [MARGEM_PDF + j * larg_col for j in range(n_cols + 1)],
+        [topo - i * ALTURA_LINHA_PDF for i in range(len(linhas) + 2)],
+    )
+
+    texto = c.beginText(MARGEM_PDF, topo - ALTURA_LINHA_PDF + 4)
+    texto.setFont("Courier-Bold", TAMANHO_FONTE_TABELA, ALTURA_LINHA_PDF)
+    texto.textLine(cabecalho)
+    texto.setFont("Courier", TAMANHO_FONTE_TABELA, ALTURA_LINHA_PDF)
+    for linha in linhas:
+        texto.textLine(linha)
+    c.drawText(texto)
+
+    c.setFont("Helvetica", 7)
+    c.drawRightString(largura - MARGEM_PDF, MARGEM_PDF / 2, f"Página {pagina}")
+    c.showPage()
+
+def escrever_pdf_paginado(destino, titulo, resumo, secoes, observacoes=None, progresso=None):
+    # `secoes`: lista de (título, colunas, total de linhas, blocos), onde blocos(n)
+    # devolve um iterador de DataFrames de até n linhas. Só um lote de
+    # PAGINAS_POR_LOTE páginas fica em memória por vez; `progresso(pagina,
+    # total_paginas)` é chamado a cada página.
+    largura, altura = landscape(A4)
+    styles = getSampleStyleSheet()
+    c = canvas.Canvas(destino, pagesize=landscape(A4))
+
+    # Capa: o mesmo resumo do PDF simples
+    capa = [
+        Paragraph(f"<b>{titulo}</b>", styles["Title"]),
+        Spacer(1, 8),
+        Paragraph(f"Gerado em {datetime.now()}", styles["BodyText"]),
+        Spacer(1, 8),
+    ]
+    for k, v in resumo.items():
+        valor = f"{v:.2f}" if isinstance(v, float) else v
+        capa.append(Paragraph(f"<b>{k}:</b> {valor}", styles["BodyText"]))
+    if observacoes:
+        capa += [Spacer(1, 12), Paragraph(observacoes, styles["BodyText"])]
+
+    # Um resumo longo (muitos setores, observações) ocupa mais de uma página:
+    # a numeração das tabelas começa depois das páginas que a capa usou
+    pagina = 0
+    while capa:
+        quadro = Frame(MARGEM_PDF, MARGEM_PDF, largura - 2 * MARGEM_PDF, altura - 2 * MARGEM_PDF)
+        antes = len(capa)
+        quadro.addFromList(capa, c)
+        if capa:
+            # addFromList não quebra parágrafos: o que não coube vai quebrado no
+            # espaço que sobrou, e o resto segue para a próxima página
+            partes = quadro.split(capa[0], c)
+            if len(partes) > 1 and quadro.add(partes[0], c):
+                capa[:1] = partes[1:]
+            elif len(capa) == antes:
+                # Nem uma página vazia comporta o início dele: repetir não adianta
+                raise LayoutError(f"Conteúdo da capa maior que uma página: {capa[0].identity(80)}")
+        c.showPage()
+        pagina += 1
+    total_paginas = pagina + sum(math.ceil(total / LINHAS_POR_PAGINA) for _, _, total, _ in secoes)
+    if progresso:
+        progresso(pagina, total_paginas)
+
+    for titulo_secao, colunas, total, blocos in secoes:
+        paginas_secao = math.ceil(total / LINHAS_POR_PAGINA)
+        n = 0
+        for lote in blocos(LINHAS_POR_PAGINA * PAGINAS_POR_LOTE):
+            cabecalho, n_cols, linhas = _formatar_bloco(lote, colunas)
+            for inicio in range(0, len(linhas), LINHAS_POR_PAGINA):
+                n += 1
+                pagina += 1
+                _pagina_tabela(
+                    c, f"{titulo_secao} ({total}) - {n}/{paginas_secao}",
+                    cabecalho, n_cols, linhas[inicio:inicio + LINHAS_POR_PAGINA], pagina,
+                )
+                if progresso:
+                    progresso(pagina, total_paginas)
+
+    c.save()
+
+def blocos_dataframe(df):
+    # Adapta um DataFrame já pronto ao formato de `secoes` de escrever_pdf_paginado
+    def blocos(n):
+        for inicio in range(0, len(df), n):
+            yield df.iloc[inicio:inicio + n]
+    return blocos
+
+def gerar_pdf_detalhado(results, progresso=None):
+    secoes = [
+        (titulo, colunas, results.contagem(chave),
+         lambda n, chave=chave: results.blocos(chave, n))
+        for chave, titulo, colunas in SECOES_PDF
+        if results.contagem(chave) > 0
+    ]
+    buf = BytesIO()
+    with etapa("PDF detalhado", sum(total for _, _, total, _ in secoes)):
+        escrever_pdf_paginado(buf, "Relatório de Auditoria", results["resumo"], secoes, progresso=progresso)
+    buf.seek(0)
+    return buf
+
+GERADORES = {"excel": gerar_excel, "pdf": gerar_pdf, "pdf_detalhado": gerar_pdf_detalhado}
+
+# -------------------------------------------------------------------------
+# GERAÇÃO SOB DEMANDA (memoizada por resultado)
+# -------------------------------------------------------------------------
+def preparar_relatorio(results, tipo):
+    # Inicia (ou reaproveita) a geração em segundo plano e devolve o Future com os bytes
+    chave = (results.chave, tipo)
+    with _memo_lock:
+        futuro = _memo.get(chave)
+        if futuro is None or (futuro.done() and futuro.exception() is not None):
+            # O contexto vai junto para as etapas entrarem no perfil ativo (instrumentacao)
+            contexto = contextvars.copy_context()
+            futuro = _executor.submit(contexto.run, lambda: GERADORES[tipo](results).getvalue())
+            _memo[chave] = futuro
+        _memo.move_to_end(chave)
+        while len(_memo) > MEMO_MAX_ITENS:
+            _memo.popitem(last=False)
+    return futuro
+
+def relatorio_pronto(results, tipo):
+    # Bytes do relatório se já estiver pronto; None se nunca foi pedido ou ainda está sendo gerado
+    with _memo_lock:
+        futuro = _memo.get((results.chave, tipo))
+    if futuro is None or not futuro.done() or futuro.exception() is not None:
+        return None
+    return futuro.result()
+
+def obter_relatorio(results, tipo):
+    return preparar_relatorio(results, tipo).result()
@@ -0,0 +1,90 @@
+import time
+import threading
+import contextvars
+import importlib.util
+
+from ingestao import carregar_planilha
+from auditoria import ETAPAS_ANALISE, analisar_setores
+from instrumentacao import etapa, perfilar
+
+# -------------------------------------------------------------------------
+# CONFIGURAÇÃO
+# -------------------------------------------------------------------------
+ETAPA_LEITURA = "Carregando planilhas"
+ETAPAS = [ETAPA_LEITURA] + ETAPAS_ANALISE
+
+# O modo fora da memória grava as partições e os achados em Parquet: só existe
+# com o pyarrow instalado, e particionado só é importado quando é usado
+FORA_DA_MEMORIA_DISPONIVEL = importlib.util.find_spec("pyarrow") is not None
+
+class AnaliseCancelada(Exception):
+    pass
+
+# -------------------------------------------------------------------------
+# ANÁLISE EM SEGUNDO PLANO
+# -------------------------------------------------------------------------
+class TarefaAnalise:
+    # Uma análise rodando em um pool compartilhado. Quem acompanha só lê
+    # `etapa` e `fracao`; o cancelamento vale a partir da próxima etapa.
+    # Com `perfil` (instrumentacao.Perfil), as etapas são medidas nele.
+    def __init__(self, pool, pool_leitura, fonte_a, fonte_b, estado=None, historico=None,
+                 fora_da_memoria=False, perfil=None):
+        # `pool_leitura` lê A e B ao mesmo tempo; precisa ser outro pool, senão
+        # as leituras podem ficar na fila atrás das próprias análises que as esperam
+        self.etapa = "Na fila"
+        self.fracao = 0.0
+        self.estado = estado
+        self.perfil = perfil
+        self.inicio = time.monotonic()
+        self._pool_leitura = pool_leitura
+        self._cancelada = threading.Event()
+        self.futuro = pool.submit(
+            self._rodar, fonte_a, fonte_b, estado, historico, fora_da_memoria
+        )
+
+    def cancelar(self):
+        self._cancelada.set()
+        self.futuro.cancel()
+
+    @property
+    def cancelando(self):
+        return self._cancelada.is_set() and not self.futuro.done()
+
+    def _avancar(self, etapa, fracao=None):
+        if self._cancelada.is_set():
+            raise AnaliseCancelada()
+        self.etapa = etapa
+        self.fracao = ETAPAS.index(etapa) / len(ETAPAS) if fracao is None else fracao
+
+    def _rodar(self, *args):
+        if self.perfil is None:
+            return self._analisar(*args)
+        with perfilar(self.perfil):
+            return self._analisar(*args)
+
+    def _analisar(self, fonte_a, fonte_b, estado, historico, fora_da_memoria):
+        if fora_da_memoria:
+            from particionado import analisar_particionado
+
+            self._avancar("Espalhando as notas em partições", 0.0)
+            with etapa("Análise fora da memória"):
+                return analisar_particionado(
+                    fonte_a, fonte_b,
+                    progresso=lambda n, total: self._avancar(f"Partição {n} de {total} analisada", n / total),
+                )
+
+        self._avancar(ETAPA_LEITURA)
+        with etapa(ETAPA_LEITURA):
+            # Cada leitura leva uma cópia do contexto, para entrar no mesmo perfil
+            leituras = [
+                self._pool_leitura.submit(contextvars.copy_context().run, _ler, nome, fonte)
+                for nome, fonte in (("Leitura A", fonte_a), ("Leitura B", fonte_b))
+            ]
+            df_a, df_b = [leitura.result() for leitura in leituras]
+        return analisar_setores(df_a, df_b, estado, historico, progresso=self._avancar)
+
+def _ler(nome, fonte):
+    with etapa(nome) as e:
+        df = carregar_planilha(fonte)
+        e.linhas = len(df)
+    return df
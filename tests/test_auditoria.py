@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from auditoria import (
+    tipar_planilhas, reconciliar, sugerir_pares, referencias_litragem, referencias_planilhas,
+    litragens_atipicas,
+    ESCALA_MAD, ESCALA_DESVIO_MEDIO, SETOR_TODOS,
+)
+
+# -------------------------------------------------------------------------
+# PLANILHAS DE TESTE
+# -------------------------------------------------------------------------
+def planilha(notas, dias=None, tipos=None, valores=None, setores=None):
+    n = len(notas)
+    return pd.DataFrame({
+        "DATA": pd.Timestamp("2024-01-01") + pd.to_timedelta(dias if dias is not None else [0] * n, unit="D"),
+        "NOTA": pd.Series(notas, dtype=object),
+        "TIPO": tipos if tipos is not None else ["GASOLINA"] * n,
+        "VALOR": valores if valores is not None else [10.0] * n,
+        "SETOR": setores if setores is not None else ["SAUDE"] * n,
+    })
+
+def pares(df_a, df_b):
+    # Pares (linha de A, linha de B) da reconciliação; -1 = sem par
+    df_a, df_b = tipar_planilhas(df_a, df_b)
+    p = reconciliar(df_a, df_b)
+    return sorted(zip(p["a"].tolist(), p["b"].tolist()))
+
+def planilhas_aleatorias(semente, n):
+    # Poucas notas, dias e litragens distintos: muitas repetições e linhas sem nota
+    rng = np.random.default_rng(semente)
+
+    def gerar(m):
+        notas = rng.integers(0, max(n // 3, 1), m).astype(str).astype(object)
+        notas[rng.random(m) < 0.03] = None
+        return planilha(notas, rng.integers(0, 5, m), rng.choice(["GASOLINA", "DIESEL"], m),
+                        rng.choice([10.0, 20.0, 35.5], m))
+
+    return gerar(n), gerar(int(n * rng.uniform(0.5, 1.5)))
+
+# -------------------------------------------------------------------------
+# RECONCILIAÇÃO UM-PARA-UM
+# -------------------------------------------------------------------------
+def test_nota_repetida_nao_gera_produto_cartesiano():
+    a = planilha(["1", "1", "1"])
+    b = planilha(["1", "1"])
+    assert pares(a, b) == [(0, 0), (1, 1), (2, -1)]
+
+def test_rodada_exata_antes_das_menos_especificas():
+    # A linha de 15 litros de A fica com a de 15 de B, mesmo vindo depois;
+    # a de 10 só pareia com a de 11 na rodada sem a litragem
+    a = planilha(["1", "1"], valores=[10.0, 15.0])
+    b = planilha(["1", "1"], valores=[15.0, 11.0])
+    assert pares(a, b) == [(0, 1), (1, 0)]
+
+def test_rodadas_por_dia_tipo_e_nota():
+    a = planilha(["1", "1", "1"], dias=[0, 1, 2], tipos=["GASOLINA", "DIESEL", "ETANOL"],
+                 valores=[10.0, 30.0, 40.0])
+    b = planilha(["1", "1", "1"], dias=[9, 1, 0], tipos=["DIESEL", "ETANOL", "GASOLINA"],
+                 valores=[40.0, 31.0, 12.0])
+    # (0, 2): mesmo dia e tipo; (1, 1): mesmo dia; (2, 0): só a nota
+    assert pares(a, b) == [(0, 2), (1, 1), (2, 0)]
+
+def test_na_rodada_so_da_nota_pareia_por_dia():
+    a = planilha(["1", "1"], dias=[3, 1], tipos=["DIESEL", "DIESEL"])
+    b = planilha(["1", "1"], dias=[8, 6], tipos=["ETANOL", "ETANOL"])
+    assert pares(a, b) == [(0, 0), (1, 1)]
+
+def test_linhas_sem_nota_nunca_pareiam():
+    a = planilha([None, "1"])
+    b = planilha([None, "1"])
+    assert pares(a, b) == [(-1, 0), (0, -1), (1, 1)]
+
+@pytest.mark.parametrize("semente", range(5))
+def test_pareamento_um_para_um(semente):
+    # Cada linha aparece uma vez; cada nota forma min(linhas em A, linhas em B) pares
+    a, b = planilhas_aleatorias(semente, 300)
+    resultado = pares(a, b)
+    linhas_a = sorted(i for i, _ in resultado if i >= 0)
+    linhas_b = sorted(j for _, j in resultado if j >= 0)
+    assert linhas_a == list(range(len(a))) and linhas_b == list(range(len(b)))
+
+    casados = [(i, j) for i, j in resultado if i >= 0 and j >= 0]
+    assert all(a["NOTA"][i] == b["NOTA"][j] for i, j in casados)
+    por_nota = pd.Series([a["NOTA"][i] for i, _ in casados], dtype=object).value_counts()
+    esperado = pd.concat([a["NOTA"].value_counts(), b["NOTA"].value_counts()], axis=1).fillna(0).min(axis=1)
+    esperado = esperado[esperado > 0]
+    pd.testing.assert_series_equal(por_nota.sort_index(), esperado.astype(np.int64).sort_index(),
+                                   check_names=False)
+
+# -------------------------------------------------------------------------
+# SUGESTÕES DE PAREAMENTO
+# -------------------------------------------------------------------------
+def sugestoes(df_a, df_b):
+    df_a, df_b = tipar_planilhas(df_a, df_b)
+    return sugerir_pares(df_a, df_b, reconciliar(df_a, df_b))
+
+@pytest.mark.parametrize("dia_b, valor_b, sugerida", [
+    (0, 10.0, True),     # mesmo abastecimento
+    (1, 55.0, True),     # dia vizinho
+    (20, 10.0, True),    # mesma litragem
+    (20, 55.0, False),   # só tipo e setor batem
+])
+def test_nota_com_digito_trocado_precisa_de_data_ou_litragem(dia_b, valor_b, sugerida):
+    a = planilha(["12345"], dias=[0], valores=[10.0])
+    b = planilha(["12354"], dias=[dia_b], valores=[valor_b])
+    assert (len(sugestoes(a, b)) == 1) == sugerida
+
+def test_nota_sem_zeros_a_esquerda_basta():
+    a = planilha(["00777"], dias=[0], valores=[10.0], tipos=["DIESEL"], setores=["OBRAS"])
+    b = planilha(["777"], dias=[30], valores=[80.0])
+    assert sugestoes(a, b)["NOTA_B"].tolist() == ["0777"]
+
+# -------------------------------------------------------------------------
+# LITRAGENS ATÍPICAS (MEDIANA E MAD)
+# -------------------------------------------------------------------------
+def tipada(df):
+    return tipar_planilhas(df, df.iloc[:0])[0]
+
+def referencia(tabela, tipo, setor):
+    linha = tabela[(tabela["TIPO"] == tipo) & (tabela["SETOR"] == setor)]
+    assert len(linha) == 1
+    return linha.iloc[0]
+
+def test_mediana_e_mad_por_tipo_e_setor():
+    valores = [38.0, 40.0, 41.0, 42.0, 44.0, 45.0, 47.0, 50.0, 400.0]
+    df = tipada(planilha([str(i) for i in range(9)], valores=valores))
+    ref = referencia(referencias_litragem(df, "A"), "GASOLINA", "SAUDE")
+    mediana = np.median(valores)
+    assert ref["MEDIANA"] == mediana
+    assert ref["DESVIO"] == pytest.approx(ESCALA_MAD * np.median(np.abs(np.array(valores) - mediana)))
+    assert ref["LINHAS"] == 9
+
+def test_mad_zero_usa_desvio_medio():
+    valores = [40.0] * 6 + [41.0, 70.0]
+    df = tipada(planilha([str(i) for i in range(8)], valores=valores))
+    ref = referencia(referencias_litragem(df, "A"), "GASOLINA", "SAUDE")
+    assert ref["MEDIANA"] == 40.0
+    assert ref["DESVIO"] == pytest.approx(ESCALA_DESVIO_MEDIO * np.mean(np.abs(np.array(valores) - 40.0)))
+
+def test_referencia_ignora_caixa_e_litragens_invalidas():
+    df = tipada(planilha(
+        [str(i) for i in range(6)],
+        tipos=["gasolina", "GASOLINA", "Gasolina", None, "GASOLINA", "GASOLINA"],
+        valores=[10.0, 20.0, 30.0, 99.0, -5.0, np.nan],
+        setores=["saude", "SAUDE", "Saude", "SAUDE", "SAUDE", "SAUDE"],
+    ))
+    tabela = referencias_litragem(df, "A")
+    assert set(zip(tabela["TIPO"], tabela["SETOR"])) == {("GASOLINA", "SAUDE"), ("GASOLINA", SETOR_TODOS)}
+    assert referencia(tabela, "GASOLINA", "SAUDE")["LINHAS"] == 3
+
+def test_outlier_sinalizado_sem_deslocar_a_referencia():
+    rng = np.random.default_rng(0)
+    valores = np.round(rng.normal(40.0, 3.0, 30), 2)
+    com_outlier = np.append(valores, 400.0)
+    df = tipada(planilha([str(i) for i in range(len(com_outlier))], valores=com_outlier))
+    referencias = referencias_planilhas(df, df.iloc[:0])
+    assert litragens_atipicas(df, "A", referencias).tolist() == [len(valores)]
+    # Com a média, o abastecimento extremo puxaria a referência em ~12 litros
+    assert abs(referencia(referencias, "GASOLINA", "SAUDE")["MEDIANA"] - np.median(valores)) < 0.5
+
+def test_grupo_pequeno_usa_referencia_do_tipo():
+    # OBRAS tem só 3 linhas (< MINIMO_GRUPO): a de 400 é comparada a todas as de GASOLINA
+    valores = [38.0, 40.0, 41.0, 42.0, 44.0, 45.0, 47.0, 50.0, 39.0, 400.0, 43.0]
+    setores = ["SAUDE"] * 8 + ["OBRAS"] * 3
+    df = tipada(planilha([str(i) for i in range(11)], valores=valores, setores=setores))
+    referencias = referencias_planilhas(df, df.iloc[:0])
+    assert litragens_atipicas(df, "A", referencias).tolist() == [9]
+
+def test_sem_referencia_suficiente_nada_e_atipico():
+    df = tipada(planilha([str(i) for i in range(4)], valores=[10.0, 11.0, 12.0, 400.0]))
+    assert len(litragens_atipicas(df, "A", referencias_planilhas(df, df.iloc[:0]))) == 0
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from auditoria import analisar_setores, FONTES_REGRAS
+from dados_sinteticos import gerar_planilhas
+from incremental import EstadoAuditoria
+
+# -------------------------------------------------------------------------
+# ALTERAÇÕES ENTRE DUAS AUDITORIAS
+# -------------------------------------------------------------------------
+# Cada alteração recebe a planilha da auditoria anterior e devolve a nova;
+# notas repetidas (duplicadas, mesmo dia) fazem as regras por nota e o
+# pareamento das notas com mais de uma linha serem refeitos de verdade
+def acrescentar(df, rng):
+    novas = df.sample(40, random_state=rng).assign(NOTA=lambda d: d["NOTA"] + 10**6)
+    repetidas = df.sample(15, random_state=rng)
+    return pd.concat([df, novas, repetidas], ignore_index=True)
+
+def editar(df, rng):
+    df = df.copy()
+    linhas = rng.choice(len(df), 30, replace=False)
+    df.loc[linhas[:10], "VALOR"] += 5.0
+    df.loc[linhas[10:20], "DATA"] += pd.Timedelta(days=1)
+    df.loc[linhas[20:], "TIPO"] = "Etanol"
+    return df
+
+def remover(df, rng):
+    return df.drop(index=rng.choice(len(df), 30, replace=False)).reset_index(drop=True)
+
+def reordenar(df, rng):
+    return df.iloc[rng.permutation(len(df))].reset_index(drop=True)
+
+ALTERACOES = {
+    "acrescentadas": acrescentar,
+    "editadas": editar,
+    "removidas": remover,
+    "reordenadas": reordenar,
+}
+
+def assert_mesmos_achados(obtidos, esperados):
+    assert obtidos.resumo == esperados.resumo
+    assert obtidos.setores == esperados.setores
+    for chave in FONTES_REGRAS:
+        pd.testing.assert_frame_equal(obtidos.tabela(chave), esperados.tabela(chave), obj=chave)
+
+# -------------------------------------------------------------------------
+# REAUDITORIA INCREMENTAL = AUDITORIA COMPLETA
+# -------------------------------------------------------------------------
+@pytest.fixture
+def planilhas():
+    posto, pmm, _ = gerar_planilhas(2000, semente=3, variantes=False)
+    return posto, pmm
+
+def test_primeira_auditoria_igual_a_completa(tmp_path, planilhas):
+    posto, pmm = planilhas
+    estado = EstadoAuditoria(str(tmp_path))
+    assert_mesmos_achados(analisar_setores(posto, pmm, estado=estado), analisar_setores(posto, pmm))
+    assert estado.ultima["notas_refeitas"] == estado.ultima["notas"]
+
+@pytest.mark.parametrize("lado", ["a", "b", "ambos"])
+@pytest.mark.parametrize("alteracao", ALTERACOES)
+def test_reauditoria_igual_a_completa(tmp_path, planilhas, alteracao, lado):
+    posto, pmm = planilhas
+    estado = EstadoAuditoria(str(tmp_path))
+    analisar_setores(posto, pmm, estado=estado)
+
+    rng = np.random.default_rng(7)
+    if lado in ("a", "ambos"):
+        posto = ALTERACOES[alteracao](posto, rng)
+    if lado in ("b", "ambos"):
+        pmm = ALTERACOES[alteracao](pmm, rng)
+
+    assert_mesmos_achados(analisar_setores(posto, pmm, estado=estado), analisar_setores(posto, pmm))
+    if alteracao != "reordenadas":
+        # Só as notas alteradas são verificadas de novo
+        assert 0 < estado.ultima["notas_refeitas"] < estado.ultima["notas"]
+
+def test_reauditoria_sem_alteracao_nao_refaz_notas(tmp_path, planilhas):
+    posto, pmm = planilhas
+    estado = EstadoAuditoria(str(tmp_path))
+    analisar_setores(posto, pmm, estado=estado)
+    assert_mesmos_achados(analisar_setores(posto, pmm, estado=estado), analisar_setores(posto, pmm))
+    assert estado.ultima["notas_refeitas"] == 0
+
+def test_alteracoes_seguidas(tmp_path, planilhas):
+    # O estado gravado por uma reauditoria serve de base para a próxima
+    posto, pmm = planilhas
+    estado = EstadoAuditoria(str(tmp_path))
+    rng = np.random.default_rng(11)
+    for alterar in ALTERACOES.values():
+        posto, pmm = alterar(posto, rng), alterar(pmm, rng)
+        assert_mesmos_achados(analisar_setores(posto, pmm, estado=estado), analisar_setores(posto, pmm))
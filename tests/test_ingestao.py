@@ -0,0 +1,125 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("openpyxl")
+pytest.importorskip("pyarrow")
+
+import ingestao
+from ingestao import carregar_planilha, ler_planilha_em_blocos, COLUNA_PERIODO
+from dados_sinteticos import gerar_planilhas, gravar_xlsx, gravar_csv, gravar_parquet
+
+# -------------------------------------------------------------------------
+# PLANILHAS DE TESTE
+# -------------------------------------------------------------------------
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestao, "CACHE_DIR", str(tmp_path / "cache"))
+    ingestao.limpar_cache()
+    yield
+    ingestao.limpar_cache()
+
+@pytest.fixture
+def posto():
+    # Cabeçalhos com outros nomes e tipo/setor em outra caixa, como nos arquivos reais
+    return gerar_planilhas(800, semente=2)[0]
+
+def gravar_abas(abas, caminho):
+    # Uma aba por período, cada uma com seu cabeçalho, e uma aba de resumo sem dados
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for nome, df in abas.items():
+        ws = wb.create_sheet(nome)
+        ws.append(list(df.columns))
+        for linha in zip(*[df[c].astype(object).tolist() for c in df.columns]):
+            ws.append(linha)
+    ws = wb.create_sheet("Resumo")
+    ws.append(["Total de litros", 1234.5])
+    wb.save(caminho)
+
+GRAVADORES = {
+    "xlsx": lambda df, caminho: gravar_xlsx(df, caminho, "Relatório de abastecimentos"),
+    "csv": gravar_csv,
+    "parquet": gravar_parquet,
+}
+
+# -------------------------------------------------------------------------
+# MESMO CONTEÚDO EM QUALQUER FORMATO
+# -------------------------------------------------------------------------
+@pytest.mark.parametrize("formato", ["csv", "parquet"])
+def test_formatos_iguais_ao_xlsx(tmp_path, posto, formato):
+    GRAVADORES["xlsx"](posto, tmp_path / "posto.xlsx")
+    GRAVADORES[formato](posto, tmp_path / f"posto.{formato}")
+    esperado = carregar_planilha(str(tmp_path / "posto.xlsx"))
+    assert len(esperado) == len(posto)
+    pd.testing.assert_frame_equal(carregar_planilha(str(tmp_path / f"posto.{formato}")), esperado)
+
+@pytest.mark.parametrize("formato", list(GRAVADORES))
+def test_blocos_iguais_a_leitura_inteira(tmp_path, posto, formato):
+    caminho = str(tmp_path / f"posto.{formato}")
+    GRAVADORES[formato](posto, caminho)
+    # Sem o cache em disco (lendo o arquivo) e depois com ele (lendo o Parquet salvo)
+    sem_cache = pd.concat(list(ler_planilha_em_blocos(caminho, linhas=300)), ignore_index=True)
+    inteira = carregar_planilha(caminho)
+    com_cache = pd.concat(list(ler_planilha_em_blocos(caminho, linhas=300)), ignore_index=True)
+    pd.testing.assert_frame_equal(sem_cache, inteira)
+    pd.testing.assert_frame_equal(com_cache, inteira)
+
+def test_abas_por_periodo_sao_empilhadas(tmp_path, posto):
+    abas = {"Janeiro": posto.iloc[:300], "Fevereiro": posto.iloc[300:]}
+    gravar_abas(abas, tmp_path / "periodos.xlsx")
+    GRAVADORES["xlsx"](posto, tmp_path / "posto.xlsx")
+
+    lida = carregar_planilha(str(tmp_path / "periodos.xlsx"))
+    esperado = carregar_planilha(str(tmp_path / "posto.xlsx"))
+    assert lida[COLUNA_PERIODO].tolist() == ["Janeiro"] * 300 + ["Fevereiro"] * (len(posto) - 300)
+    pd.testing.assert_frame_equal(lida.drop(columns=[COLUNA_PERIODO]), esperado)
+
+    blocos = pd.concat(list(ler_planilha_em_blocos(str(tmp_path / "periodos.xlsx"), linhas=128)),
+                       ignore_index=True)
+    pd.testing.assert_frame_equal(blocos, lida)
+
+# -------------------------------------------------------------------------
+# LIMITES DO CACHE
+# -------------------------------------------------------------------------
+def gravar_varias(tmp_path, posto, n):
+    caminhos = []
+    for i in range(n):
+        caminho = str(tmp_path / f"posto{i}.parquet")
+        gravar_parquet(posto.assign(VALOR=posto.iloc[:, 3] + i), caminho)
+        caminhos.append(caminho)
+    return caminhos
+
+def test_cache_em_memoria_limitado_em_bytes(tmp_path, posto, monkeypatch):
+    caminhos = gravar_varias(tmp_path, posto, 3)
+    tamanho = carregar_planilha(caminhos[0]).memory_usage(index=True, deep=True).sum()
+    ingestao.limpar_cache()
+    # Cabem duas planilhas: a terceira expulsa a usada há mais tempo
+    monkeypatch.setattr(ingestao, "CACHE_MEMORIA_MB", 2.5 * tamanho / 1024 / 1024)
+    for caminho in caminhos[:2] + caminhos[:1] + caminhos[2:]:
+        carregar_planilha(caminho)
+    assert list(ingestao._cache) == [ingestao.hash_arquivo(c) for c in (caminhos[0], caminhos[2])]
+    assert ingestao._cache_bytes <= ingestao.CACHE_MEMORIA_MB * 1024 * 1024
+
+    # Uma planilha maior que o cache inteiro não é guardada
+    monkeypatch.setattr(ingestao, "CACHE_MEMORIA_MB", 0.5 * tamanho / 1024 / 1024)
+    ingestao.limpar_cache()
+    carregar_planilha(caminhos[1])
+    assert not ingestao._cache
+
+def test_cache_em_disco_limitado_apaga_o_usado_ha_mais_tempo(tmp_path, posto, monkeypatch):
+    caminhos = gravar_varias(tmp_path, posto, 3)
+    carregar_planilha(caminhos[0])
+    sidecar = ingestao._caminho_sidecar(ingestao.hash_arquivo(caminhos[0]))
+    monkeypatch.setattr(ingestao, "CACHE_DISCO_MB", 2.5 * os.path.getsize(sidecar) / 1024 / 1024)
+
+    for caminho in caminhos[1:2] + caminhos[:1] + caminhos[2:]:
+        ingestao.limpar_cache()
+        time.sleep(0.01)
+        carregar_planilha(caminho)
+    # posto0 foi relido do disco depois de posto1, então posto1 é o que sai
+    restantes = [c for c in caminhos if os.path.exists(ingestao._caminho_sidecar(ingestao.hash_arquivo(c)))]
+    assert restantes == [caminhos[0], caminhos[2]]
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import ingestao
+import particionado
+from auditoria import analisar_setores, referencias_litragem, FONTES_REGRAS
+from dados_sinteticos import gerar_arquivos
+
+# -------------------------------------------------------------------------
+# PLANILHAS DE TESTE
+# -------------------------------------------------------------------------
+@pytest.fixture(autouse=True)
+def pastas(tmp_path, monkeypatch):
+    monkeypatch.setattr(particionado, "PARTICOES_DIR", str(tmp_path / "particoes"))
+    monkeypatch.setattr(ingestao, "CACHE_DIR", str(tmp_path / "cache"))
+    ingestao.limpar_cache()
+
+@pytest.fixture(scope="module")
+def arquivos(tmp_path_factory):
+    (posto, pmm), _ = gerar_arquivos(6000, str(tmp_path_factory.mktemp("planilhas")), semente=5,
+                                     formato="parquet")
+    return posto, pmm
+
+def linhas(df):
+    # Multiconjunto das linhas: a ordem entre partições é outra e as colunas
+    # auxiliares DIA não vão para o disco
+    df = df[[c for c in df.columns if not c.startswith("DIA")]]
+    return sorted(map(str, df.astype(object).where(df.notna(), None).itertuples(index=False)))
+
+# -------------------------------------------------------------------------
+# PARTICIONADO = EM MEMÓRIA
+# -------------------------------------------------------------------------
+@pytest.mark.parametrize("memoria_mb", [1, 512])
+def test_mesmos_achados_que_em_memoria(arquivos, memoria_mb):
+    posto, pmm = arquivos
+    esperados = analisar_setores(ingestao.carregar_planilha(posto), ingestao.carregar_planilha(pmm))
+    obtidos = particionado.analisar_particionado(posto, pmm, memoria_mb=memoria_mb)
+
+    assert obtidos.setores == esperados.setores
+    for setor in ["Todos"] + esperados.setores:
+        e, o = esperados.fatiar(setor), obtidos.fatiar(setor)
+        assert o.resumo.keys() == e.resumo.keys()
+        for nome, valor in e.resumo.items():
+            assert o.resumo[nome] == pytest.approx(valor), (setor, nome)
+        for chave in FONTES_REGRAS:
+            if chave == "notas_outro_periodo":
+                continue
+            assert o.contagem(chave) == e.contagem(chave), (setor, chave)
+            assert linhas(o.tabela(chave)) == linhas(e.tabela(chave)), (setor, chave)
+
+def test_paginas_e_blocos(arquivos):
+    # Páginas em qualquer ordem e blocos de uma fatia batem com a tabela inteira
+    posto, pmm = arquivos
+    obtidos = particionado.analisar_particionado(posto, pmm, memoria_mb=1)
+    rng = np.random.default_rng(0)
+    for achados in [obtidos, obtidos.fatiar(obtidos.setores[0])]:
+        for chave in ["merged", "df_a", "valores_divergentes"]:
+            inteira = achados.tabela(chave, ["NOTA", "VALOR_A", "VALOR"])
+            posicoes = rng.permutation(len(inteira))[:300]
+            pagina = achados.tabela(chave, ["NOTA", "VALOR_A", "VALOR"], posicoes)
+            pd.testing.assert_frame_equal(pagina, inteira.iloc[posicoes].reset_index(drop=True))
+            blocos = pd.concat(list(achados.blocos(chave, 1000)), ignore_index=True)
+            pd.testing.assert_frame_equal(blocos, achados.tabela(chave))
+
+# -------------------------------------------------------------------------
+# REFERÊNCIAS DE LITRAGEM EM PASSADAS
+# -------------------------------------------------------------------------
+@pytest.mark.parametrize("memoria_mb", [512, 0.01, 1e-5])
+def test_referencias_iguais_as_em_memoria(tmp_path, memoria_mb):
+    # Empates, grupos com MAD zero, tipo e setor em outra caixa e sem setor;
+    # orçamentos mínimos forçam várias passadas de seleção
+    rng = np.random.default_rng(1)
+    n = 20_000
+    valor = np.where(rng.random(n) < 0.5, rng.integers(0, 20, n).astype(float), rng.lognormal(3, 1, n))
+    tipo = rng.choice(np.array(["gasolina", "Gasolina", "DIESEL", "etanol", None], dtype=object), n)
+    valor[tipo == "etanol"] = 7.0
+    valor[rng.random(n) < 0.05] = np.nan
+    df = pd.DataFrame({
+        "DATA": pd.Timestamp("2024-01-01"),
+        "NOTA": rng.integers(0, 5000, n).astype(str),
+        "TIPO": tipo,
+        "VALOR": valor,
+        "SETOR": rng.choice(np.array(["obras", "OBRAS", "saude", None], dtype=object), n),
+    })
+    particionado._espalhar(df, str(tmp_path), "a")
+
+    esperadas = referencias_litragem(df.astype({"TIPO": "category", "SETOR": "category"}), "A")
+    obtidas = particionado._referencias_baldes(str(tmp_path), "a", memoria_mb)
+    juntas = esperadas.merge(obtidas, on=["LADO", "TIPO", "SETOR"], how="outer", indicator=True)
+    assert (juntas["_merge"] == "both").all()
+    for coluna in ["MEDIANA", "DESVIO", "LINHAS"]:
+        np.testing.assert_allclose(juntas[f"{coluna}_y"].astype(float), juntas[f"{coluna}_x"].astype(float),
+                                   rtol=1e-12)
@@ -0,0 +1,36 @@
+import re
+from io import BytesIO
+
+import pandas as pd
+import pytest
+from reportlab.platypus import Spacer
+from reportlab.platypus.doctemplate import LayoutError
+
+import relatorios
+from relatorios import escrever_pdf_paginado, blocos_dataframe
+
+# -------------------------------------------------------------------------
+# CAPA DO PDF PAGINADO
+# -------------------------------------------------------------------------
+def paginas(pdf):
+    return len(re.findall(rb"/Type /Page\b", pdf))
+
+def test_observacoes_longas_ocupam_varias_paginas():
+    destino, chamadas = BytesIO(), []
+    tabela = pd.DataFrame({"NOTA": range(10)})
+    escrever_pdf_paginado(
+        destino, "Auditoria", {"Notas": 10}, [("Notas", ["NOTA"], 10, blocos_dataframe(tabela))],
+        observacoes=" ".join(f"obs{i}" for i in range(20000)),
+        progresso=lambda pagina, total: chamadas.append((pagina, total)),
+    )
+    capa, total = chamadas[0]
+    assert capa > 1
+    assert total == capa + 1 == paginas(destino.getvalue())
+    assert chamadas[-1] == (total, total)
+
+def test_bloco_maior_que_uma_pagina_falha_em_vez_de_travar(monkeypatch):
+    paragrafo = relatorios.Paragraph
+    monkeypatch.setattr(relatorios, "Paragraph",
+                        lambda texto, estilo: Spacer(1, 5000) if texto == "GRANDE" else paragrafo(texto, estilo))
+    with pytest.raises(LayoutError):
+        escrever_pdf_paginado(BytesIO(), "Auditoria", {"Notas": 0}, [], observacoes="GRANDE")